@@ -1,266 +1,169 @@
 import streamlit as st
 import streamlit.components.v1 as components
+import functools
 import json
-import os
-import gspread
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-import requests
-
-SAVE_PATH = "numbers_dict.json"
-DEFAULT_SPREADSHEET_NAME = "登分小工具 - 成績記錄"
-FIXED_SPREADSHEET_ID = "10vZcrrYPBPm4kAvsOoHusaAH8bCPKjvk4qjHjZNFNC8"
-
-# Initialize the number dictionary with all valid keys
-VALID_KEYS = [
-    1, 2, 5, 8, 10, 11, 12, 13, 14, 15, 17, 18, 19, 20,
-    23, 24, 25, 26, 27, 28, 30, 31, 32, 33, 34, 35, 36, 37, 38,
-    40, 41, 42, 43, 44, 45, 46, 47, 49, 50, 51, 52, 53,
-    55, 56, 57, 58, 59, 60, 61, 62, 63, 64
-]
-
-def load_dict():
-    """Load the dictionary from JSON file"""
-    if os.path.exists(SAVE_PATH):
-        try:
-            with open(SAVE_PATH, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            return {int(k): (int(v) if v is not None else None) for k, v in data.items()}
-        except Exception:
-            return None
-    return None
-
-def save_dict(numbers_dict):
-    """Save the dictionary to JSON file"""
-    try:
-        with open(SAVE_PATH, "w", encoding="utf-8") as f:
-            json.dump({str(k): v for k, v in numbers_dict.items()}, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception:
-        return False
-
-def initialize_dict():
-    """Initialize dictionary with all keys set to None"""
-    return {k: None for k in VALID_KEYS}
-
-def get_column_letter(col_index):
-    """Convert column index to column letter(s) (1->A, 27->AA, etc.)"""
-    result = ""
-    while col_index > 0:
-        col_index -= 1
-        result = chr(65 + (col_index % 26)) + result
-        col_index //= 26
-    return result
-
-def get_google_sheets_client():
-    """Get Google Sheets client using Replit connection, uploaded credentials, Streamlit Secrets, or local secrets.json"""
-    try:
-        hostname = os.environ.get('REPLIT_CONNECTORS_HOSTNAME')
-        x_replit_token = None
-        
-        repl_identity = os.environ.get('REPL_IDENTITY')
-        web_repl_renewal = os.environ.get('WEB_REPL_RENEWAL')
-        
-        # Try Replit connection first
-        if repl_identity:
-            x_replit_token = 'repl ' + repl_identity
-        elif web_repl_renewal:
-            x_replit_token = 'depl ' + web_repl_renewal
-        
-        if x_replit_token and hostname:
-            url = f'https://{hostname}/api/v2/connection?include_secrets=true&connector_names=google-sheet'
-            headers = {
-                'Accept': 'application/json',
-                'X_REPLIT_TOKEN': x_replit_token
-            }
-            
-            try:
-                response = requests.get(url, headers=headers, timeout=10)
-                if response.status_code == 200:
-                    data = response.json()
-                    items = data.get('items', [])
-                    
-                    if items:
-                        connection_settings = items[0]
-                        access_token = connection_settings.get('settings', {}).get('access_token')
-                        
-                        if not access_token:
-                            oauth_creds = connection_settings.get('settings', {}).get('oauth', {}).get('credentials', {})
-                            access_token = oauth_creds.get('access_token')
-                        
-                        if access_token:
-                            credentials = Credentials(token=access_token)
-                            client = gspread.authorize(credentials)
-                            return client, None
-            except Exception:
-                pass
-        
-        # Try uploaded credentials from session state
-        try:
-            if 'uploaded_credentials' in st.session_state and st.session_state.uploaded_credentials:
-                creds_dict = st.session_state.uploaded_credentials
-                
-                from google.oauth2.service_account import Credentials as ServiceAccountCredentials
-                scopes = [
-                    'https://www.googleapis.com/auth/spreadsheets',
-                    'https://www.googleapis.com/auth/drive'
-                ]
-                credentials = ServiceAccountCredentials.from_service_account_info(
-                    creds_dict,
-                    scopes=scopes
-                )
-                client = gspread.authorize(credentials)
-                return client, None
-        except Exception:
-            pass
-        
-        # Try Streamlit Secrets (for Streamlit Cloud)
-        try:
-            if 'google_sheets_credentials' in st.secrets:
-                import json as json_module
-                creds_dict = st.secrets['google_sheets_credentials']
-                if isinstance(creds_dict, str):
-                    creds_dict = json_module.loads(creds_dict)
-                
-                from google.oauth2.service_account import Credentials as ServiceAccountCredentials
-                scopes = [
-                    'https://www.googleapis.com/auth/spreadsheets',
-                    'https://www.googleapis.com/auth/drive'
-                ]
-                credentials = ServiceAccountCredentials.from_service_account_info(
-                    creds_dict,
-                    scopes=scopes
-                )
-                client = gspread.authorize(credentials)
-                return client, None
-        except Exception as secret_error:
-            pass
-        
-        # Try local secrets.json file
-        try:
-            secrets_path = os.path.join(os.path.dirname(__file__), 'secrets.json')
-            if os.path.exists(secrets_path):
-                with open(secrets_path, 'r', encoding='utf-8') as f:
-                    creds_dict = json.load(f)
-                
-                from google.oauth2.service_account import Credentials as ServiceAccountCredentials
-                scopes = [
-                    'https://www.googleapis.com/auth/spreadsheets',
-                    'https://www.googleapis.com/auth/drive'
-                ]
-                credentials = ServiceAccountCredentials.from_service_account_info(
-                    creds_dict,
-                    scopes=scopes
-                )
-                client = gspread.authorize(credentials)
-                return client, None
-        except Exception as file_error:
-            pass
-        
-        return None, "未找到Google Sheets認證信息。請上傳密鑰文件或在本地創建 secrets.json。"
-        
-    except Exception as e:
-        return None, f"連接Google Sheets時出錯: {str(e)}"
+import time
+import uuid
+
+from score_tool.export import (
+    CURRENT_TITLE,
+    MIME_TYPES,
+    archived_exams,
+    available_formats,
+    export_bytes,
+    export_filename,
+    iter_rows,
+    values_text,
+)
+from rapid_entry import new_entries, rapid_entry
+from score_tool.ingest import parse_bulk_codes, parse_code
+from score_tool.live import LIVE_REFRESH_INTERVAL, get_board
+from score_tool.metrics import (
+    METRICS_EXPORT_INTERVAL,
+    METRICS_EXPORT_PATH,
+    Metrics,
+    bind_session,
+    count,
+    export_metrics,
+    get_metrics,
+    observe,
+    timer,
+)
+from score_tool.ratelimit import get_rate_limiter
+from score_tool.rosters import DEFAULT_CLASS, get_class_ids, get_roster, initialize_dict
+from score_tool.sheets import (
+    get_client_pool,
+    get_upload_queue,
+    get_column_letter,
+    list_exam_columns,
+    load_exam_column,
+    open_upload_worksheet,
+    prewarm_imports,
+    service_account_identity,
+)
+from score_tool.sheet_cache import get_sheet_cache, pull_sheet
+from score_tool.stats import compare_exams, student_trends
+from score_tool.storage import StorageLoadError, get_storage
+from score_tool.sync import get_sync_state
+from score_tool.targets import get_upload_targets
 
-def upload_to_google_sheets(numbers_dict, column_title, spreadsheet_name, spreadsheet_id=None):
-    """Upload data to Google Sheets"""
-    try:
-        client, error = get_google_sheets_client()
-        if error:
-            return False, error
-        
-        spreadsheet_found = False
-        spreadsheet = None
-        
-        if spreadsheet_id and spreadsheet_id.strip():
-            try:
-                spreadsheet = client.open_by_key(spreadsheet_id.strip())
-                spreadsheet_found = True
-            except Exception as id_error:
-                return False, f"無法用ID打開試算表: {str(id_error)}"
-        else:
-            spreadsheet_name = spreadsheet_name.strip() if spreadsheet_name else DEFAULT_SPREADSHEET_NAME
-            
-            try:
-                spreadsheet = client.open(spreadsheet_name)
-                spreadsheet_found = True
-            except gspread.SpreadsheetNotFound:
-                spreadsheet_found = False
-            except Exception as open_error:
-                return False, f"查找試算表時出錯: {str(open_error)}"
-            
-            if not spreadsheet_found:
-                try:
-                    spreadsheet = client.create(spreadsheet_name)
-                except Exception as create_error:
-                    return False, f"創建試算表時出錯: {str(create_error)}"
-        
-        try:
-            worksheet = spreadsheet.sheet1
-        except Exception as ws_error:
-            return False, f"訪問工作表時出錯: {str(ws_error)}"
-        
-        all_values = worksheet.get_all_values()
-        
-        if not all_values or (len(all_values) == 1 and all_values[0] == []):
-            headers = ["座號"]
-            seat_numbers = [[key] for key in sorted(VALID_KEYS)]
-            
-            worksheet.update('A1', [headers])
-            worksheet.update('A2', seat_numbers)
-        
-        all_values = worksheet.get_all_values()
-        
-        # Search for the first empty column
-        empty_col_index = None
-        max_col_index = len(all_values[0]) if all_values and all_values[0] else 1
-        
-        for col_idx in range(1, max_col_index + 1):
-            # Check if this column is empty (all cells are empty or don't exist)
-            is_empty = True
-            for row_idx in range(1, len(all_values)):  # Skip header row
-                cell_value = ""
-                if col_idx <= len(all_values[row_idx]):
-                    cell_value = all_values[row_idx][col_idx - 1].strip()
-                
-                if cell_value:
-                    is_empty = False
-                    break
-            
-            if is_empty:
-                empty_col_index = col_idx
-                break
-        
-        # If no empty column found, append to the end
-        if empty_col_index is None:
-            empty_col_index = max_col_index + 1
-        
-        next_col_letter = get_column_letter(empty_col_index)
-        
-        worksheet.update(f'{next_col_letter}1', [[column_title]])
-        
-        score_data = []
-        for key in sorted(VALID_KEYS):
-            value = numbers_dict.get(key)
-            score_data.append([value if value is not None else ""])
-        
-        worksheet.update(f'{next_col_letter}2', score_data)
-        
-        msg = f"成功上傳到Google Sheets！\n試算表：{spreadsheet_name}\n列名：{column_title}"
-        return True, msg
-        
-    except Exception as e:
-        return False, f"上傳失敗: {str(e)}"
+UPLOAD_POLL_INTERVAL = 2
+
+rerun_started = time.perf_counter()
+
+SETUP_INSTRUCTIONS = """
+### 🔧 Streamlit Cloud上的Google Sheets設置說明
+
+此應用在Streamlit Cloud上需要Google服務帳戶認證才能訪問Google Sheets。
+
+**步驟1: 建立Google服務帳戶**
+1. 訪問 [Google Cloud Console](https://console.cloud.google.com/)
+2. 創建新項目或選擇現有項目
+3. 啟用 "Google Sheets API"
+4. 創建服務帳戶 (IAM & Admin → Service Accounts)
+5. 為服務帳戶創建JSON密鑰並下載
+
+**步驟2: 在Streamlit Cloud中設置密鑰**
+1. 在應用設置中選擇 "Secrets"
+2. 將下載的JSON內容粘貼到 `Secrets` 欄中
+3. 秘密名稱應為：`google_sheets_credentials`
+4. 值為完整的JSON內容（從下載的JSON文件複製）
+
+**步驟3: 在Google Sheets中授予權限**
+1. 打開要編輯的Google Sheet
+2. 點擊「共享」按鈕
+3. 將服務帳戶的電子郵件地址添加為編輯者
+   (電子郵件形式：xxx@xxx.iam.gserviceaccount.com)
+
+完成後刷新此頁面即可使用！
+"""
+
+def timed_fragment(fn, **kwargs):
+    """st.fragment whose runs are timed into the session's metrics as ui.<function name>"""
+    @functools.wraps(fn)
+    def run():
+        # Fragment reruns start in a fresh script thread, so the session is bound again
+        bind_session(st.session_state.metrics)
+        with timer(f"ui.{fn.__name__}"):
+            fn()
+    return st.fragment(run, **kwargs)
+
+def activate_class(class_id):
+    """Make a copy of the class's shared board the active numbers_dict; pull_live() keeps it current"""
+    version, numbers_dict = get_board(class_id).snapshot()
+    st.session_state.class_id = class_id
+    st.session_state.numbers_dict = numbers_dict
+    st.session_state.live_version = version
+    bump_version()
+
+def select_class():
+    """Class selector callback: the class is activated (and its load errors shown) by the script run that follows"""
+    st.session_state.class_id = st.session_state.class_select
+    st.session_state.pop("numbers_dict", None)
+
+def pull_live():
+    """Merge entries other devices made on the active class since this session last looked"""
+    board = get_board(st.session_state.class_id)
+    board.touch(st.session_state.session_id)
+    version, changed = board.changes_since(st.session_state.live_version)
+    if changed:
+        st.session_state.numbers_dict.update(changed)
+        bump_version()
+    st.session_state.live_version = version
+
+def bump_version():
+    """Mark the active dictionary as changed so cached HTML blocks are rebuilt"""
+    st.session_state.dict_version = st.session_state.get("dict_version", 0) + 1
+
+def cached_block(name, build):
+    """HTML block or other derived value cached in the session until the active class or its dictionary changes"""
+    key = (st.session_state.class_id, st.session_state.dict_version)
+    cache = st.session_state.setdefault("html_cache", {})
+    entry = cache.get(name)
+    if entry is None or entry[0] != key:
+        entry = cache[name] = (key, build())
+    return entry[1]
+
+def grid_html(numbers_dict, seats, cols_per_row=10):
+    """Quick-view grid as one HTML block"""
+    cells = "".join(
+        f"<div>{'🟢' if numbers_dict.get(key) is not None else '⚪'} {key:02d}</div>"
+        for key in seats
+    )
+    return (
+        f"<div style='display: grid; grid-template-columns: repeat({cols_per_row}, 1fr); "
+        f"gap: 0.5rem; text-align: center; font-size: 0.8em;'>{cells}</div>"
+    )
+
+def mapping_html(numbers_dict, seats, cols=4):
+    """Full seat -> score list as one HTML block"""
+    cells = "".join(
+        f"<div><b>{key:02d}</b> → "
+        + (f"<code>{numbers_dict[key]}</code>" if numbers_dict.get(key) is not None else "—")
+        + "</div>"
+        for key in seats
+    )
+    return f"<div style='display: grid; grid-template-columns: repeat({cols}, 1fr); gap: 0.25rem 1rem;'>{cells}</div>"
 
 # Initialize session state
+if "metrics" not in st.session_state:
+    st.session_state.metrics = Metrics()
+bind_session(st.session_state.metrics)
+
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex[:8]
+
+class_ids = get_class_ids()
+load_error = None
+if "class_id" not in st.session_state or st.session_state.class_id not in class_ids:
+    st.session_state.class_id = DEFAULT_CLASS if DEFAULT_CLASS in class_ids else class_ids[0]
 if "numbers_dict" not in st.session_state:
-    # Load from file if exists, otherwise initialize empty
-    loaded_dict = load_dict()
-    if loaded_dict is not None:
-        st.session_state.numbers_dict = loaded_dict
-    else:
-        st.session_state.numbers_dict = initialize_dict()
-        save_dict(st.session_state.numbers_dict)
+    # Shared with every other session on the class; loaded from storage by the first one
+    try:
+        activate_class(st.session_state.class_id)
+    except StorageLoadError as e:
+        # Nothing is written to a store that failed to load; the class opens once it reads again
+        load_error = e
 
 if "message" not in st.session_state:
     st.session_state.message = None
@@ -268,6 +171,10 @@ if "message_type" not in st.session_state:
     st.session_state.message_type = "info"
 if "show_upload_dialog" not in st.session_state:
     st.session_state.show_upload_dialog = False
+if "upload_jobs" not in st.session_state:
+    st.session_state.upload_jobs = []
+if "dict_version" not in st.session_state:
+    st.session_state.dict_version = 0
 
 # Page config
 st.set_page_config(page_title="登分小工具", layout="wide")
@@ -275,6 +182,19 @@ st.set_page_config(page_title="登分小工具", layout="wide")
 # Title
 st.title("登分小工具")
 
+if len(class_ids) > 1:
+    st.selectbox(
+        "班級",
+        class_ids,
+        key="class_select",
+        index=class_ids.index(st.session_state.class_id),
+        on_change=select_class
+    )
+
+if load_error is not None:
+    st.error(f"❌ 無法讀取 {st.session_state.class_id} 的成績，為避免覆蓋已儲存的資料暫不開啟：{load_error}")
+    st.stop()
+
 # Instructions
 with st.expander("📖 使用說明", expanded=False):
     st.markdown("""
@@ -283,163 +203,499 @@ with st.expander("📖 使用說明", expanded=False):
     - 例如：`1025` 表示10號25分
     - 例如：`45123` 表示將45號123分
     - 點擊「顯示所有對應」查看完整列表
-    - 點擊「複製所有值」將所有值複製到剪貼簿
+    - 在「複製 / 下載」中點擊右上角的複製圖示將所有值複製到剪貼簿，或下載 CSV / TSV / XLSX
     - 點擊「清空所有值」重置所有數據
     - 點擊enter會自動清空數據,紀錄後回到輸入框,不用一直點提交按鈕
     """)
 
-# Main input section
-st.subheader("輸入成績")
-
-with st.form(key="input_form", clear_on_submit=True):
-    col1, col2 = st.columns([3, 1])
+def entry_panel():
+    """Entry form, message, statistics and quick view; reruns on its own for each entry,
+    and every LIVE_REFRESH_INTERVAL seconds while other devices are on the same class"""
+    roster = get_roster(st.session_state.class_id)
+    board = get_board(st.session_state.class_id)
+    pull_live()
     
-    with col1:
-        user_input = st.text_input(
-            "輸入 4-5 位數字",
-            max_chars=5,
-            placeholder="例如：1025 或 45123"
-        )
+    st.subheader("輸入成績")
+    if st.toggle("逐筆送出（每筆等待伺服器回應）", key="classic_entry"):
+        classic_entry_form(board, roster)
+    else:
+        rapid_entry_box(board, roster)
+    
+    # Display message
+    if st.session_state.message:
+        if st.session_state.message_type == "success":
+            st.success(st.session_state.message)
+        elif st.session_state.message_type == "error":
+            st.error(st.session_state.message)
+        elif st.session_state.message_type == "warning":
+            st.warning(st.session_state.message)
+        else:
+            st.info(st.session_state.message)
+        st.session_state.message = None
+    
+    conflicts_panel(board)
+    
+    numbers_dict = st.session_state.numbers_dict
     
+    # Statistics are maintained by the board on every entry; nothing here scans the class
+    stats = board.statistics()
+    total_count = len(roster)
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("總人數", total_count)
     with col2:
-        st.write("")  # Spacing
-        submit_button = st.form_submit_button("提交", type="primary", use_container_width=True)
+        st.metric("已填寫", stats["count"])
+    with col3:
+        st.metric("未填寫", total_count - stats["count"])
+    
+    if stats["count"]:
+        statistics_panel(stats, history_comparison(st.session_state.class_id, numbers_dict, roster.seats))
+    
+    # Grid view
+    st.subheader("快速檢視")
+    st.caption("綠色表示已設定值，灰色表示未設定")
+    st.markdown(cached_block("grid", lambda: grid_html(numbers_dict, roster.seats)), unsafe_allow_html=True)
+    
+    # Display all mappings
+    if st.session_state.get("show_all"):
+        st.subheader("所有對應列表")
+        st.markdown(cached_block("mapping", lambda: mapping_html(numbers_dict, roster.seats)), unsafe_allow_html=True)
+    
+    with st.expander("📋 複製 / 下載"):
+        # st.code has its own copy button; the text is only rebuilt when the scores change
+        st.code(cached_block("values", lambda: values_text(numbers_dict, roster.seats)), language=None)
+        # The files are only built when a button is clicked, not on every entry rerun
+        formats = available_formats()
+        for col, fmt in zip(st.columns(len(formats)), formats):
+            col.download_button(
+                f"⬇️ {fmt.upper()}",
+                export_file(fmt, st.session_state.class_id, numbers_dict),
+                file_name=export_filename(fmt, [st.session_state.class_id]),
+                mime=MIME_TYPES[fmt],
+                on_click="ignore",
+                use_container_width=True
+            )
+
+def export_file(fmt, class_id, numbers_dict):
+    """Deferred download data: builds the class's export from a copy of its scores when called"""
+    scores = dict(numbers_dict)
+    return lambda: export_bytes(fmt, iter_rows([class_id], load_current=lambda class_id: scores))
+
+def format_score(value):
+    return "—" if value is None else f"{value:.1f}".removesuffix(".0")
+
+def history_comparison(class_id, numbers_dict, seats):
+    """Archived exams compared with the current scores; None when the class has no history"""
+    exams = archived_exams(class_id, True)
+    if not exams:
+        return None
+    # Archived scores never change, so they are read once per set of exams
+    key = (class_id, tuple(exam_id for exam_id, _ in exams))
+    history = st.session_state.setdefault("history_cache", {})
+    if key not in history:
+        history[key] = [(title, get_storage().exam_scores(exam_id)) for exam_id, title in exams]
+    return cached_block(
+        f"comparison_{key}", lambda: compare_exams(seats, history[key] + [(CURRENT_TITLE, numbers_dict)])
+    )
 
-# Process input
-if submit_button and user_input:
-    user_input = user_input.strip()
+def statistics_panel(stats, comparison):
+    """Mean, spread and distribution of the current scores, and how they compare with earlier exams"""
+    with st.expander("📊 成績統計"):
+        col1, col2, col3, col4, col5 = st.columns(5)
+        col1.metric("平均", format_score(stats["mean"]))
+        col2.metric("標準差", format_score(stats["std"]))
+        col3.metric("中位數", format_score(stats["median"]))
+        col4.metric("最高", format_score(stats["max"]))
+        col5.metric("最低", format_score(stats["min"]))
+        st.caption(f"第 25 百分位數 {format_score(stats['p25'])}，第 75 百分位數 {format_score(stats['p75'])}")
+        st.bar_chart(
+            {"分數": [label for label, _ in stats["histogram"]], "人數": [n for _, n in stats["histogram"]]},
+            x="分數",
+            y="人數",
+            height=200
+        )
+        
+        if comparison is None:
+            return
+        st.markdown("**與歷次考試比較**")
+        st.dataframe(
+            [
+                {
+                    "考試": exam["title"],
+                    "人數": exam["count"],
+                    "平均": format_score(exam["mean"]),
+                    "標準差": format_score(exam["std"]),
+                    "中位數": format_score(exam["median"]),
+                    "最高": format_score(exam["max"]),
+                    "最低": format_score(exam["min"]),
+                }
+                for exam in comparison["exams"]
+            ],
+            hide_index=True,
+            use_container_width=True
+        )
+        change = comparison["change"]
+        if change and change["seats"]:
+            correlation = "" if change["correlation"] is None else f"，相關係數 {change['correlation']:.2f}"
+            st.caption(
+                f"與「{change['previous_title']}」相比（{change['seats']} 人）：平均變化 {change['mean_delta']:+.1f}，"
+                f"進步 {change['improved']} 人、退步 {change['declined']} 人{correlation}"
+            )
+        if comparison["movers"]:
+            st.caption("變化最大：" + "、".join(
+                f"{seat:02d} 號 {format_score(before)} → {format_score(after)}"
+                for seat, before, after, delta in comparison["movers"]
+            ))
+
+def trends_panel():
+    """Per-student trends from the local copy of an upload target's sheet; only the download buttons reach Google"""
+    targets = get_upload_targets(st.session_state.class_id)
+    with st.expander("📈 歷次成績趨勢（Google Sheets）"):
+        if not targets:
+            st.caption(f"沒有符合 {st.session_state.class_id} 的上傳目標")
+            return
+        target = targets[0]
+        if len(targets) > 1:
+            target = st.selectbox("試算表", targets, format_func=lambda target: target.label, key="trend_target")
+        cache = get_sheet_cache(target.spreadsheet_id, target.worksheet)
+        
+        col1, col2 = st.columns(2)
+        pull = col1.button("⬇️ 下載新的考試", use_container_width=True)
+        pull_all = col2.button("🔁 重新下載全部", use_container_width=True, help="試算表中舊的欄位被修改過時使用")
+        if pull or pull_all:
+            with st.spinner("正在從 Google Sheets 下載..."):
+                success, message = pull_sheet(target, st.session_state.get('uploaded_credentials'), full=pull_all)
+            (st.success if success else st.error)(message)
+        
+        titles = cache.titles
+        if not titles:
+            st.caption("尚未下載。下載後，趨勢都從本機副本計算，不必再開啟 Google Sheets。")
+            return
+        st.caption(f"本機副本：{len(titles)} 次考試，更新於 {time.strftime('%Y-%m-%d %H:%M', time.localtime(cache.refreshed))}")
+        
+        sheet_seats = [int(seat) for seat in cache.seats()]
+        roster = get_roster(st.session_state.class_id)
+        # The sheet may hold more seats than this class; show the class's own when they overlap
+        rows = [i for i, seat in enumerate(sheet_seats) if seat in roster] or \
+            [i for i, seat in enumerate(sheet_seats) if seat >= 0]
+        trends = student_trends(cache.matrix()[:, rows])
+        st.dataframe(
+            [
+                {
+                    "座號": sheet_seats[row],
+                    "次數": int(trends["count"][i]),
+                    "平均": format_score(None if trends["count"][i] == 0 else float(trends["mean"][i])),
+                    "最近": format_score(None if trends["count"][i] == 0 else float(trends["last"][i])),
+                    "較前次": "" if trends["count"][i] < 2 else f"{trends['change'][i]:+.1f}",
+                    "每次變化": "" if trends["count"][i] < 2 else f"{trends['slope'][i]:+.2f}",
+                }
+                for i, row in enumerate(rows)
+            ],
+            hide_index=True,
+            use_container_width=True
+        )
+        
+        seat = st.selectbox("學生趨勢", [sheet_seats[row] for row in rows], format_func=lambda k: f"{k:02d} 號")
+        # Exam numbers keep the chart in sheet order
+        points = [(f"{i + 1:02d} {title}", value) for i, (title, value) in enumerate(cache.trend(seat)) if value is not None]
+        if points:
+            st.line_chart({"考試": [label for label, _ in points], "分數": [value for _, value in points]},
+                          x="考試", y="分數", height=220)
+
+def load_column_panel():
+    """Load an uploaded exam column back into the active class to correct it; only changed cells are written back"""
+    targets = get_upload_targets(st.session_state.class_id)
+    with st.expander("✏️ 修改已上傳的考試"):
+        if not targets:
+            st.caption(f"沒有符合 {st.session_state.class_id} 的上傳目標")
+            return
+        target = targets[0]
+        if len(targets) > 1:
+            target = st.selectbox("試算表", targets, format_func=lambda target: target.label, key="load_target")
+        credentials = st.session_state.get('uploaded_credentials')
+        listed = st.session_state.setdefault("exam_columns", {})
+        target_key = (target.spreadsheet_id, target.worksheet)
+        
+        # Only the header row is read to list the exams
+        if st.button("📑 讀取考試列表", key="list_columns"):
+            worksheet, error = open_upload_worksheet(target.spreadsheet_id, target.worksheet, credentials)
+            if not error:
+                columns, error = list_exam_columns(worksheet)
+            if error:
+                st.error(error)
+            else:
+                listed[target_key] = columns
+        columns = listed.get(target_key)
+        if columns is None:
+            st.caption("先讀取考試列表（只讀取試算表的標題列）")
+            return
+        if not columns:
+            st.caption("試算表中還沒有考試")
+            return
+        
+        col_index, title = st.selectbox(
+            "考試",
+            list(reversed(columns)),
+            format_func=lambda column: f"{get_column_letter(column[0])} 欄 · {column[1]}",
+            key="load_column"
+        )
+        st.warning(f"載入後會取代 {st.session_state.class_id} 目前輸入的成績")
+        if not st.button(f"載入「{title}」", type="primary"):
+            return
+        # The worksheet opened for the listing is still cached, so this is a single read
+        worksheet, error = open_upload_worksheet(target.spreadsheet_id, target.worksheet, credentials)
+        if not error:
+            column, error = load_exam_column(worksheet, col_index, title)
+        if error:
+            st.error(error)
+            return
+        
+        class_id = st.session_state.class_id
+        roster = get_roster(class_id)
+        numbers_dict = {seat: column["values"].get(seat) for seat in roster.seats}
+        get_board(class_id).replace(numbers_dict, st.session_state.session_id)
+        activate_class(class_id)
+        # The loaded column becomes the class's uploaded exam: corrections go back as a delta sync of that column
+        get_sync_state().record_upload(
+            class_id, target.spreadsheet_id, col_index, title, column["seats"], numbers_dict, target.worksheet,
+            target.label
+        )
+        missing = len(roster.seat_set - set(column["seats"]))
+        notes = []
+        if column["skipped"]:
+            notes.append(f"{len(column['skipped'])} 格不是整數分數，未載入")
+        if missing:
+            notes.append(f"{missing} 個座號不在試算表中，修改不會寫回")
+        st.session_state.message = (
+            f"✅ 已載入「{title}」{sum(v is not None for v in numbers_dict.values())} 筆成績；"
+            f"修改後在「上傳到Google Sheets」按「只同步修改」即寫回這一欄" + ("（" + "；".join(notes) + "）" if notes else "")
+        )
+        st.session_state.message_type = "warning" if notes else "success"
+        st.rerun()
+
+def classic_entry_form(board, roster):
+    """One code per submit; each Enter reruns the entry fragment on the server"""
+    with st.form(key="input_form", clear_on_submit=True):
+        col1, col2 = st.columns([3, 1])
+        
+        with col1:
+            user_input = st.text_input(
+                "輸入 4-5 位數字",
+                max_chars=5,
+                placeholder="例如：1025 或 45123"
+            )
+        
+        with col2:
+            st.write("")  # Spacing
+            submit_button = st.form_submit_button("提交", type="primary", use_container_width=True)
     
-    # Validate input
-    if not user_input.isdigit() or len(user_input) not in [4, 5]:
-        st.session_state.message = "❌ 格式不符"
-        st.session_state.message_type = "error"
-    else:
-        key = int(user_input[:2])
-        value = int(user_input[2:])
+    # Process input
+    if submit_button and user_input:
+        user_input = user_input.strip()
         
-        if key not in VALID_KEYS:
-            st.session_state.message = f"❌ 錯誤：座號 {key:02d} 不在系統中，請重新輸入"
+        # Validate input
+        parsed = parse_code(user_input)
+        if parsed is None:
+            st.session_state.message = "❌ 格式不符"
             st.session_state.message_type = "error"
         else:
-            st.session_state.numbers_dict[key] = value
-            save_dict(st.session_state.numbers_dict)
-            st.session_state.message = f"✅ 成功：座號 {key:02d} 已設定為 {value}"
-            st.session_state.message_type = "success"
-
-# Display message
-if st.session_state.message:
-    if st.session_state.message_type == "success":
-        st.success(st.session_state.message)
-    elif st.session_state.message_type == "error":
-        st.error(st.session_state.message)
-    else:
-        st.info(st.session_state.message)
-    st.session_state.message = None
-
-# Action buttons
-st.subheader("操作")
-col1, col2, col3, col4 = st.columns(4)
+            key, value = parsed
+            
+            if key not in roster.seat_set:
+                st.session_state.message = f"❌ 錯誤：座號 {key:02d} 不在系統中，請重新輸入"
+                st.session_state.message_type = "error"
+            else:
+                conflict = board.set(key, value, st.session_state.session_id, st.session_state.live_version)
+                pull_live()
+                if conflict:
+                    st.session_state.message = (
+                        f"⚠️ 座號 {key:02d} 剛被另一台裝置設為 {conflict['other_value']}，已改為 {value}，請在下方確認"
+                    )
+                    st.session_state.message_type = "warning"
+                else:
+                    st.session_state.message = f"✅ 成功：座號 {key:02d} 已設定為 {value}"
+                    st.session_state.message_type = "success"
+
+def rapid_entry_box(board, roster):
+    """Entry box that checks and buffers codes in the browser; each batch is applied once and acknowledged"""
+    component_key = f"rapid_entry_{st.session_state.class_id}"
+    acks = st.session_state.setdefault("rapid_acks", {})
+    # The batch that triggered this rerun is applied before rendering, so the box gets its ack right away
+    entries, ack = new_entries(st.session_state.get(component_key), acks)
+    if entries:
+        # Codes were checked in the browser; this only guards against a page with an outdated roster
+        valid = {seat: value for seat, value in entries if seat in roster.seat_set}
+        rejected = sorted({seat for seat, _ in entries if seat not in roster.seat_set})
+        conflicts = []
+        if valid:
+            with timer("entry.batch"):
+                conflicts = board.set_many(valid, st.session_state.session_id, st.session_state.live_version)
+            pull_live()
+        count("entry.codes", len(entries))
+        if conflicts:
+            seats = "、".join(f"{conflict['seat']:02d}" for conflict in conflicts)
+            st.session_state.message = f"⚠️ 座號 {seats} 剛被另一台裝置改過，已採用你的輸入，請在下方確認"
+            st.session_state.message_type = "warning"
+        elif rejected:
+            st.session_state.message = f"❌ 座號 {'、'.join(f'{seat:02d}' for seat in rejected)} 不在系統中，未儲存"
+            st.session_state.message_type = "error"
+    if ack is not None:
+        acks[ack["client"]] = ack["seq"]
+        st.session_state.rapid_ack = ack
+    
+    rapid_entry(
+        st.session_state.class_id,
+        roster.seats,
+        st.session_state.numbers_dict,
+        ack=st.session_state.get("rapid_ack"),
+        key=component_key
+    )
 
-with col1:
-    if st.button("📋 顯示所有對應", use_container_width=True):
-        st.session_state.show_all = True
+def conflicts_panel(board):
+    """Seats two devices entered different scores for; either device can pick the value to keep"""
+    conflicts = board.open_conflicts()
+    if not conflicts:
+        return
+    with st.expander(f"⚠️ 多台裝置輸入不一致（{len(conflicts)}）", expanded=True):
+        for conflict in conflicts:
+            key = conflict["seat"]
+            col1, col2, col3 = st.columns([2, 1, 1])
+            col1.markdown(f"座號 **{key:02d}**：{conflict['other_value']} → {conflict['value']}")
+            for col, value in ((col2, conflict["value"]), (col3, conflict["other_value"])):
+                if col.button(f"採用 {value}", key=f"resolve_{key}_{value}", use_container_width=True):
+                    board.resolve(key, value, st.session_state.session_id)
+                    pull_live()
+                    st.rerun(scope="fragment")
+
+def live_status():
+    """Shows who else is entering this class; a full rerun switches entry refreshing on or off"""
+    board = get_board(st.session_state.class_id)
+    board.touch(st.session_state.session_id)
+    peers = board.peers(st.session_state.session_id)
+    if peers:
+        st.caption(f"👥 另有 {peers} 台裝置正在輸入此班，成績會自動合併")
+    if bool(peers) != st.session_state.get("live_peers", False):
+        st.session_state.live_peers = bool(peers)
+        st.rerun()
 
-with col2:
-    values = ["" if st.session_state.numbers_dict[k] is None else str(st.session_state.numbers_dict[k]) 
-              for k in sorted(VALID_KEYS)]
-    
-    if all(v == "" for v in values):
-        st.button("📎 複製所有值", disabled=True, use_container_width=True)
-        if st.session_state.get("show_copy_warning"):
-            st.warning("⚠️ 沒有可複製的值")
-    else:
-        text = "\n".join(values)
-        # Escape special characters for JavaScript
-        text_escaped = text.replace('\\', '\\\\').replace('`', '\\`').replace('$', '\\$')
+def bulk_panel():
+    """Paste or upload many codes at once; valid ones are stored with a single write"""
+    with st.expander("📥 批次輸入（貼上或上傳檔案）"):
+        with st.form(key="bulk_form", clear_on_submit=True):
+            bulk_text = st.text_area(
+                "每行一個或多個代碼（以空白、逗號分隔），或 CSV 的「座號,成績」",
+                height=150,
+                placeholder="1025\n45123\n08,100"
+            )
+            bulk_file = st.file_uploader("或上傳 .txt / .csv 檔案", type=['txt', 'csv'])
+            overwrite = st.checkbox("覆寫已有的成績", value=True)
+            bulk_submit = st.form_submit_button("匯入", type="primary")
         
-        # Create a custom HTML button with direct clipboard access
-        copy_button_html = f"""
-        <div style="width: 100%;">
-            <button id="copyBtn" style="
-                width: 100%;
-                padding: 0.5rem 1rem;
-                background-color: #ff4b4b;
-                color: white;
-                border: none;
-                border-radius: 0.5rem;
-                font-size: 1rem;
-                cursor: pointer;
-                font-weight: 500;
-            ">📎 複製所有值</button>
-            <div id="copyStatus" style="margin-top: 0.5rem; font-size: 0.875rem;"></div>
-            <textarea id="fallbackText" style="
-                position: absolute;
-                left: -9999px;
-                width: 1px;
-                height: 1px;
-            ">{text_escaped}</textarea>
-        </div>
-        <script>
-            const btn = document.getElementById('copyBtn');
-            const status = document.getElementById('copyStatus');
-            const fallbackText = document.getElementById('fallbackText');
-            
-            btn.addEventListener('click', async function() {{
-                const text = `{text_escaped}`;
-                let success = false;
-                
-                // Method 1: Try modern Clipboard API
-                try {{
-                    await navigator.clipboard.writeText(text);
-                    success = true;
-                }} catch (err) {{
-                    // Method 2: Fallback to execCommand (works on mobile Safari)
-                    try {{
-                        fallbackText.value = text;
-                        fallbackText.select();
-                        fallbackText.setSelectionRange(0, 99999);
-                        success = document.execCommand('copy');
-                    }} catch (err2) {{
-                        success = false;
-                    }}
-                }}
-                
-                if (success) {{
-                    status.innerHTML = '<span style="color: #0e7c46;">✅ 值已複製到剪貼簿</span>';
-                    btn.style.backgroundColor = '#0e7c46';
-                    setTimeout(() => {{
-                        btn.style.backgroundColor = '#ff4b4b';
-                        status.innerHTML = '';
-                    }}, 2000);
-                }} else {{
-                    status.innerHTML = '<span style="color: #ff8c00;">⚠️ 複製失敗，請使用下方文字框手動複製</span>';
-                }}
-            }});
-        </script>
-        """
+        if not bulk_submit:
+            return
+        
+        text = bulk_text or ""
+        if bulk_file is not None:
+            text += "\n" + bulk_file.getvalue().decode("utf-8-sig", errors="replace")
         
-        components.html(copy_button_html, height=100)
+        roster = get_roster(st.session_state.class_id)
+        entries, issues, overwrites = parse_bulk_codes(text, roster.seat_set, st.session_state.numbers_dict)
+        if not overwrite:
+            for key in overwrites:
+                del entries[key]
         
-        # Always show the fallback text area for manual copy
-        with st.expander("📝 手動複製（如果上方按鈕無效）"):
-            st.text_area("所有值", value=text, height=200, label_visibility="collapsed")
-
-with col3:
-    if st.button("🗑️ 清空所有值", use_container_width=True):
-        st.session_state.numbers_dict = initialize_dict()
-        save_dict(st.session_state.numbers_dict)
-        st.success("✅ 所有值已清空")
+        conflicts = []
+        if entries:
+            board = get_board(st.session_state.class_id)
+            conflicts = board.set_many(entries, st.session_state.session_id, st.session_state.live_version)
+            pull_live()
+        
+        summary = f"✅ 已匯入 {len(entries)} 筆"
+        if overwrites:
+            summary += f"，{'已覆寫' if overwrite else '略過'} {len(overwrites)} 筆已有成績"
+        if issues:
+            summary += f"，{len(issues)} 個問題"
+        if conflicts:
+            summary += f"，{len(conflicts)} 筆與其他裝置的輸入不一致"
+        st.session_state.message = summary
+        st.session_state.message_type = "success" if entries else "error"
+        st.session_state.bulk_issues = issues
         st.rerun()
 
-with col4:
-    filled_count = sum(1 for v in st.session_state.numbers_dict.values() if v is not None)
-    if filled_count == 0:
-        st.button("📤 上傳到Google Sheets", disabled=True, use_container_width=True)
-    else:
+def bulk_issues_panel():
+    """Problems found in the last bulk import"""
+    issues = st.session_state.get("bulk_issues")
+    if not issues:
+        return
+    with st.expander(f"⚠️ 批次輸入的問題（{len(issues)}）", expanded=True):
+        st.dataframe(
+            [{"行": line_no, "內容": content, "原因": reason} for line_no, content, reason in issues],
+            hide_index=True,
+            use_container_width=True
+        )
+        if st.button("關閉"):
+            st.session_state.bulk_issues = None
+            st.rerun()
+
+def actions_panel():
+    """Action buttons; they do not depend on the dictionary, so entries never rerun them"""
+    st.subheader("操作")
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        if st.session_state.get("show_all"):
+            if st.button("🙈 隱藏列表", use_container_width=True):
+                st.session_state.show_all = False
+                st.rerun()
+        elif st.button("📋 顯示所有對應", use_container_width=True):
+            st.session_state.show_all = True
+            st.rerun()
+    
+    with col2:
+        with st.popover("📥 匯出多班 / 歷次成績", use_container_width=True):
+            export_panel()
+    
+    with col3:
+        if st.button("🗑️ 清空所有值", use_container_width=True):
+            get_board(st.session_state.class_id).replace(
+                initialize_dict(get_roster(st.session_state.class_id).seats), st.session_state.session_id
+            )
+            activate_class(st.session_state.class_id)
+            # A cleared dictionary starts a new exam; never sync it into the old column
+            get_sync_state().forget(st.session_state.class_id)
+            st.session_state.message = "✅ 所有值已清空"
+            st.session_state.message_type = "success"
+            st.rerun()
+    
+    with col4:
         if st.button("📤 上傳到Google Sheets", use_container_width=True):
-            st.session_state.show_upload_dialog = True
+            if any(v is not None for v in st.session_state.numbers_dict.values()):
+                st.session_state.show_upload_dialog = True
+                st.rerun()
+            else:
+                st.warning("⚠️ 沒有可上傳的值")
+
+def export_panel():
+    """Export of several classes and their archived exams side by side, built when asked for"""
+    class_ids = get_class_ids()
+    with st.form(key="export_form"):
+        selected = st.multiselect("班級", class_ids, default=[st.session_state.class_id])
+        include_history = st.checkbox("包含已上傳的歷次考試", value=True)
+        fmt = st.radio("格式", available_formats(), horizontal=True, format_func=str.upper)
+        build = st.form_submit_button("產生匯出檔", type="primary")
+    if build and selected:
+        # Current scores come from the shared boards, so entries from other devices are included
+        rows = iter_rows(selected, include_history, load_current=lambda class_id: get_board(class_id).snapshot()[1])
+        st.session_state.export_file = (
+            export_bytes(fmt, rows), export_filename(fmt, selected, include_history), MIME_TYPES[fmt]
+        )
+    if st.session_state.get("export_file"):
+        data, file_name, mime = st.session_state.export_file
+        st.download_button(f"⬇️ {file_name}", data, file_name=file_name, mime=mime, on_click="ignore")
 
-if st.session_state.show_upload_dialog:
+def upload_dialog():
+    """Credential upload and exam title form"""
     st.divider()
     st.subheader("上傳到Google Sheets")
     
@@ -455,6 +711,9 @@ if st.session_state.show_upload_dialog:
         try:
             file_content = json.loads(uploaded_file.getvalue().decode("utf-8"))
             if 'type' in file_content and file_content['type'] == 'service_account':
+                previous = st.session_state.get('uploaded_credentials')
+                if previous and service_account_identity(previous) != service_account_identity(file_content):
+                    get_client_pool().evict('uploaded', service_account_identity(previous))
                 st.session_state.uploaded_credentials = file_content
                 st.success("✅ 密鑰文件已上傳成功！")
             else:
@@ -467,12 +726,56 @@ if st.session_state.show_upload_dialog:
     
     st.divider()
     
+    # Corrections after an upload can be pushed into the same column of every target
+    sync_states = list(get_sync_state().for_class(st.session_state.class_id).values())
+    if sync_states:
+        dirty = get_sync_state().dirty_seats(st.session_state.class_id, st.session_state.numbers_dict)
+        title = sync_states[0]['title']
+        places = "、".join(
+            f"{state.get('target_name') or '成績記錄'} {get_column_letter(state['column'])} 欄" for state in sync_states
+        )
+        st.markdown(f"上次上傳：**{title}**（{places}）")
+        if dirty:
+            if st.button(f"🔄 只同步 {len(dirty)} 筆修改到「{title}」", type="primary"):
+                jobs = get_upload_queue().submit_sync(
+                    st.session_state.numbers_dict,
+                    st.session_state.class_id,
+                    st.session_state.get('uploaded_credentials')
+                )
+                for job in jobs:
+                    if job.id not in st.session_state.upload_jobs:
+                        st.session_state.upload_jobs.append(job.id)
+                st.session_state.message = f"🔄 已加入同步佇列：{len(dirty)} 筆修改"
+                st.session_state.message_type = "info"
+                st.session_state.show_upload_dialog = False
+                st.rerun()
+        else:
+            st.caption("沒有未同步的修改")
+        st.divider()
+    
+    targets = get_upload_targets(st.session_state.class_id)
+    if not targets:
+        st.warning(f"沒有符合 {st.session_state.class_id} 的上傳目標（請檢查 upload_targets.json 的 classes）")
+        if st.button("關閉", key="close_upload_dialog"):
+            st.session_state.show_upload_dialog = False
+            st.rerun()
+        return
+    limiter = get_rate_limiter()
+    wait = max((limiter.wait_estimate(spreadsheet_id=target.spreadsheet_id) for target in targets), default=0.0)
+    if wait >= 1:
+        st.caption(f"🚦 其他上傳正在使用 Google Sheets 配額，新的上傳預計排隊約 {wait:.0f} 秒")
+    
     with st.form(key="upload_form"):
         column_title = st.text_input(
             "列標題",
             placeholder="例如：第一次段考",
             help="這個標題將成為新增列的標題"
         )
+        # The exam goes to every selected target at the same time; each one reports on its own
+        labels = [target.label for target in targets]
+        selected = labels
+        if len(targets) > 1:
+            selected = st.multiselect("上傳目標", labels, default=labels)
         
         col_upload1, col_upload2 = st.columns([1, 1])
         with col_upload1:
@@ -480,134 +783,206 @@ if st.session_state.show_upload_dialog:
         with col_upload2:
             upload_cancel = st.form_submit_button("取消", use_container_width=True)
         
-        if upload_submit and column_title:
-            with st.spinner("正在上傳到Google Sheets..."):
-                success, message = upload_to_google_sheets(
-                    st.session_state.numbers_dict, 
-                    column_title, 
-                    "", 
-                    FIXED_SPREADSHEET_ID
-                )
-                
-                if success:
-                    st.success(message)
-                    st.session_state.show_upload_dialog = False
-                    st.rerun()
-                else:
-                    st.error(message)
-                    
-                    # Show setup instructions if running on Streamlit Cloud
-                    if "未找到Google Sheets認證" in message:
-                        st.info("""
-### 🔧 Streamlit Cloud上的Google Sheets設置說明
-
-此應用在Streamlit Cloud上需要Google服務帳戶認證才能訪問Google Sheets。
-
-**步驟1: 建立Google服務帳戶**
-1. 訪問 [Google Cloud Console](https://console.cloud.google.com/)
-2. 創建新項目或選擇現有項目
-3. 啟用 "Google Sheets API"
-4. 創建服務帳戶 (IAM & Admin → Service Accounts)
-5. 為服務帳戶創建JSON密鑰並下載
-
-**步驟2: 在Streamlit Cloud中設置密鑰**
-1. 在應用設置中選擇 "Secrets"
-2. 將下載的JSON內容粘貼到 `Secrets` 欄中
-3. 秘密名稱應為：`google_sheets_credentials`
-4. 值為完整的JSON內容（從下載的JSON文件複製）
-
-**步驟3: 在Google Sheets中授予權限**
-1. 打開要編輯的Google Sheet
-2. 點擊「共享」按鈕
-3. 將服務帳戶的電子郵件地址添加為編輯者
-   (電子郵件形式：xxx@xxx.iam.gserviceaccount.com)
-
-完成後刷新此頁面即可使用！
-                        """)
+        if upload_submit and column_title and selected:
+            jobs = get_upload_queue().submit_targets(
+                st.session_state.numbers_dict,
+                column_title,
+                [target for target in targets if target.label in selected],
+                st.session_state.get('uploaded_credentials'),
+                get_roster(st.session_state.class_id).seats,
+                st.session_state.class_id
+            )
+            for job in jobs:
+                if job.id not in st.session_state.upload_jobs:
+                    st.session_state.upload_jobs.append(job.id)
+            st.session_state.message = f"📤 已加入上傳佇列：{column_title}（{len(jobs)} 個目標）"
+            st.session_state.message_type = "info"
+            st.session_state.show_upload_dialog = False
+            st.rerun()
         elif upload_submit and not column_title:
             st.error("❌ 請輸入列標題")
+        elif upload_submit:
+            st.error("❌ 請至少選擇一個上傳目標")
         
         if upload_cancel:
             st.session_state.show_upload_dialog = False
             st.rerun()
 
-# Display all mappings in a table
-if "show_all" in st.session_state and st.session_state.show_all:
-    st.subheader("所有對應列表")
+def visible_upload_jobs():
+    """This session's uploads plus every upload still waiting in the outbox (e.g. from before a restart)"""
+    queue = get_upload_queue()
+    jobs = [job for job in map(queue.get, st.session_state.upload_jobs) if job is not None]
+    seen = {job.key for job in jobs}
+    return jobs + [job for job in queue.outbox_jobs() if job.key not in seen]
+
+def partial_failures(jobs):
+    """One line per finished multi-target upload where some targets succeeded and others failed"""
+    groups = {}
+    for job in jobs:
+        if job.group:
+            groups.setdefault(job.group, []).append(job)
+    summaries = []
+    for group in groups.values():
+        failed = [job.target_label for job in group if job.status == "failed"]
+        succeeded = sum(job.status == "success" for job in group)
+        if failed and succeeded and not any(job.active for job in group):
+            summaries.append(
+                f"⚠️ {group[0].column_title}：{succeeded}/{len(group)} 個目標已完成，"
+                f"{'、'.join(failed)} 失敗（可在下方重試）"
+            )
+    return summaries
+
+def render_upload_jobs():
+    """Status of this session's uploads and of the outbox; polled while any upload is still pending"""
+    queue = get_upload_queue()
+    jobs = visible_upload_jobs()
+    if not jobs:
+        return
     
-    # Create columns for better display
-    cols = st.columns(4)
-    sorted_keys = sorted(VALID_KEYS)
+    st.subheader("上傳狀態")
+    pending = [job for job in jobs if job.active]
+    failed = [job for job in jobs if job.status == "failed"]
+    if pending or failed:
+        st.caption(f"📮 待傳區：{len(pending)} 筆等待上傳、{len(failed)} 筆失敗（已存於本機，重新啟動後仍會繼續）")
+    limiter = get_rate_limiter()
+    wait = limiter.wait_estimate()
+    if limiter.waiting and pending:
+        st.info(f"🚦 已達 Google Sheets 每分鐘請求配額，{limiter.waiting} 個請求排隊中，預計約 {wait:.0f} 秒後繼續")
+    for summary in partial_failures(jobs):
+        st.warning(summary)
+    for job in reversed(jobs):
+        if job.status == "success":
+            st.success(f"✅ {job.column_title} → {job.target_label}：{job.message}")
+        elif job.status == "failed":
+            st.error(f"❌ {job.class_id} {job.column_title} → {job.target_label}：{job.message}")
+            if "未找到Google Sheets認證" in job.message:
+                st.info(SETUP_INSTRUCTIONS)
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("重試", key=f"retry_{job.id}"):
+                    queue.retry(job.id, st.session_state.get('uploaded_credentials'))
+                    if job.id not in st.session_state.upload_jobs:
+                        st.session_state.upload_jobs.append(job.id)
+                    st.rerun()
+            with col2:
+                if st.button("捨棄", key=f"discard_{job.id}"):
+                    queue.discard(job.id)
+                    st.rerun()
+        elif job.status == "retrying":
+            wait = max(0, int((job.next_retry or time.time()) - time.time()))
+            st.warning(
+                f"⏳ {job.column_title} → {job.target_label}：第 {job.attempts} 次嘗試失敗，{wait} 秒後重試（{job.message}）"
+            )
+            if st.button("捨棄", key=f"discard_{job.id}"):
+                queue.discard(job.id)
+                st.rerun()
+        else:
+            st.info(f"⏳ {job.column_title} → {job.target_label}：{'上傳中' if job.status == 'running' else '排隊中'}...")
     
-    for idx, key in enumerate(sorted_keys):
-        value = st.session_state.numbers_dict[key]
-        col_idx = idx % 4
+    col1, col2 = st.columns(2)
+    with col1:
+        if any(job.status == "retrying" for job in jobs) and st.button("🔄 立即重試"):
+            queue.retry_now()
+            st.rerun()
+    with col2:
+        if st.button("清除已完成的上傳紀錄"):
+            queue.release([job.id for job in jobs if job.status == "success"])
+            st.session_state.upload_jobs = [job.id for job in jobs if job.active]
+            st.rerun()
+
+def diagnostics_panel():
+    """Per-phase latency percentiles and API call counts; only shown with ?diagnostics=1 in the URL"""
+    with st.expander("🩺 診斷資訊", expanded=True):
+        scope = st.radio("範圍", ["本工作階段", "整個伺服器"], horizontal=True, key="diagnostics_scope")
+        metrics = st.session_state.metrics if scope == "本工作階段" else get_metrics()
+        snapshot = metrics.snapshot()
         
-        with cols[col_idx]:
-            if value is not None:
-                st.markdown(f"**{key:02d}** → `{value}`")
-            else:
-                st.markdown(f"**{key:02d}** → —")
-    
-    if st.button("隱藏列表"):
-        st.session_state.show_all = False
-        st.rerun()
+        phases = snapshot["phases"]
+        api_calls = sum(stats["count"] for phase, stats in phases.items() if phase.startswith("sheets_api."))
+        col1, col2, col3 = st.columns(3)
+        col1.metric("重新執行次數", phases.get("ui.rerun", {}).get("count", 0))
+        col2.metric("Sheets API 呼叫", api_calls)
+        col3.metric("API 錯誤", snapshot["counters"].get("sheets_api.errors", 0))
+        
+        if phases:
+            st.table([
+                {
+                    "階段": phase,
+                    "次數": stats["count"],
+                    "p50 (ms)": f"{stats['p50_ms']:.1f}",
+                    "p95 (ms)": f"{stats['p95_ms']:.1f}",
+                    "p99 (ms)": f"{stats['p99_ms']:.1f}",
+                    "最大 (ms)": f"{stats['max_ms']:.1f}",
+                }
+                for phase, stats in phases.items()
+            ])
+        else:
+            st.caption("尚無資料")
+        if snapshot["counters"]:
+            st.table([{"計數": name, "值": value} for name, value in snapshot["counters"].items()])
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(
+                "下載 Prometheus 格式",
+                metrics.to_prometheus(),
+                file_name="score_tool_metrics.prom",
+                mime="text/plain"
+            )
+        with col2:
+            if st.button("重設統計"):
+                metrics.reset()
+                st.rerun()
+        if METRICS_EXPORT_PATH:
+            st.caption(f"伺服器統計每 {METRICS_EXPORT_INTERVAL:.0f} 秒匯出至 `{METRICS_EXPORT_PATH}`")
+
+# Each section reruns independently; a full-app rerun only happens for class switches,
+# clearing, and opening/closing the upload dialog
+live_board = get_board(st.session_state.class_id)
+live_board.touch(st.session_state.session_id)
+st.session_state.live_peers = bool(live_board.peers(st.session_state.session_id))
+timed_fragment(live_status, run_every=LIVE_REFRESH_INTERVAL * 2)()
+timed_fragment(entry_panel, run_every=LIVE_REFRESH_INTERVAL if st.session_state.live_peers else None)()
+
+timed_fragment(bulk_panel)()
+bulk_issues_panel()
+
+timed_fragment(trends_panel)()
+timed_fragment(load_column_panel)()
 
-# Statistics
 st.divider()
-filled_count = sum(1 for v in st.session_state.numbers_dict.values() if v is not None)
-total_count = len(VALID_KEYS)
-
-col1, col2, col3 = st.columns(3)
-with col1:
-    st.metric("總人數", total_count)
-with col2:
-    st.metric("已填寫", filled_count)
-with col3:
-    st.metric("未填寫", total_count - filled_count)
-
-# Grid view
-st.subheader("快速檢視")
-st.caption("綠色表示已設定值，灰色表示未設定")
-
-# Create a grid layout
-cols_per_row = 10
-rows = []
-current_row = []
-
-for key in sorted(VALID_KEYS):
-    value = st.session_state.numbers_dict[key]
-    if value is not None:
-        current_row.append(f"🟢 {key:02d}")
-    else:
-        current_row.append(f"⚪ {key:02d}")
-    
-    if len(current_row) == cols_per_row:
-        rows.append(current_row)
-        current_row = []
-
-if current_row:
-    rows.append(current_row)
-
-for row in rows:
-    cols = st.columns(cols_per_row)
-    for idx, item in enumerate(row):
-        with cols[idx]:
-            st.markdown(f"<div style='text-align: center; font-size: 0.8em;'>{item}</div>", 
-                       unsafe_allow_html=True)
-
-# Auto-focus input field on page load
-components.html(
-    """
-    <script>
-        // Focus input field only once on page load
-        setTimeout(function() {
-            const inputs = window.parent.document.querySelectorAll('input[type="text"]');
-            if (inputs.length > 0) {
-                inputs[0].focus();
-            }
-        }, 100);
-    </script>
-    """,
-    height=0,
-)
+timed_fragment(actions_panel)()
+
+if st.session_state.show_upload_dialog:
+    timed_fragment(upload_dialog)()
+
+upload_jobs = visible_upload_jobs()
+if upload_jobs:
+    has_active = any(job.active for job in upload_jobs)
+    timed_fragment(render_upload_jobs, run_every=UPLOAD_POLL_INTERVAL if has_active else None)()
+
+# Auto-focus the form's input field on page load (the rapid entry box focuses itself)
+if st.session_state.get("classic_entry"):
+    components.html(
+        """
+        <script>
+            // Focus input field only once on page load
+            setTimeout(function() {
+                const inputs = window.parent.document.querySelectorAll('input[type="text"]');
+                if (inputs.length > 0) {
+                    inputs[0].focus();
+                }
+            }, 100);
+        </script>
+        """,
+        height=0,
+    )
+
+observe("ui.rerun", time.perf_counter() - rerun_started)
+export_metrics()
+
+# The page is on screen; load gspread and google-auth for the first upload in the background
+prewarm_imports()
+
+if st.query_params.get("diagnostics"):
+    diagnostics_panel()
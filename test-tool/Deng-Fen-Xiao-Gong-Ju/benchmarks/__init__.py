@@ -0,0 +1 @@
+"""Offline benchmarks for 登分小工具 (run with `python -m benchmarks.run`; `python -m benchmarks.loadtest` for concurrent sessions)"""
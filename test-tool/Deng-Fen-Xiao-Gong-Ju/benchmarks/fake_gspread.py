@@ -0,0 +1,253 @@
+"""In-process stand-in for the parts of gspread the app uses.
+
+FakeClient mimics gspread.Client / Spreadsheet / Worksheet closely enough for
+score_tool.sheets: every call that would be an HTTP request goes through
+`client.http_client.request(method, url)` like in gspread 6, so instrument_client()
+can wrap it. Requests are counted per kind, can be slowed down by a fixed latency,
+and fail with a 429 quota error when injected or when they exceed the quota.
+"""
+
+import json
+import re
+import threading
+import time
+from collections import deque
+
+import gspread
+import requests
+
+A1_CELL = re.compile(r"^([A-Z]+)?(\d+)?$")
+
+def parse_a1(label):
+    """'B3' -> (3, 2); missing row/column parts come back as None ('B' -> (None, 2), '3' -> (3, None))"""
+    match = A1_CELL.match(label.split("!")[-1].replace("$", ""))
+    letters, digits = match.groups()
+    col = None
+    if letters:
+        col = 0
+        for ch in letters:
+            col = col * 26 + ord(ch) - 64
+    return (int(digits) if digits else None), col
+
+def quota_error():
+    """A gspread APIError carrying an HTTP 429 response, as raised by the real client"""
+    response = requests.Response()
+    response.status_code = 429
+    response._content = json.dumps({
+        "error": {"code": 429, "message": "Quota exceeded (fake)", "status": "RESOURCE_EXHAUSTED"}
+    }).encode("utf-8")
+    return gspread.exceptions.APIError(response)
+
+class FakeWorksheet:
+    def __init__(self, client, spreadsheet, sheet_id, title, rows=1000, cols=26):
+        self.client = client
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id
+        self.title = title
+        self.row_count = rows
+        self.col_count = cols
+        self.cells = {}
+
+    # -- reads -------------------------------------------------------------
+
+    def _range(self, rng):
+        start, _, end = rng.partition(":")
+        r1, c1 = parse_a1(start)
+        r2, c2 = parse_a1(end) if end else (r1, c1)
+        r1, c1 = r1 or 1, c1 or 1
+        r2 = r2 or self.row_count
+        c2 = c2 or self.col_count
+        rows = []
+        for r in range(r1, r2 + 1):
+            row = [self.cells.get((r, c), "") for c in range(c1, c2 + 1)]
+            while row and row[-1] == "":
+                row.pop()
+            rows.append(row)
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def get(self, range_name=None, **kwargs):
+        self.client.request(self.spreadsheet.id, "values.get")
+        return self._range(range_name or f"A1:{gspread.utils.rowcol_to_a1(self.row_count, self.col_count)}")
+
+    def batch_get(self, ranges, **kwargs):
+        self.client.request(self.spreadsheet.id, "values.batchGet")
+        return [self._range(rng) for rng in ranges]
+
+    def row_values(self, row, **kwargs):
+        self.client.request(self.spreadsheet.id, "values.get")
+        rows = self._range(f"A{row}:{gspread.utils.rowcol_to_a1(row, self.col_count)}")
+        return rows[0] if rows else []
+
+    def col_values(self, col, **kwargs):
+        self.client.request(self.spreadsheet.id, "values.get")
+        letter = gspread.utils.rowcol_to_a1(1, col)[:-1]
+        return [row[0] if row else "" for row in self._range(f"{letter}1:{letter}{self.row_count}")]
+
+    def get_all_values(self, **kwargs):
+        self.client.request(self.spreadsheet.id, "values.get")
+        return self._range(f"A1:{gspread.utils.rowcol_to_a1(self.row_count, self.col_count)}")
+
+    def acell(self, label, **kwargs):
+        self.client.request(self.spreadsheet.id, "values.get")
+        rows = self._range(label)
+        value = rows[0][0] if rows and rows[0] else None
+        return gspread.cell.Cell(*parse_a1(label), value)
+
+    # -- writes ------------------------------------------------------------
+
+    def _write(self, rng, values):
+        row, col = parse_a1(rng.partition(":")[0])
+        for i, line in enumerate(values):
+            for j, value in enumerate(line):
+                if row + i > self.row_count or col + j > self.col_count:
+                    raise gspread.exceptions.GSpreadException(f"Range {rng} exceeds grid limits")
+                self.cells[(row + i, col + j)] = value
+
+    def update(self, range_name, values=None, **kwargs):
+        # Accept both the gspread 5 (range, values) and gspread 6 (values, range) orders
+        if not isinstance(range_name, str):
+            range_name, values = values, range_name
+        self.client.request(self.spreadsheet.id, "values.update")
+        self._write(range_name or "A1", values)
+
+    def batch_update(self, data, **kwargs):
+        self.client.request(self.spreadsheet.id, "values.batchUpdate")
+        for item in data:
+            self._write(item["range"], item["values"])
+
+    def resize(self, rows=None, cols=None):
+        self.client.request(self.spreadsheet.id, "spreadsheets.batchUpdate")
+        self.row_count = rows or self.row_count
+        self.col_count = cols or self.col_count
+
+    def add_cols(self, cols):
+        self.resize(cols=self.col_count + cols)
+
+class FakeSpreadsheet:
+    def __init__(self, client, spreadsheet_id, title):
+        self.client = client
+        self.id = spreadsheet_id
+        self.title = title
+        self._worksheets = [FakeWorksheet(client, self, 0, "工作表1")]
+
+    @property
+    def sheet1(self):
+        self.client.request(self.id, "spreadsheets.get")
+        return self._worksheets[0]
+
+    def worksheets(self):
+        self.client.request(self.id, "spreadsheets.get")
+        return list(self._worksheets)
+
+    def worksheet(self, title):
+        self.client.request(self.id, "spreadsheets.get")
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                return worksheet
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+    def add_worksheet(self, title, rows=1000, cols=26, **kwargs):
+        self.client.request(self.id, "spreadsheets.batchUpdate")
+        worksheet = FakeWorksheet(self.client, self, len(self._worksheets), title, rows, cols)
+        self._worksheets.append(worksheet)
+        return worksheet
+
+SHEETS_URL = "https://sheets.googleapis.com/v4/spreadsheets/"
+DRIVE_URL = "https://www.googleapis.com/drive/v3/files"
+
+# kind -> (HTTP method, URL suffix after the spreadsheet id), as sent by gspread
+REQUESTS = {
+    "spreadsheets.get": ("GET", ""),
+    "spreadsheets.batchUpdate": ("POST", ":batchUpdate"),
+    "values.get": ("GET", "/values/A1"),
+    "values.batchGet": ("GET", "/values:batchGet"),
+    "values.update": ("PUT", "/values/A1"),
+    "values.batchUpdate": ("POST", "/values:batchUpdate"),
+}
+
+class FakeHTTPClient:
+    """Plays the role of gspread's HTTPClient: latency, injected failures and the per-minute quota"""
+
+    def __init__(self, client):
+        self.client = client
+        self.auth = None
+
+    def request(self, method, endpoint, **kwargs):
+        client = self.client
+        with client.lock:
+            now = time.monotonic()
+            fail = client.quota_errors > 0 or (client.fail_every and client.total % client.fail_every == 0)
+            if client.quota_errors > 0:
+                client.quota_errors -= 1
+            if client.quota:
+                while client.sent and client.sent[0] <= now - client.quota_period:
+                    client.sent.popleft()
+                if len(client.sent) >= client.quota:
+                    fail = True
+                else:
+                    client.sent.append(now)
+        if client.latency:
+            time.sleep(client.latency)
+        if fail:
+            with client.lock:
+                client.counts["429"] = client.counts.get("429", 0) + 1
+            raise quota_error()
+
+class FakeClient:
+    """Fake gspread client.
+
+    latency: seconds slept per request; quota_errors: how many of the next requests
+    fail with 429; fail_every: additionally fail every n-th request (0 = never);
+    quota: requests accepted per quota_period seconds (a sliding window, like the
+    Sheets per-user quota); anything above is rejected with 429. None = unlimited.
+    """
+
+    def __init__(self, latency=0.0, quota_errors=0, fail_every=0, quota=None, quota_period=60.0):
+        self.latency = latency
+        self.quota_errors = quota_errors
+        self.fail_every = fail_every
+        self.quota = quota
+        self.quota_period = quota_period
+        self.sent = deque()
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.total = 0
+        self.spreadsheets = {}
+        self.http_client = FakeHTTPClient(self)
+
+    def request(self, spreadsheet_id, kind):
+        with self.lock:
+            self.total += 1
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+        if kind.startswith("drive."):
+            method, url = ("POST" if kind.endswith("create") else "GET"), DRIVE_URL
+        else:
+            method, suffix = REQUESTS[kind]
+            url = SHEETS_URL + spreadsheet_id + suffix
+        self.http_client.request(method, url)
+
+    def reset_counts(self):
+        with self.lock:
+            self.counts = {}
+            self.total = 0
+
+    def open_by_key(self, key):
+        self.request(key, "spreadsheets.get")
+        if key not in self.spreadsheets:
+            self.spreadsheets[key] = FakeSpreadsheet(self, key, key)
+        return self.spreadsheets[key]
+
+    def open(self, title):
+        self.request(None, "drive.files.list")
+        for spreadsheet in self.spreadsheets.values():
+            if spreadsheet.title == title:
+                return spreadsheet
+        raise gspread.SpreadsheetNotFound(title)
+
+    def create(self, title, **kwargs):
+        self.request(None, "drive.files.create")
+        spreadsheet = FakeSpreadsheet(self, f"fake-{len(self.spreadsheets) + 1}", title)
+        self.spreadsheets[spreadsheet.id] = spreadsheet
+        return spreadsheet
@@ -0,0 +1,524 @@
+"""Concurrent-session load test: python -m benchmarks.loadtest [--sessions N] [--rate R] [--duration S] ...
+
+Starts a local Streamlit server for app.py (through benchmarks/loadtest_app.py, which swaps
+Google Sheets for the fake gspread client and the rosters for generated ones) and connects N
+websocket clients to it, each speaking the same protobuf messages as a browser tab. Every
+client enters codes at a fixed rate through the rapid entry box (one fragment rerun per
+batch) or the classic form (one per code) and, like the browser, reruns the fragments the
+server asks to refresh (live status, entry panel while others are on the class).
+
+Reported as JSON: entry latency percentiles (time from sending a code until the rerun that
+saves it has finished), how far clients fell behind their schedule, achieved throughput,
+contention on the score store (time spent waiting for its lock, write and fsync timings, as
+measured inside the server) and the server's resident memory per session.
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(APP_DIR, "app.py")
+SERVER_SCRIPT = os.path.join(APP_DIR, "benchmarks", "loadtest_app.py")
+
+TOGGLE_LABEL = "逐筆送出（每筆等待伺服器回應）"
+CODE_LABEL = "輸入 4-5 位數字"
+SUBMIT_LABEL = "提交"
+
+def rss_kb():
+    """Resident set size of this process in KiB (peak RSS where /proc is not available)"""
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def write_rosters(root, classes, seats):
+    """K class rosters of `seats` seats each; returns their class ids"""
+    os.makedirs(root, exist_ok=True)
+    class_ids = [f"load{c + 1:02d}" for c in range(classes)]
+    for class_id in class_ids:
+        with open(os.path.join(root, f"{class_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(list(range(1, seats + 1)), f)
+    return class_ids
+
+# -- server side (runs inside `streamlit run benchmarks/loadtest_app.py`) -------
+
+@functools.lru_cache(maxsize=None)
+def install_stand_ins():
+    """Point the app at the generated rosters and the fake gspread client; returns the client"""
+    from score_tool import rosters, sheet_cache, sheets
+
+    from .fake_gspread import FakeClient
+
+    rosters.ROSTER_DIR = os.environ["SCORE_LOADTEST_ROSTERS"]
+    client = FakeClient(latency=float(os.environ.get("SCORE_LOADTEST_LATENCY", "0.02")))
+    fake_client = lambda uploaded_credentials=None: (client, None)
+    sheets.get_google_sheets_client = fake_client
+    sheet_cache.get_google_sheets_client = fake_client
+    return client
+
+@functools.lru_cache(maxsize=None)
+def app_code():
+    with open(APP_PATH, "r", encoding="utf-8") as f:
+        return compile(f.read(), APP_PATH, "exec")
+
+def upload_classes(client):
+    """Upload every class through the shared queue at once; returns [(seconds, succeeded)]"""
+    from score_tool.live import get_board
+    from score_tool.rosters import get_class_ids, get_roster
+    from score_tool.sheets import get_upload_queue
+    from score_tool.targets import get_upload_targets
+
+    queue = get_upload_queue()
+    results = []
+
+    def upload(class_id):
+        start = time.perf_counter()
+        jobs = queue.submit_targets(
+            get_board(class_id).snapshot()[1], f"load {class_id}", get_upload_targets(class_id),
+            seats=get_roster(class_id).seats, class_id=class_id
+        )
+        for job in jobs:
+            job.done.wait(120)
+        results.append((time.perf_counter() - start, all(job.status == "success" for job in jobs)))
+
+    threads = [threading.Thread(target=upload, args=(class_id,)) for class_id in get_class_ids()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def serve():
+    """One rerun of the served page: a control request from the harness, or app.py itself
+
+    ?loadtest=reset clears the server's metrics, ?loadtest=report writes them (with the
+    resident memory and every class board) to SCORE_LOADTEST_REPORT, ?loadtest=upload uploads
+    every class. ?class=ID opens the page on that class.
+    """
+    import streamlit as st
+
+    from score_tool.live import get_board
+    from score_tool.metrics import get_metrics
+    from score_tool.rosters import get_class_ids
+
+    client = install_stand_ins()
+    control = st.query_params.get("loadtest")
+    if control:
+        report = {}
+        if control == "reset":
+            get_metrics().reset()
+        elif control == "report":
+            report = {
+                "rss_kb": rss_kb(),
+                "metrics": get_metrics().snapshot(),
+                "boards": {class_id: get_board(class_id).snapshot()[1] for class_id in get_class_ids()},
+            }
+        elif control == "upload":
+            report = {"uploads": upload_classes(client), "requests": client.total}
+        with open(os.environ["SCORE_LOADTEST_REPORT"], "w", encoding="utf-8") as f:
+            json.dump(report, f)
+        st.stop()
+    if "class_id" not in st.session_state and st.query_params.get("class"):
+        st.session_state.class_id = st.query_params["class"]
+    exec(app_code(), {"__name__": "__main__", "__file__": APP_PATH})
+
+# -- client side -----------------------------------------------------------------
+
+class Session:
+    """One simulated browser tab connected to the server's websocket"""
+
+    def __init__(self, url, index, query="", args=None, seats=()):
+        self.url = url
+        self.index = index
+        self.query = query
+        self.args = args
+        # Tabs on the same class start at different seats, like several devices splitting a stack of papers
+        offset = index * len(seats) // max(1, args.sessions) if args else 0
+        self.seats = list(seats[offset:]) + list(seats[:offset])
+        self.ws = None
+        self.lock = None
+        self.widgets = {}
+        self.fragments = {}
+        self.auto_tasks = {}
+        self.classic = False
+        self.first_render = None
+        self.entry_latency = []
+        self.rerun_latency = []
+        self.lag = []
+        self.entered = 0
+        self.auto_reruns = 0
+        self.errors = []
+        self.final = {}
+
+    async def connect(self):
+        import websockets
+        self.ws = await websockets.connect(self.url, subprotocols=["streamlit"], max_size=None)
+        self.lock = asyncio.Lock()
+
+    async def close(self):
+        # Stop the auto-rerun timers before the socket goes, so none of them is left sending on it
+        tasks = list(self.auto_tasks.values())
+        self.auto_tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.ws is not None:
+            await self.ws.close()
+
+    def _on_delta(self, delta):
+        element = delta.new_element
+        kind = element.WhichOneof("type")
+        if kind == "exception":
+            self.errors.append(element.exception.message)
+            return
+        if kind == "component_instance" and element.component_instance.component_name.endswith("rapid_entry"):
+            name, widget_id = "rapid_entry", element.component_instance.id
+        elif kind in ("checkbox", "text_input", "button"):
+            name, widget_id = getattr(element, kind).label, getattr(element, kind).id
+        else:
+            return
+        self.widgets[name] = widget_id
+        self.fragments[name] = delta.fragment_id
+
+    def _schedule(self, auto_rerun):
+        # The browser reruns run_every fragments on its own timer; so does this tab
+        task = self.auto_tasks.get(auto_rerun.fragment_id)
+        if task is None or task.done():
+            self.auto_tasks[auto_rerun.fragment_id] = asyncio.ensure_future(
+                self._auto_rerun(auto_rerun.fragment_id, auto_rerun.interval)
+            )
+
+    async def _auto_rerun(self, fragment_id, interval):
+        from websockets.exceptions import ConnectionClosed
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.rerun(fragment_id=fragment_id, auto=True)
+            except ConnectionClosed:
+                return
+            self.auto_reruns += 1
+
+    def _widget_states(self, extra):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        states = []
+        if self.classic:
+            states.append(WidgetState(id=self.widgets[TOGGLE_LABEL], bool_value=True))
+        states.extend(extra)
+        return states
+
+    async def rerun(self, widgets=(), fragment_id=None, auto=False):
+        """Send one rerun request and read the server's messages until the run has finished"""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        async with self.lock:
+            msg = BackMsg()
+            state = msg.rerun_script
+            state.query_string = self.query
+            state.widget_states.widgets.extend(self._widget_states(widgets))
+            if fragment_id:
+                state.fragment_id = fragment_id
+            state.is_auto_rerun = auto
+            await self.ws.send(msg.SerializeToString())
+            while True:
+                reply = ForwardMsg()
+                reply.ParseFromString(await asyncio.wait_for(self.ws.recv(), self.args.timeout if self.args else 120))
+                kind = reply.WhichOneof("type")
+                if kind == "delta":
+                    self._on_delta(reply.delta)
+                elif kind == "auto_rerun":
+                    self._schedule(reply.auto_rerun)
+                elif kind == "stop_auto_rerun":
+                    for stopped in reply.stop_auto_rerun.fragment_ids:
+                        task = self.auto_tasks.pop(stopped, None)
+                        if task is not None:
+                            task.cancel()
+                elif kind == "script_finished":
+                    return
+
+    async def open(self):
+        """Load the page (and switch to the classic form in classic mode)"""
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        await self.connect()
+        start = time.perf_counter()
+        await self.rerun()
+        self.first_render = time.perf_counter() - start
+        if self.args.mode == "classic" and not self.errors:
+            await self.rerun([WidgetState(id=self.widgets[TOGGLE_LABEL], bool_value=True)],
+                             self.fragments[TOGGLE_LABEL])
+            self.classic = True
+
+    def codes(self, count):
+        # Two-digit scores, so every code typed into the classic form is a valid four-digit one
+        return [(self.seats[i % len(self.seats)], 10 + (self.index + i) % 90) for i in range(count)]
+
+    async def send(self, entries, first_seq):
+        """One rerun carrying `entries`, the way the browser sends them"""
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        if self.classic:
+            (seat, value), = entries
+            await self.rerun([
+                WidgetState(id=self.widgets[CODE_LABEL], string_value=f"{seat:02d}{value}"),
+                WidgetState(id=self.widgets[SUBMIT_LABEL], trigger_value=True),
+            ], self.fragments[SUBMIT_LABEL])
+        else:
+            batch = {
+                "client": f"load{self.index}",
+                "batch": first_seq,
+                "entries": [[first_seq + j, seat, value] for j, (seat, value) in enumerate(entries)],
+            }
+            await self.rerun([WidgetState(id=self.widgets["rapid_entry"], json_value=json.dumps(batch))],
+                             self.fragments["rapid_entry"])
+
+    async def run(self, started, count):
+        """Enter `count` codes at args.rate per second, counted from `started` (perf_counter)"""
+        batch = 1 if self.classic else self.args.batch
+        codes = self.codes(count)
+        for first in range(0, count, batch):
+            if self.errors:
+                break
+            entries = codes[first:first + batch]
+            # A batch leaves the browser once its last code has been typed
+            due = started + (first + len(entries) - 1) / self.args.rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.lag.append(max(0.0, -delay))
+            start = time.perf_counter()
+            await self.send(entries, first + 1)
+            elapsed = time.perf_counter() - start
+            self.rerun_latency.append(elapsed)
+            self.entry_latency.extend([elapsed] * len(entries))
+            self.entered += len(entries)
+            self.final.update(entries)
+
+class Server:
+    """`streamlit run benchmarks/loadtest_app.py` in a working directory of its own"""
+
+    def __init__(self, tmp, args):
+        self.tmp = tmp
+        self.report_path = os.path.join(tmp, "loadtest_report.json")
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        env = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join(filter(None, [APP_DIR, os.environ.get("PYTHONPATH")])),
+            SCORE_STORAGE=args.storage,
+            SCORE_PREWARM_IMPORTS="0",
+            SCORE_LOADTEST_ROSTERS=os.path.join(tmp, "rosters"),
+            SCORE_LOADTEST_LATENCY=str(args.latency),
+            SCORE_LOADTEST_REPORT=self.report_path,
+        )
+        self.log = open(os.path.join(tmp, "server.log"), "w", encoding="utf-8")
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", SERVER_SCRIPT,
+             "--server.headless", "true", "--server.address", "127.0.0.1", "--server.port", str(self.port),
+             "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"],
+            cwd=tmp, env=env, stdout=self.log, stderr=subprocess.STDOUT
+        )
+        self.url = f"ws://127.0.0.1:{self.port}/_stcore/stream"
+
+    def wait_ready(self, timeout=60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.proc.poll() is not None:
+                break
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{self.port}/_stcore/health", timeout=2):
+                    return True
+            except OSError:
+                time.sleep(0.2)
+        return False
+
+    async def control(self, action):
+        """Run a ?loadtest=action page in a throwaway session; returns what the server wrote"""
+        session = Session(self.url, -1, f"loadtest={action}")
+        await session.connect()
+        try:
+            await session.rerun()
+        finally:
+            await session.close()
+        with open(self.report_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def log_tail(self, lines=20):
+        self.log.flush()
+        with open(self.log.name, "r", encoding="utf-8", errors="replace") as f:
+            return "".join(f.readlines()[-lines:])
+
+    def stop(self):
+        self.proc.terminate()
+        try:
+            self.proc.wait(10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+        self.log.close()
+
+def lost_entries(sessions, boards):
+    """Seats whose last code from a tab is not on the board, counting only seats no other tab wrote
+
+    Tabs sharing a class may overwrite each other's seats, so those seats cannot be checked.
+    """
+    writers = {}
+    for session in sessions:
+        for seat in session.final:
+            writers.setdefault((session.query, seat), []).append(session)
+    lost = 0
+    for (query, seat), owners in writers.items():
+        board = boards.get(query.partition("=")[2], {})
+        if len(owners) == 1 and board.get(str(seat)) != owners[0].final[seat]:
+            lost += 1
+    return lost
+
+async def load_test(server, class_ids, args):
+    from .run import summarize
+
+    count = args.entries or max(1, int(args.rate * args.duration))
+    seats = list(range(1, args.seats + 1))
+    # Imports and module-level caches are paid for once per server, not per session
+    warmup = Session(server.url, -1, f"class={class_ids[0]}", args)
+    await warmup.open()
+    await warmup.close()
+    if warmup.errors:
+        return {"error": warmup.errors[0]}
+    baseline = await server.control("report")
+
+    sessions = [
+        Session(server.url, i, f"class={class_ids[i % len(class_ids)]}", args, seats)
+        for i in range(args.sessions)
+    ]
+    await asyncio.gather(*(session.open() for session in sessions))
+    idle = await server.control("report")
+    # Only the entry phase goes into the storage and rerun timings
+    await server.control("reset")
+    started = time.perf_counter()
+    await asyncio.gather(*(session.run(started, count) for session in sessions))
+    wall = time.perf_counter() - started
+    final = await server.control("report")
+    auto_reruns = sum(session.auto_reruns for session in sessions)
+    await asyncio.gather(*(session.close() for session in sessions))
+
+    entry_latency = [sample for session in sessions for sample in session.entry_latency]
+    rerun_latency = [sample for session in sessions for sample in session.rerun_latency]
+    lag = [sample for session in sessions for sample in session.lag]
+    entered = sum(session.entered for session in sessions)
+    phases = final["metrics"]["phases"]
+    results = {
+        "params": {
+            "sessions": args.sessions, "classes": args.classes, "seats": args.seats, "mode": args.mode,
+            "rate_per_session": args.rate, "codes_per_session": count,
+            "batch": args.batch if args.mode == "rapid" else 1,
+            "storage": args.storage, "latency_s": args.latency,
+        },
+        "first_render": summarize([session.first_render for session in sessions]),
+        "entry_latency": summarize(entry_latency) if entry_latency else None,
+        "rerun_latency": summarize(rerun_latency) if rerun_latency else None,
+        "schedule_lag": summarize(lag) if lag else None,
+        "throughput": {
+            "codes": entered,
+            "wall_s": wall,
+            "codes_per_s": entered / wall if wall else None,
+            "target_codes_per_s": args.rate * args.sessions,
+        },
+        "server": {
+            phase: phases[phase] for phase in phases
+            if phase.startswith(("storage.", "ui.")) or phase == "entry.batch"
+        },
+        "memory": {
+            "server_baseline_kb": baseline["rss_kb"],
+            "per_session_idle_kb": (idle["rss_kb"] - baseline["rss_kb"]) / len(sessions),
+            "per_session_after_entry_kb": (final["rss_kb"] - baseline["rss_kb"]) / len(sessions),
+        },
+        "auto_reruns": auto_reruns,
+        "lost_entries": lost_entries(sessions, final["boards"]),
+        "conflicts": final["metrics"]["counters"].get("live.conflicts", 0),
+        "errors": sorted({error for session in sessions for error in session.errors}),
+    }
+    if args.upload:
+        uploaded = await server.control("upload")
+        results["upload"] = dict(
+            summarize([elapsed for elapsed, _ in uploaded["uploads"]]),
+            failed=sum(not ok for _, ok in uploaded["uploads"]),
+            requests=uploaded["requests"],
+        )
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.loadtest", description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=8, help="simulated browser tabs")
+    parser.add_argument("--classes", type=int, default=2, help="class rosters the tabs are spread over")
+    parser.add_argument("--seats", type=int, default=40, help="seats per class roster")
+    parser.add_argument("--rate", type=float, default=2.0, help="codes per second entered in each tab")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of entry (ignored with --entries)")
+    parser.add_argument("--entries", type=int, help="codes per tab instead of --duration")
+    parser.add_argument("--mode", choices=("rapid", "classic"), default="rapid",
+                        help="rapid entry box (a rerun per batch) or the classic form (a rerun per code)")
+    parser.add_argument("--batch", type=int, default=10, help="codes per rapid entry batch")
+    parser.add_argument("--storage", choices=("journal", "sqlite"), default="journal", help="score store backend")
+    parser.add_argument("--upload", action="store_true", help="upload every class to the fake Sheets at the end")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake Sheets latency per request (seconds)")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for one rerun")
+    parser.add_argument("-o", "--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    try:
+        import websockets  # noqa: F401
+        import streamlit  # noqa: F401
+    except ImportError as e:
+        print(f"{e.name} is not installed", file=sys.stderr)
+        return 1
+
+    from .run import git_revision
+
+    with tempfile.TemporaryDirectory() as tmp:
+        class_ids = write_rosters(os.path.join(tmp, "rosters"), args.classes, args.seats)
+        server = Server(tmp, args)
+        try:
+            if not server.wait_ready():
+                print(server.log_tail(), file=sys.stderr)
+                return 1
+            results = asyncio.run(load_test(server, class_ids, args))
+        except Exception:
+            print(server.log_tail(), file=sys.stderr)
+            raise
+        finally:
+            server.stop()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0 if "error" not in results and not results["errors"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
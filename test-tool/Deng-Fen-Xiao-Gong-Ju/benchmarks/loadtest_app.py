@@ -0,0 +1,5 @@
+"""app.py as served to the tabs of `python -m benchmarks.loadtest` (which starts it; not meant to be run by hand)"""
+
+from benchmarks.loadtest import serve
+
+serve()
@@ -0,0 +1,725 @@
+"""Benchmark runner: python -m benchmarks.run [--quick] [--only NAME] [--output FILE]
+
+Covers code parsing/validation, the storage backends at several roster sizes, incremental
+statistics, concurrent entry on a shared class board, a full Streamlit rerun through
+streamlit.testing's AppTest, cold-start time to first render (Google stack imported eagerly
+vs. lazily), and uploads against the fake gspread client (request counts, injected latency
+and 429s, one exam fanned out to several targets), and reading past exams through the local
+columnar sheet cache vs. downloading the whole sheet, and loading one exam column back for
+editing with narrow range reads. Results are printed as JSON so runs from different versions can be compared offline.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from score_tool import sheets
+from score_tool.ingest import parse_bulk_codes, parse_code
+from score_tool.live import ClassBoard
+from score_tool.sheet_cache import SheetCache, parse_cell
+from score_tool.stats import ScoreStats, compare_exams, student_trends
+from score_tool.ratelimit import RateLimiter
+from score_tool.storage import EntryJournal, SQLiteStorage, read_journal
+from score_tool.sync import SyncStateStore
+from score_tool.targets import UploadTarget
+
+from .fake_gspread import FakeClient
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def summarize(samples):
+    """Latency summary in milliseconds"""
+    ordered = sorted(samples)
+    n = len(ordered)
+    pick = lambda q: ordered[min(n - 1, int(q * n))] * 1000
+    return {
+        "n": n,
+        "mean_ms": sum(ordered) / n * 1000,
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+def measure(fn, repeat):
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+def codes_for(seats, count):
+    return [f"{seats[i % len(seats)]:02d}{i % 100}" for i in range(count)]
+
+# -- parsing -------------------------------------------------------------------
+
+def bench_parse(quick):
+    seats = tuple(range(1, 100))
+    seat_set = frozenset(seats)
+    results = []
+    codes = codes_for(seats, 10000)
+    results.append(dict(
+        name="parse.single_code", params={"codes": len(codes)},
+        **measure(lambda i: [parse_code(code) for code in codes], 3 if quick else 10)
+    ))
+    for lines in (50, 1000) if quick else (50, 1000, 10000):
+        text = "\n".join(codes_for(seats, lines))
+        results.append(dict(
+            name="parse.bulk", params={"lines": lines},
+            **measure(lambda i: parse_bulk_codes(text, seat_set, {}), 3 if quick else 10)
+        ))
+    return results
+
+# -- storage -------------------------------------------------------------------
+
+def bench_storage(quick):
+    results = []
+    entries = 100 if quick else 500
+    for size in (50, 500) if quick else (50, 500, 5000):
+        numbers_dict = {k: (k % 100 if k % 3 else None) for k in range(1, size + 1)}
+        with tempfile.TemporaryDirectory() as tmp:
+            # Pre-journal behaviour: rewrite the whole file with indent=2 on every entry
+            legacy_path = os.path.join(tmp, "legacy.json")
+            def legacy_save(i):
+                numbers_dict[i % size + 1] = i
+                with open(legacy_path, "w", encoding="utf-8") as f:
+                    json.dump({str(k): v for k, v in numbers_dict.items()}, f, ensure_ascii=False, indent=2)
+            results.append(dict(name="storage.legacy_rewrite.entry", params={"seats": size}, **measure(legacy_save, entries)))
+            
+            snapshot = os.path.join(tmp, "numbers_dict.json")
+            journal = EntryJournal(snapshot, snapshot + ".log")
+            results.append(dict(
+                name="storage.journal.replace", params={"seats": size},
+                **measure(lambda i: journal.replace(numbers_dict), 5 if quick else 20)
+            ))
+            results.append(dict(
+                name="storage.journal.entry", params={"seats": size},
+                **measure(lambda i: journal.append(i % size + 1, i), entries)
+            ))
+            journal.sync()
+            results.append(dict(
+                name="storage.journal.load", params={"seats": size, "log_records": journal.log_records},
+                **measure(lambda i: EntryJournal(snapshot, snapshot + ".log").load(), 5 if quick else 20)
+            ))
+            
+            storage = SQLiteStorage(os.path.join(tmp, "scores.db"))
+            results.append(dict(
+                name="storage.sqlite.replace", params={"seats": size},
+                **measure(lambda i: storage.replace("bench", numbers_dict), 5 if quick else 20)
+            ))
+            results.append(dict(
+                name="storage.sqlite.entry", params={"seats": size},
+                **measure(lambda i: storage.append("bench", i % size + 1, i), entries)
+            ))
+            results.append(dict(
+                name="storage.sqlite.load", params={"seats": size},
+                **measure(lambda i: storage.load("bench"), 5 if quick else 20)
+            ))
+            storage.conn.close()
+    
+    # Clearing a seat (value None) has to leave both backends with the same scores
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = os.path.join(tmp, "numbers_dict.json")
+        journal = EntryJournal(snapshot, snapshot + ".log")
+        storage = SQLiteStorage(os.path.join(tmp, "scores.db"))
+        for write in (journal.append_many, lambda entries: storage.append_many("bench", entries)):
+            write([(1, 50), (2, 60), (3, 70)])
+            write([(1, None), (2, 65)])
+        journal.append(3, None)
+        storage.append("bench", 3, None)
+        cleared = {
+            "journal": {k: v for k, v in journal.load().items() if v is not None},
+            "sqlite": {k: v for k, v in storage.load("bench").items() if v is not None},
+        }
+        results.append({"name": "storage.clear_seat", "expected": {2: 65}, **cleared})
+        if any(scores != {2: 65} for scores in cleared.values()):
+            results[-1]["error"] = "a cleared seat is still stored"
+        storage.conn.close()
+    
+    # The app server and a CLI run appending to one journal at once, both compacting it
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = os.path.join(tmp, "numbers_dict.json")
+        journal = EntryJournal(snapshot, snapshot + ".log")
+        journal.replace({})
+        child = subprocess.Popen(
+            [sys.executable, "-c", JOURNAL_WRITER_SCRIPT, snapshot, "10000", "11200"],
+            env=dict(os.environ, PYTHONPATH=APP_DIR)
+        )
+        for key in range(1200):
+            journal.append(key, 1)
+        child.wait()
+        external = journal.external_changes()
+        journal.compact()
+        stored = read_journal(snapshot, snapshot + ".log") or {}
+        expected = set(range(1200)) | set(range(10000, 11200))
+        results.append({
+            "name": "storage.journal.processes", "entries": len(expected),
+            "lost": len(expected - set(stored)), "external": len(external),
+        })
+        if child.returncode or results[-1]["lost"] or not set(range(10000, 11200)) <= set(journal.load()):
+            results[-1]["error"] = "entries of one process were lost or not seen by the other"
+    return results
+
+JOURNAL_WRITER_SCRIPT = """
+import sys
+from score_tool.storage import EntryJournal
+journal = EntryJournal(sys.argv[1], sys.argv[1] + ".log")
+for key in range(int(sys.argv[2]), int(sys.argv[3])):
+    journal.append(key, 2)
+journal.sync()
+"""
+
+# -- statistics ----------------------------------------------------------------
+
+def bench_stats(quick):
+    """Incremental statistics per entry vs. recomputing them from the whole class, and cross-exam comparison"""
+    results = []
+    entries = 200 if quick else 2000
+    for size in (50, 500) if quick else (50, 500, 5000):
+        numbers_dict = {k: k % 101 if k % 4 else None for k in range(1, size + 1)}
+        stats = ScoreStats(numbers_dict.values())
+        def incremental(i):
+            key = i % size + 1
+            value = (i * 7) % 101
+            stats.update(numbers_dict[key], value)
+            numbers_dict[key] = value
+            stats.summary()
+        results.append(dict(name="stats.incremental", params={"seats": size}, **measure(incremental, entries)))
+        
+        def recompute(i):
+            key = i % size + 1
+            numbers_dict[key] = (i * 7) % 101
+            values = sorted(v for v in numbers_dict.values() if v is not None)
+            mean = sum(values) / len(values)
+            (sum((v - mean) ** 2 for v in values) / len(values)) ** 0.5
+            values[len(values) // 2]
+        results.append(dict(name="stats.full_recompute", params={"seats": size}, **measure(recompute, entries)))
+    
+    seats = tuple(range(1, 501))
+    compare_exams(seats, [])  # numpy is imported on first use; keep that out of the timings
+    for exams in (2, 10):
+        columns = [(f"exam {e}", {k: (k * (e + 3)) % 101 for k in seats if (k + e) % 9}) for e in range(exams)]
+        results.append(dict(
+            name="stats.compare_exams", params={"seats": len(seats), "exams": exams},
+            **measure(lambda i: compare_exams(seats, columns), 5 if quick else 20)
+        ))
+    return results
+
+# -- shared sessions -------------------------------------------------------------
+
+def bench_live(quick):
+    """Devices entering disjoint halves (or all) of one class's seats at the same time on a shared board"""
+    results = []
+    seats = tuple(range(1, 61))
+    rounds = 3 if quick else 10
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for devices, overlap in ((1, False), (2, False), (2, True), (4, False)):
+                board = ClassBoard(f"bench{devices}{int(overlap)}", dict.fromkeys(seats))
+                samples = []
+                conflicts = []
+                
+                def device(d):
+                    mine = seats if overlap else seats[d::devices]
+                    for r in range(rounds):
+                        # Each round stands for one refresh: devices write against the version they last pulled
+                        version = board.changes_since(0)[0]
+                        for key in mine:
+                            start = time.perf_counter()
+                            conflicts.extend(board.set_many({key: d * 100 + r}, f"device{d}", version))
+                            samples.append(time.perf_counter() - start)
+                
+                threads = [threading.Thread(target=device, args=(d,)) for d in range(devices)]
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.perf_counter() - start
+                results.append(dict(
+                    name="live.concurrent_entry",
+                    params={"devices": devices, "same_seats": overlap, "seats": len(seats), "rounds": rounds},
+                    entries_per_s=len(samples) / elapsed,
+                    conflicts=len(conflicts),
+                    **summarize(samples)
+                ))
+        finally:
+            os.chdir(cwd)
+    return results
+
+# -- streamlit rerun -----------------------------------------------------------
+
+def bench_apptest(quick):
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        return [{"name": "apptest", "skipped": "streamlit is not installed"}]
+    
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            at = AppTest.from_file(os.path.join(APP_DIR, "app.py"), default_timeout=60)
+            results.append(dict(name="apptest.first_run", params={}, **measure(lambda i: at.run(), 1)))
+            
+            # Rapid entry: the browser sends batches of codes; one rerun applies a whole batch
+            seats = (1, 2, 5, 8, 10, 11, 12)
+            batch_size = 10
+            batches = 5 if quick else 20
+            def send_batch(i):
+                entries = [[i * batch_size + j + 1, seats[j % len(seats)], (i + j) % 100] for j in range(batch_size)]
+                at.session_state["rapid_entry_default"] = {"client": "bench", "batch": i + 1, "entries": entries}
+                at.run()
+            results.append(dict(
+                name="apptest.rapid_batch_rerun", params={"batches": batches, "codes_per_batch": batch_size},
+                **measure(send_batch, batches)
+            ))
+            
+            # Classic form: one rerun per code
+            at.toggle[0].set_value(True)
+            at.run()
+            codes = codes_for(seats, 20 if quick else 100)
+            def enter(i):
+                at.text_input[0].input(codes[i])
+                next(button for button in at.button if button.label == "提交").click()
+                at.run()
+            results.append(dict(name="apptest.entry_rerun", params={"entries": len(codes)}, **measure(enter, len(codes))))
+            if at.exception:
+                results[-1]["error"] = str(at.exception[0].value)
+        finally:
+            os.chdir(cwd)
+    return results
+
+# -- cold start ----------------------------------------------------------------
+
+# Run in a fresh interpreter: import what app.py imports, then render the page once with AppTest.
+# "eager" first imports the Google stack the way sheets.py did at module level before it was made lazy.
+COLDSTART_SCRIPT = """
+import json, os, sys, time
+start = time.perf_counter()
+if sys.argv[1] == "eager":
+    import gspread, google.auth.exceptions, google.auth.transport.requests, google.oauth2.credentials, requests
+import streamlit, streamlit.components.v1
+import score_tool.ingest, score_tool.metrics, score_tool.ratelimit, score_tool.rosters
+import score_tool.sheets, score_tool.storage, score_tool.sync
+imported = time.perf_counter()
+result = {"import_ms": (imported - start) * 1000, "gspread_loaded": "gspread" in sys.modules}
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(os.path.join(sys.argv[2], "app.py"), default_timeout=60)
+at.run()
+result["first_render_ms"] = (time.perf_counter() - start) * 1000
+result["error"] = str(at.exception[0].value) if at.exception else None
+print(json.dumps(result))
+"""
+
+def bench_coldstart(quick):
+    """Time to first render of app.py in fresh processes, with the Google stack imported eagerly or lazily"""
+    results = []
+    env = dict(os.environ, PYTHONPATH=APP_DIR, SCORE_PREWARM_IMPORTS="0")
+    for mode in ("eager", "lazy"):
+        runs = []
+        for i in range(2 if quick else 5):
+            with tempfile.TemporaryDirectory() as tmp:
+                proc = subprocess.run(
+                    [sys.executable, "-c", COLDSTART_SCRIPT, mode, APP_DIR],
+                    cwd=tmp, env=env, capture_output=True, text=True, timeout=300
+                )
+            if proc.returncode != 0:
+                results.append({"name": "coldstart", "params": {"imports": mode},
+                                "skipped": proc.stderr.strip().splitlines()[-1]})
+                break
+            runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        else:
+            for phase in ("import", "first_render"):
+                results.append(dict(
+                    name=f"coldstart.{phase}", params={"imports": mode},
+                    **summarize([run[f"{phase}_ms"] / 1000 for run in runs])
+                ))
+            results[-1]["gspread_loaded_before_render"] = runs[0]["gspread_loaded"]
+            errors = [run["error"] for run in runs if run["error"]]
+            if errors:
+                results[-1]["error"] = errors[0]
+    return results
+
+# -- uploads -------------------------------------------------------------------
+
+def bench_upload(quick, latency):
+    results = []
+    seats = tuple(range(1, 61))
+    numbers_dict = {k: k for k in seats}
+    original_client = sheets.get_google_sheets_client
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for columns in (1, 100):
+                client = FakeClient(latency=latency)
+                sheets.get_google_sheets_client = lambda uploaded_credentials=None: (client, None)
+                worksheet = client.open_by_key("bench").sheet1
+                worksheet.resize(cols=columns + 30)
+                worksheet.batch_update([
+                    {"range": "A1", "values": [["座號"]] + [[k] for k in seats]},
+                    *({"range": f"{sheets.get_column_letter(c)}1", "values": [[f"exam {c}"]] + [[1]] * len(seats)}
+                      for c in range(2, columns + 1))
+                ])
+                client.reset_counts()
+                resume = {}
+                start = time.perf_counter()
+                success, message = sheets.upload_to_google_sheets(
+                    numbers_dict, "bench", "", "bench", resume=resume, seats=seats
+                )
+                results.append({
+                    "name": "upload.column",
+                    "params": {"existing_columns": columns, "latency_s": latency},
+                    "ms": (time.perf_counter() - start) * 1000,
+                    "requests": client.total,
+                    "request_counts": dict(client.counts),
+                    "success": success,
+                })
+            
+            # Delta sync of a few corrected seats into the column uploaded above
+            sync_state = SyncStateStore(os.path.join(tmp, "sync_state.json"))
+            sync_key = sync_state.record_upload("bench", "bench", resume["col_index"], "bench", seats, numbers_dict)
+            changed = dict(numbers_dict)
+            changed.update({1: 0, 2: 0, 3: 0})
+            client.reset_counts()
+            start = time.perf_counter()
+            success, message = sheets.sync_changes_to_google_sheets(changed, sync_state.get(sync_key))
+            results.append({
+                "name": "upload.delta_sync",
+                "params": {"changed_seats": 3, "latency_s": latency},
+                "ms": (time.perf_counter() - start) * 1000,
+                "requests": client.total,
+                "request_counts": dict(client.counts),
+                "success": success,
+            })
+            
+            # Queue with injected 429s: measures retries and end-to-end time
+            original_backoff = sheets.UPLOAD_BACKOFF_BASE
+            sheets.UPLOAD_BACKOFF_BASE = 0.01
+            try:
+                for quota_errors in (0, 2):
+                    client = FakeClient(latency=latency, quota_errors=quota_errors)
+                    sheets.get_google_sheets_client = lambda uploaded_credentials=None: (client, None)
+                    queue = sheets.UploadQueue(storage=NullStorage(), sync_state=sync_state)
+                    start = time.perf_counter()
+                    job = queue.submit(numbers_dict, f"queued {quota_errors}", "queue", seats=seats, class_id="bench")
+                    queue.wait([job])
+                    results.append({
+                        "name": "upload.queue",
+                        "params": {"injected_429": quota_errors, "latency_s": latency},
+                        "ms": (time.perf_counter() - start) * 1000,
+                        "attempts": job.attempts,
+                        "status": job.status,
+                        "requests": client.total,
+                        "request_counts": dict(client.counts),
+                    })
+                    queue.executor.shutdown()
+            finally:
+                sheets.UPLOAD_BACKOFF_BASE = original_backoff
+        finally:
+            sheets.get_google_sheets_client = original_client
+            os.chdir(cwd)
+    return results
+
+def bench_targets(quick, latency):
+    """One exam column queued for several targets (separate spreadsheets, one of them a named
+    worksheet), run one after another (a single worker) or side by side, then a delta sync to all"""
+    seats = tuple(range(1, 41))
+    numbers_dict = {k: k for k in seats}
+    targets = [
+        UploadTarget("homeroom", "bench-homeroom"),
+        UploadTarget("subject", "bench-subject", "國文"),
+        UploadTarget("archive", "bench-archive", "封存"),
+    ]
+    results = []
+    original_client = sheets.get_google_sheets_client
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for workers in (1, sheets.UPLOAD_WORKERS):
+                client = FakeClient(latency=latency)
+                sheets.get_google_sheets_client = lambda uploaded_credentials=None: (client, None)
+                sync_state = SyncStateStore(os.path.join(tmp, f"sync_state_{workers}.json"))
+                queue = sheets.UploadQueue(storage=NullStorage(), sync_state=sync_state, max_workers=workers)
+                start = time.perf_counter()
+                jobs = queue.submit_targets(numbers_dict, "bench", targets, seats=seats, class_id="bench")
+                queue.wait(jobs)
+                results.append({
+                    "name": "targets.column",
+                    "params": {"targets": len(targets), "workers": workers, "latency_s": latency},
+                    "ms": (time.perf_counter() - start) * 1000,
+                    "succeeded": sum(job.status == "success" for job in jobs),
+                    "requests": client.total,
+                })
+                
+                changed = dict(numbers_dict)
+                changed.update({1: 0, 2: 0})
+                start = time.perf_counter()
+                jobs = queue.submit_sync(changed, "bench")
+                queue.wait(jobs)
+                results.append({
+                    "name": "targets.delta_sync",
+                    "params": {"targets": len(jobs), "workers": workers, "latency_s": latency},
+                    "ms": (time.perf_counter() - start) * 1000,
+                    "succeeded": sum(job.status == "success" for job in jobs),
+                })
+                queue.executor.shutdown()
+        finally:
+            sheets.get_google_sheets_client = original_client
+            os.chdir(cwd)
+    return results
+
+def bench_sheetcache(quick, latency):
+    """Reading past exams from Google Sheets every time (get_all_values) vs. the local columnar
+    cache: refresh with nothing new, refresh with one new column, and trend queries on the cache"""
+    seats = tuple(range(1, 61))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for exams in ((10, 40) if quick else (10, 40, 150)):
+            client = FakeClient(latency=latency)
+            worksheet = client.open_by_key("bench").sheet1
+            worksheet.resize(cols=exams + 2)
+            worksheet.batch_update([
+                {"range": "A1", "values": [["座號"]] + [[k] for k in seats]},
+                *({"range": f"{sheets.get_column_letter(c)}1",
+                   "values": [[f"exam {c}"]] + [[(k * c) % 101] for k in seats]}
+                  for c in range(2, exams + 2))
+            ])
+            cache = SheetCache("bench", root=os.path.join(tmp, str(exams)))
+            cache.refresh(worksheet)
+            
+            def download(i):
+                values = worksheet.get_all_values()
+                [[parse_cell(value) for value in row[1:]] for row in values[1:]]
+            
+            def add_column(i):
+                col = exams + 2 + i
+                worksheet.resize(cols=col)
+                worksheet.batch_update([{"range": f"{sheets.get_column_letter(col)}1",
+                                         "values": [[f"new {i}"]] + [[i]] * len(seats)}])
+            
+            repeat = 5 if quick else 20
+            for name, fn, setup in (
+                ("sheetcache.full_download", download, None),
+                ("sheetcache.refresh_unchanged", lambda i: cache.refresh(worksheet), None),
+                ("sheetcache.refresh_new_column", lambda i: cache.refresh(worksheet), add_column),
+            ):
+                samples = []
+                client.reset_counts()
+                for i in range(repeat):
+                    if setup:
+                        setup(i)
+                        client.reset_counts()
+                    start = time.perf_counter()
+                    fn(i)
+                    samples.append(time.perf_counter() - start)
+                results.append({
+                    "name": name,
+                    "params": {"exams": exams, "seats": len(seats), "latency_s": latency},
+                    **summarize(samples),
+                    "requests_per_call": client.total / (1 if setup else repeat),
+                })
+            
+            # Trend queries never touch the network; a fresh cache object reads the arrays from disk
+            results.append({
+                "name": "sheetcache.trends_all",
+                "params": {"exams": len(cache.titles), "seats": len(seats)},
+                **measure(lambda i: student_trends(SheetCache("bench", root=cache.path.rsplit(os.sep, 1)[0]).matrix()),
+                          repeat * 5),
+            })
+            results.append({
+                "name": "sheetcache.trend_one_seat",
+                "params": {"exams": len(cache.titles), "seats": len(seats)},
+                **measure(lambda i: cache.trend(seats[i % len(seats)]), repeat * 5),
+            })
+    return results
+
+def bench_loadcolumn(quick, latency):
+    """Loading one uploaded exam back for editing: reading the whole sheet vs. the header row plus
+    one two-range request (seat column + the exam column) on one opened worksheet, from a cold start
+    and with the worksheet already open (e.g. listed earlier); cells counts what the API returned"""
+    seats = tuple(range(1, 61))
+    results = []
+    original_client = sheets.get_google_sheets_client
+    original_worksheets = sheets.get_worksheet_cache
+    try:
+        for exams in ((20, 150) if quick else (20, 150, 500)):
+            client = FakeClient(latency=latency)
+            sheets.get_google_sheets_client = lambda uploaded_credentials=None: (client, None)
+            worksheets = sheets.WorksheetCache()
+            sheets.get_worksheet_cache = lambda: worksheets
+            worksheet = client.open_by_key("bench").sheet1
+            worksheet.resize(cols=exams + 1)
+            worksheet.batch_update([
+                {"range": "A1", "values": [["座號"]] + [[k] for k in seats]},
+                *({"range": f"{sheets.get_column_letter(c)}1",
+                   "values": [[f"exam {c}"]] + [[(k * c) % 101] for k in seats]}
+                  for c in range(2, exams + 2))
+            ])
+            cells = [0]
+            read_range = worksheet._range
+            
+            def counted_range(rng):
+                rows = read_range(rng)
+                cells[0] += sum(len(row) for row in rows)
+                return rows
+            
+            worksheet._range = counted_range
+            title = f"exam {exams // 2}"
+            
+            def whole_sheet():
+                values = sheets.open_target_worksheet(client, "bench").get_all_values()
+                col = values[0].index(title)
+                return {int(row[0]): int(row[col]) for row in values[1:] if row[col] != ""}
+            
+            def ranges():
+                worksheet, error = sheets.open_upload_worksheet("bench")
+                columns, error = sheets.list_exam_columns(worksheet)
+                col_index = [col for col, name in columns if name == title][-1]
+                column, error = sheets.load_exam_column(worksheet, col_index, title)
+                return column["values"]
+            
+            for name, fn in (("loadcolumn.whole_sheet", whole_sheet), ("loadcolumn.ranges", ranges),
+                             ("loadcolumn.ranges_open", ranges)):
+                client.reset_counts()
+                cells[0] = 0
+                start = time.perf_counter()
+                values = fn()
+                results.append({
+                    "name": name,
+                    "params": {"exams": exams, "seats": len(seats), "latency_s": latency},
+                    "ms": (time.perf_counter() - start) * 1000,
+                    "requests": client.total,
+                    "request_counts": dict(client.counts),
+                    "cells": cells[0],
+                    "loaded": len(values),
+                })
+    finally:
+        sheets.get_google_sheets_client = original_client
+        sheets.get_worksheet_cache = original_worksheets
+    return results
+
+def bench_ratelimit(quick, latency):
+    """Concurrent sessions uploading through one service account against a fake that enforces
+    the quota (scaled down to a short period), with and without the shared rate limiter"""
+    quota, period = 60, 3.0 if quick else 10.0
+    sessions, uploads = 6, 4
+    seats = tuple(range(1, 41))
+    numbers_dict = {k: k for k in seats}
+    results = []
+    original_client = sheets.get_google_sheets_client
+    original_limiter = sheets.get_rate_limiter
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for limited in (False, True):
+                client = FakeClient(latency=latency, quota=quota, quota_period=period)
+                limiter = RateLimiter(account_quota=quota, spreadsheet_quota=quota, period=period)
+                sheets.get_rate_limiter = lambda: limiter
+                if limited:
+                    sheets.instrument_client(client, "bench@fake")
+                sheets.get_google_sheets_client = lambda uploaded_credentials=None: (client, None)
+                outcomes = []
+                
+                def session(i):
+                    for j in range(uploads):
+                        success, message = sheets.upload_to_google_sheets(
+                            numbers_dict, f"s{i}-{j}", "", "bench", seats=seats
+                        )
+                        outcomes.append(success)
+                
+                threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                results.append({
+                    "name": "ratelimit.concurrent_uploads",
+                    "params": {"limited": limited, "sessions": sessions, "uploads_each": uploads,
+                               "quota": quota, "quota_period_s": period, "latency_s": latency},
+                    "ms": (time.perf_counter() - start) * 1000,
+                    "succeeded": sum(outcomes),
+                    "failed": len(outcomes) - sum(outcomes),
+                    "requests": client.total,
+                    "rejected_429": client.counts.get("429", 0),
+                })
+        finally:
+            sheets.get_google_sheets_client = original_client
+            sheets.get_rate_limiter = original_limiter
+            os.chdir(cwd)
+    return results
+
+class NullStorage:
+    """Storage stand-in for queue benchmarks: archiving is not what is being measured"""
+
+    def archive_exam(self, class_id, title, numbers_dict):
+        return None
+
+BENCHMARKS = {
+    "parse": lambda args: bench_parse(args.quick),
+    "storage": lambda args: bench_storage(args.quick),
+    "stats": lambda args: bench_stats(args.quick),
+    "live": lambda args: bench_live(args.quick),
+    "apptest": lambda args: bench_apptest(args.quick),
+    "coldstart": lambda args: bench_coldstart(args.quick),
+    "upload": lambda args: bench_upload(args.quick, args.latency),
+    "targets": lambda args: bench_targets(args.quick, args.latency),
+    "sheetcache": lambda args: bench_sheetcache(args.quick, args.latency),
+    "loadcolumn": lambda args: bench_loadcolumn(args.quick, args.latency),
+    "ratelimit": lambda args: bench_ratelimit(args.quick, args.latency),
+}
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="fewer sizes and iterations")
+    parser.add_argument("--only", action="append", choices=sorted(BENCHMARKS), help="run only these groups")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake Sheets latency per request (seconds)")
+    parser.add_argument("-o", "--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+    
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick,
+        },
+        "results": [],
+    }
+    for name in args.only or BENCHMARKS:
+        print(f"running {name}...", file=sys.stderr)
+        report["results"].extend(BENCHMARKS[name](args))
+    
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
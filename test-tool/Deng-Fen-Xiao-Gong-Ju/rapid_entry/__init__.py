@@ -0,0 +1,46 @@
+"""Browser-side rapid entry box for the Streamlit app.
+
+Codes are checked against the roster in the browser and queued there; the queue is sent to
+Python in batches (every `batch_size` entries or after `idle_ms` without typing) and kept,
+in localStorage as well, until a later render acknowledges it. Python has to apply only
+entries with a sequence number above the last one it acknowledged for that client, since
+unacknowledged batches are sent again.
+"""
+
+import os
+
+import streamlit.components.v1 as components
+
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend")
+RAPID_BATCH_SIZE = 10
+RAPID_IDLE_MS = 800
+
+_component = components.declare_component("rapid_entry", path=FRONTEND_DIR)
+
+def rapid_entry(class_id, seats, numbers_dict, ack=None, batch_size=RAPID_BATCH_SIZE, idle_ms=RAPID_IDLE_MS,
+                key=None):
+    """Render the entry box; returns the latest batch sent by the browser or None
+
+    A batch is {"client": id, "batch": n, "entries": [[seq, seat, value], ...]}. `ack` is
+    {"client": id, "seq": n}, the last entry of that client that has been applied.
+    """
+    return _component(
+        class_id=class_id,
+        seats=list(seats),
+        values={str(k): v for k, v in numbers_dict.items() if v is not None},
+        ack=ack,
+        batch_size=batch_size,
+        idle_ms=idle_ms,
+        key=key,
+        default=None
+    )
+
+def new_entries(batch, acks):
+    """Entries of a batch not applied yet, given {client: last applied seq}; also returns that client's new ack"""
+    if not batch or not batch.get("entries"):
+        return [], None
+    client = batch["client"]
+    applied = acks.get(client, 0)
+    entries = [(int(seat), int(value)) for seq, seat, value in batch["entries"] if seq > applied]
+    last_seq = max(applied, max(seq for seq, _, _ in batch["entries"]))
+    return entries, {"client": client, "seq": last_seq}
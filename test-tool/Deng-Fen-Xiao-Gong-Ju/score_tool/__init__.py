@@ -0,0 +1,21 @@
+"""Core of 登分小工具: rosters, score storage, code parsing and Google Sheets upload.
+
+Importing this package does not start any UI; app.py is the Streamlit front end
+and `python -m score_tool` is the command-line entry point.
+"""
+
+from .ingest import parse_bulk_codes, parse_code
+from .live import get_board
+from .metrics import get_metrics
+from .rosters import DEFAULT_CLASS, Roster, get_class_ids, get_roster, initialize_dict
+from .sheets import get_google_sheets_client, get_upload_queue, upload_to_google_sheets
+from .storage import (
+    StorageLoadError,
+    get_storage,
+    load_class_dict,
+    load_dict,
+    save_dict,
+    save_entries,
+    save_entry,
+)
+from .targets import FIXED_SPREADSHEET_ID, UploadTarget, get_upload_targets
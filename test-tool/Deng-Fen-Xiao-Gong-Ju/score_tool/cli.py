@@ -0,0 +1,374 @@
+"""Command-line entry point: python -m score_tool <command>
+
+    classes                         list classes that have a roster
+    ingest FILE... [--class C]      store codes from text/CSV files ("-" reads stdin)
+    show [--class C] [--format F]   print or export the current mapping
+    export [--class C]... [--history] [--format csv|tsv|xlsx] -o FILE
+                                    export classes and archived exams side by side
+    upload --title T [--class C]... upload one exam column per class in one run, to every
+                                    configured target (upload_targets.json) at once
+    sync [--class C]...             push corrections into the columns uploaded last
+    outbox [--drain]                list (and retry) uploads that have not gone through yet
+    load [--to NAME] [--title T]    list uploaded exams, or load one back into a class to correct it
+    pull [--to NAME]... [--full]    download new exam columns of the targets into the local cache
+    trend [--to NAME] [--seat N]    per-student trends (or one seat's scores) from the local cache
+"""
+
+import argparse
+import json
+import sys
+
+from .export import FORMATS, available_formats, iter_rows, values_text, write_delimited, write_export
+from .ingest import parse_bulk_codes
+from .metrics import export_metrics
+from .rosters import DEFAULT_CLASS, get_class_ids, get_roster
+from .sheet_cache import get_sheet_cache, pull_sheet
+from .sheets import get_column_letter, get_upload_queue, list_exam_columns, load_exam_column, open_upload_worksheet
+from .stats import student_trends
+from .storage import StorageLoadError, load_class_dict, save_dict, save_entries
+from .sync import get_sync_state
+from .targets import UploadTarget, get_upload_targets
+
+def read_input(path):
+    """Read a code file, or stdin for "-" """
+    if path == "-":
+        return sys.stdin.read()
+    with open(path, "r", encoding="utf-8-sig") as f:
+        return f.read()
+
+def cmd_classes(args):
+    for class_id in get_class_ids():
+        print(f"{class_id}\t{len(get_roster(class_id))}")
+    return 0
+
+def cmd_ingest(args):
+    roster = get_roster(args.class_id)
+    numbers_dict = load_class_dict(args.class_id)
+    text = "\n".join(read_input(path) for path in args.files)
+    entries, issues, overwrites = parse_bulk_codes(text, roster.seat_set, numbers_dict)
+    if args.no_overwrite:
+        for key in overwrites:
+            del entries[key]
+    
+    if entries and not save_entries(entries.items(), args.class_id):
+        print("儲存失敗", file=sys.stderr)
+        return 1
+    
+    for line_no, content, reason in issues:
+        print(f"第 {line_no} 行 {content}: {reason}", file=sys.stderr)
+    print(f"已匯入 {len(entries)} 筆，{len(overwrites)} 筆已有成績（{'略過' if args.no_overwrite else '已覆寫'}），{len(issues)} 個問題")
+    return 0 if not issues or args.allow_issues else 2
+
+def cmd_show(args):
+    roster = get_roster(args.class_id)
+    numbers_dict = load_class_dict(args.class_id)
+    out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    try:
+        if args.format == "json":
+            json.dump({str(k): numbers_dict[k] for k in roster.seats}, out, ensure_ascii=False, indent=2)
+            out.write("\n")
+        elif args.format in ("csv", "tsv"):
+            rows = iter_rows([args.class_id], current_title="成績", load_current=lambda class_id: numbers_dict)
+            write_delimited(rows, out, "," if args.format == "csv" else "\t")
+        elif args.format == "values":
+            # Same text as the app's copy button
+            out.write(values_text(numbers_dict, roster.seats) + "\n")
+        else:
+            for k in roster.seats:
+                out.write(f"{k:02d} → {'—' if numbers_dict[k] is None else numbers_dict[k]}\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+def cmd_export(args):
+    class_ids = get_class_ids() if args.all_classes else (args.class_ids or [DEFAULT_CLASS])
+    if args.format not in available_formats():
+        print("XLSX 匯出需要安裝 openpyxl", file=sys.stderr)
+        return 1
+    if args.format == "xlsx" and not args.output and sys.stdout.isatty():
+        print("XLSX 請用 -o 指定輸出檔案", file=sys.stderr)
+        return 1
+    # Rows are streamed straight into the output, one class and exam at a time
+    rows = iter_rows(class_ids, args.history)
+    if args.output:
+        with open(args.output, "wb") as out:
+            write_export(args.format, rows, out)
+    else:
+        write_export(args.format, rows, sys.stdout.buffer)
+    return 0
+
+def report_jobs(jobs):
+    """Print job outcomes per target; exit status 1 if any failed, 3 if some are still waiting in the outbox"""
+    failed = pending = 0
+    groups = {}
+    for job in jobs:
+        if job.active:
+            print(f"{job.class_id} → {job.target_label}: 仍在待傳區，下次執行時繼續上傳 - {job.message}")
+            pending += 1
+        else:
+            print(f"{job.class_id} → {job.target_label}: {job.status} - {job.message}")
+            failed += job.status != "success"
+        groups.setdefault((job.class_id, job.group or job.key), []).append(job)
+    for (class_id, _), group in groups.items():
+        done = sum(job.status == "success" for job in group)
+        if 0 < done < len(group):
+            print(f"{class_id}: {done}/{len(group)} 個目標完成（部分失敗）", file=sys.stderr)
+    return 1 if failed else 3 if pending else 0
+
+def cmd_outbox(args):
+    queue = get_upload_queue()
+    jobs = queue.outbox_jobs()
+    if args.discard_failed:
+        for job in jobs:
+            if job.status == "failed":
+                queue.discard(job.id)
+        jobs = queue.outbox_jobs()
+    if not jobs:
+        print("待傳區是空的")
+        return 0
+    for job in jobs:
+        print(f"{job.id}\t{job.class_id}\t{job.mode}\t{job.column_title}\t{job.status}\t{job.attempts}\t{job.message}")
+    if not args.drain:
+        return 0
+    queue.retry_now()
+    queue.wait(jobs, args.wait)
+    return report_jobs(jobs)
+
+def upload_targets(args, class_id, overrides):
+    """Targets of one class: --target/--spreadsheet if given, else the configured ones (narrowed by --to)"""
+    spreadsheet_id = overrides.get(class_id, args.spreadsheet)
+    if spreadsheet_id:
+        return [UploadTarget(spreadsheet_id, spreadsheet_id, args.worksheet)]
+    targets = get_upload_targets(class_id)
+    if args.to:
+        targets = [target for target in targets if target.name in args.to]
+    return targets
+
+def cmd_upload(args):
+    class_ids = get_class_ids() if args.all_classes else (args.class_ids or [DEFAULT_CLASS])
+    overrides = dict(target.split("=", 1) for target in args.target)
+    credentials = None
+    if args.credentials:
+        with open(args.credentials, "r", encoding="utf-8") as f:
+            credentials = json.load(f)
+    
+    queue = get_upload_queue()
+    jobs = []
+    for class_id in class_ids:
+        numbers_dict = load_class_dict(class_id)
+        if all(v is None for v in numbers_dict.values()):
+            print(f"{class_id}: 沒有可上傳的值，略過")
+            continue
+        targets = upload_targets(args, class_id, overrides)
+        if not targets:
+            print(f"{class_id}: 沒有符合的上傳目標，略過")
+            continue
+        # All targets of all classes are queued first, so they upload side by side
+        jobs.extend(queue.submit_targets(
+            numbers_dict,
+            args.title,
+            targets,
+            credentials,
+            get_roster(class_id).seats,
+            class_id
+        ))
+    queue.wait(jobs, args.wait)
+    return report_jobs(jobs)
+
+def cmd_sync(args):
+    class_ids = get_class_ids() if args.all_classes else (args.class_ids or [DEFAULT_CLASS])
+    credentials = None
+    if args.credentials:
+        with open(args.credentials, "r", encoding="utf-8") as f:
+            credentials = json.load(f)
+    
+    queue = get_upload_queue()
+    jobs = []
+    for class_id in class_ids:
+        class_jobs = queue.submit_sync(load_class_dict(class_id), class_id, credentials)
+        if not class_jobs:
+            print(f"{class_id}: 尚未上傳過，略過")
+        jobs.extend(class_jobs)
+    queue.wait(jobs, args.wait)
+    return report_jobs(jobs)
+
+def named_targets(names):
+    """Configured targets, only the named ones when names are given"""
+    return [target for target in get_upload_targets() if not names or target.name in names]
+
+def cmd_load(args):
+    targets = [target for target in get_upload_targets(args.class_id) if not args.to or target.name == args.to]
+    if not targets:
+        print("找不到這個上傳目標", file=sys.stderr)
+        return 1
+    target = targets[0]
+    credentials = None
+    if args.credentials:
+        with open(args.credentials, "r", encoding="utf-8") as f:
+            credentials = json.load(f)
+    # One opened worksheet serves both the listing and the column read
+    worksheet, error = open_upload_worksheet(target.spreadsheet_id, target.worksheet, credentials)
+    if not error:
+        columns, error = list_exam_columns(worksheet)
+    if error:
+        print(error, file=sys.stderr)
+        return 1
+    if not args.title:
+        for col_index, title in columns:
+            print(f"{get_column_letter(col_index)}\t{title}")
+        return 0
+    # The rightmost column with the title is the latest upload of that exam
+    matches = [col_index for col_index, title in columns if title == args.title]
+    if not matches:
+        print(f"「{target.label}」中沒有「{args.title}」", file=sys.stderr)
+        return 1
+    column, error = load_exam_column(worksheet, matches[-1], args.title)
+    if error:
+        print(error, file=sys.stderr)
+        return 1
+    
+    roster = get_roster(args.class_id)
+    numbers_dict = {seat: column["values"].get(seat) for seat in roster.seats}
+    if not save_dict(numbers_dict, args.class_id):
+        print("儲存失敗", file=sys.stderr)
+        return 1
+    get_sync_state().record_upload(
+        args.class_id, target.spreadsheet_id, matches[-1], args.title, column["seats"], numbers_dict,
+        target.worksheet, target.label
+    )
+    loaded = sum(v is not None for v in numbers_dict.values())
+    print(f"已載入「{args.title}」（{get_column_letter(matches[-1])} 欄）{loaded} 筆成績；修改後執行 sync 寫回這一欄")
+    if column["skipped"]:
+        print(f"座號 {', '.join(map(str, column['skipped']))} 不是整數分數，未載入", file=sys.stderr)
+    return 0
+
+def cmd_pull(args):
+    credentials = None
+    if args.credentials:
+        with open(args.credentials, "r", encoding="utf-8") as f:
+            credentials = json.load(f)
+    failed = 0
+    for target in named_targets(args.to):
+        success, message = pull_sheet(target, credentials, full=args.full)
+        print(message, file=sys.stdout if success else sys.stderr)
+        failed += not success
+    return 1 if failed else 0
+
+def cmd_trend(args):
+    targets = named_targets(args.to and [args.to])
+    if not targets:
+        print("找不到這個上傳目標", file=sys.stderr)
+        return 1
+    cache = get_sheet_cache(targets[0].spreadsheet_id, targets[0].worksheet)
+    if not cache.titles:
+        print(f"「{targets[0].label}」尚未下載，請先執行 pull", file=sys.stderr)
+        return 1
+    if args.seat is not None:
+        for title, value in cache.trend(args.seat):
+            print(f"{title}\t{'' if value is None else f'{value:g}'}")
+        return 0
+    seats = [int(seat) for seat in cache.seats()]
+    rows = [i for i, seat in enumerate(seats) if seat >= 0]
+    trends = student_trends(cache.matrix()[:, rows])
+    print("座號\t次數\t平均\t最近\t較前次\t每次變化")
+    for i, row in enumerate(rows):
+        figures = [trends[name][i] for name in ("mean", "last", "change", "slope")]
+        print(f"{seats[row]}\t{trends['count'][i]}\t" + "\t".join("" if f != f else f"{f:.2f}" for f in figures))
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m score_tool", description="登分小工具（命令列）")
+    sub = parser.add_subparsers(dest="command", required=True)
+    
+    sub.add_parser("classes", help="列出所有班級").set_defaults(func=cmd_classes)
+    
+    ingest = sub.add_parser("ingest", help="從檔案匯入成績代碼")
+    ingest.add_argument("files", nargs="+", help="代碼檔案（.txt/.csv），- 代表標準輸入")
+    ingest.add_argument("--class", dest="class_id", default=DEFAULT_CLASS)
+    ingest.add_argument("--no-overwrite", action="store_true", help="不覆寫已有的成績")
+    ingest.add_argument("--allow-issues", action="store_true", help="有問題的行不影響結束碼")
+    ingest.set_defaults(func=cmd_ingest)
+    
+    show = sub.add_parser("show", help="顯示或匯出目前的成績")
+    show.add_argument("--class", dest="class_id", default=DEFAULT_CLASS)
+    show.add_argument("--format", choices=["text", "csv", "tsv", "json", "values"], default="text")
+    show.add_argument("-o", "--output", help="輸出檔案（預設為標準輸出）")
+    show.set_defaults(func=cmd_show)
+    
+    export = sub.add_parser("export", help="匯出一個或多個班級的成績（CSV / TSV / XLSX）")
+    export.add_argument("--class", dest="class_ids", action="append", help="班級（可重複）")
+    export.add_argument("--all-classes", action="store_true", help="匯出所有班級")
+    export.add_argument("--history", action="store_true", help="並列已上傳的歷次考試（SQLite 儲存）")
+    export.add_argument("--format", choices=FORMATS, default="csv")
+    export.add_argument("-o", "--output", help="輸出檔案（預設為標準輸出）")
+    export.set_defaults(func=cmd_export)
+    
+    upload = sub.add_parser("upload", help="上傳到Google Sheets")
+    upload.add_argument("--title", required=True, help="列標題")
+    upload.add_argument("--class", dest="class_ids", action="append", help="班級（可重複）")
+    upload.add_argument("--all-classes", action="store_true", help="上傳所有班級")
+    upload.add_argument("--to", action="append", metavar="NAME", help="只上傳到這個設定的目標（可重複）")
+    upload.add_argument("--spreadsheet", help="試算表ID（取代設定的上傳目標）")
+    upload.add_argument("--worksheet", help="搭配 --spreadsheet/--target 的工作表名稱（預設第一個工作表）")
+    upload.add_argument("--target", action="append", default=[], metavar="CLASS=ID", help="指定某班級的試算表ID")
+    upload.add_argument("--credentials", help="服務帳戶 JSON 密鑰檔案")
+    upload.set_defaults(func=cmd_upload)
+    
+    sync = sub.add_parser("sync", help="只把修改過的成績同步到上次上傳的欄位")
+    sync.add_argument("--class", dest="class_ids", action="append", help="班級（可重複）")
+    sync.add_argument("--all-classes", action="store_true", help="同步所有班級")
+    sync.add_argument("--credentials", help="服務帳戶 JSON 密鑰檔案")
+    sync.set_defaults(func=cmd_sync)
+    
+    outbox = sub.add_parser("outbox", help="列出待傳區（尚未成功的上傳）")
+    outbox.add_argument("--drain", action="store_true", help="立即重試並等待上傳完成")
+    outbox.add_argument("--discard-failed", action="store_true", help="刪除已確定失敗的上傳")
+    outbox.set_defaults(func=cmd_outbox)
+    
+    load = sub.add_parser("load", help="列出已上傳的考試，或把其中一欄載回班級以便修改")
+    load.add_argument("--to", metavar="NAME", help="上傳目標（預設班級的第一個）")
+    load.add_argument("--title", help="要載入的考試（列標題）；省略時只列出考試")
+    load.add_argument("--class", dest="class_id", default=DEFAULT_CLASS)
+    load.add_argument("--credentials", help="服務帳戶 JSON 密鑰檔案")
+    load.set_defaults(func=cmd_load)
+    
+    pull = sub.add_parser("pull", help="把上傳目標的試算表下載到本機快取（只下載新的考試欄）")
+    pull.add_argument("--to", action="append", metavar="NAME", help="只下載這個設定的目標（可重複）")
+    pull.add_argument("--full", action="store_true", help="重新下載全部（舊欄位被修改過時使用）")
+    pull.add_argument("--credentials", help="服務帳戶 JSON 密鑰檔案")
+    pull.set_defaults(func=cmd_pull)
+    
+    trend = sub.add_parser("trend", help="從本機快取計算每位學生的成績趨勢")
+    trend.add_argument("--to", metavar="NAME", help="上傳目標（預設第一個）")
+    trend.add_argument("--seat", type=int, help="只列出這個座號的歷次成績")
+    trend.set_defaults(func=cmd_trend)
+    
+    for command in (upload, sync, outbox):
+        command.add_argument("--wait", type=float, default=300, metavar="SECONDS",
+                             help="最多等待幾秒；之後未完成的上傳留在待傳區（預設 300）")
+    
+    return parser
+
+def unknown_classes(args):
+    """--class values without a roster file"""
+    class_ids = getattr(args, "class_ids", None) or []
+    if getattr(args, "class_id", None):
+        class_ids = [args.class_id]
+    known = set(get_class_ids())
+    return [class_id for class_id in class_ids if class_id not in known]
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    unknown = unknown_classes(args)
+    if unknown:
+        print(f"找不到班級 {', '.join(unknown)}（可用的班級：{', '.join(get_class_ids()) or '無'}）", file=sys.stderr)
+        return 1
+    # Journaled entries are fsynced by the journal's atexit hook
+    try:
+        status = args.func(args)
+    except StorageLoadError as e:
+        print(f"讀取成績失敗（已儲存的資料未被更動）: {e}", file=sys.stderr)
+        status = 1
+    export_metrics(force=True)
+    return status
@@ -0,0 +1,101 @@
+"""Score exports as CSV / TSV / XLSX, written row by row so large exports never sit in memory as one string
+
+A table has one row per seat: the class (when several are exported), the seat number and one
+column per exam, side by side; archived exams come first (oldest first), then the current scores.
+"""
+
+import csv
+import importlib.util
+import io
+
+from .rosters import get_roster
+from .storage import get_storage, load_class_dict
+
+CURRENT_TITLE = "目前成績"
+FORMATS = ("csv", "tsv", "xlsx")
+MIME_TYPES = {
+    "csv": "text/csv",
+    "tsv": "text/tab-separated-values",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+def xlsx_available():
+    """Whether the optional openpyxl dependency for XLSX export is installed (without importing it)"""
+    return importlib.util.find_spec("openpyxl") is not None
+
+def available_formats():
+    return tuple(fmt for fmt in FORMATS if fmt != "xlsx" or xlsx_available())
+
+def values_text(numbers_dict, seats):
+    """One score per line in seat order (blank for missing): the clipboard payload"""
+    return "\n".join("" if numbers_dict.get(k) is None else str(numbers_dict[k]) for k in seats)
+
+def archived_exams(class_id, include_history):
+    """Archived exams of a class as (exam_id, title), oldest first; a later exam with the same title wins"""
+    if not include_history:
+        return []
+    exams = {}
+    for exam_id, title, created_at in get_storage().list_exams(class_id):
+        exams.pop(title, None)
+        exams[title] = exam_id
+    return [(exam_id, title) for title, exam_id in exams.items()]
+
+def iter_rows(class_ids, include_history=False, load_current=load_class_dict, current_title=CURRENT_TITLE):
+    """Header row, then one row per seat of each class; each exam is read only when its class is reached
+
+    `load_current(class_id)` supplies the current scores (e.g. a shared board's snapshot in the app).
+    """
+    class_ids = list(class_ids)
+    exams = {class_id: archived_exams(class_id, include_history) for class_id in class_ids}
+    titles = list(dict.fromkeys(title for per_class in exams.values() for _, title in per_class))
+    titles.append(current_title)
+    with_class = len(class_ids) > 1
+    yield (["班級"] if with_class else []) + ["座號"] + titles
+
+    storage = get_storage()
+    for class_id in class_ids:
+        columns = {title: storage.exam_scores(exam_id) for exam_id, title in exams[class_id]}
+        columns[current_title] = load_current(class_id)
+        for seat in get_roster(class_id).seats:
+            row = [class_id] if with_class else []
+            row.append(seat)
+            row.extend(
+                "" if columns.get(title, {}).get(seat) is None else columns[title][seat] for title in titles
+            )
+            yield row
+
+def write_delimited(rows, out, delimiter=","):
+    """Write rows to a text stream as CSV (or TSV with delimiter="\\t")"""
+    writer = csv.writer(out, delimiter=delimiter, lineterminator="\n")
+    for row in rows:
+        writer.writerow(row)
+
+def write_xlsx(rows, out, sheet_title="成績"):
+    """Write rows to a binary stream as XLSX using openpyxl's streaming (write-only) workbook"""
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_title)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(out)
+
+def write_export(fmt, rows, out):
+    """Write rows in `fmt` to a binary stream; CSV/TSV get a UTF-8 BOM so Excel shows Chinese correctly"""
+    if fmt == "xlsx":
+        write_xlsx(rows, out)
+        return
+    text = io.TextIOWrapper(out, encoding="utf-8-sig", newline="", write_through=True)
+    try:
+        write_delimited(rows, text, "," if fmt == "csv" else "\t")
+    finally:
+        text.detach()
+
+def export_bytes(fmt, rows):
+    """Export as bytes, e.g. for a download button"""
+    buffer = io.BytesIO()
+    write_export(fmt, rows, buffer)
+    return buffer.getvalue()
+
+def export_filename(fmt, class_ids, include_history=False):
+    name = "_".join(class_ids) if len(class_ids) <= 3 else f"{len(class_ids)}班"
+    return f"成績_{name}{'_歷次' if include_history else ''}.{fmt}"
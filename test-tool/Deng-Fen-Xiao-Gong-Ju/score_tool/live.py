@@ -0,0 +1,197 @@
+"""Shared grading sessions: one in-memory score board per class, merged per seat across devices"""
+
+import functools
+import threading
+import time
+
+from .metrics import count
+from .stats import ScoreStats
+from .storage import external_changes, has_external_changes, load_class_dict, save_dict, save_entries
+
+# Sessions on the same class pull each other's entries this often (seconds)
+LIVE_REFRESH_INTERVAL = 2
+# A session that has not refreshed for this long no longer counts as connected
+LIVE_SESSION_TIMEOUT = 30
+
+class ClassBoard:
+    """Authoritative scores of one class, shared by every session entering it.
+
+    Each seat has its own lock and remembers the board version and session of its last
+    write, so two devices entering different seats never wait on each other. A writer
+    passes the version it last pulled; if another session changed the seat to a different
+    value since then, the new entry still wins (as the later entry would on one device) but
+    the seat is flagged as a conflict until someone picks a value. Sessions catch up with
+    changes_since(), which returns only the seats written after their version. Statistics are
+    kept in step with every write, so reading them never scans the class. Scores another
+    process stored (e.g. a CLI import) are taken in by pull_external() like any other write.
+    """
+
+    def __init__(self, class_id, numbers_dict):
+        self.class_id = class_id
+        self.lock = threading.Lock()
+        self.seat_locks = {key: threading.Lock() for key in numbers_dict}
+        self.values = dict(numbers_dict)
+        self.stats = ScoreStats(self.values.values())
+        self.seat_versions = dict.fromkeys(numbers_dict, 0)
+        self.writers = {}
+        self.version = 0
+        self.conflicts = {}
+        self.sessions = {}
+
+    def _seat_lock(self, key):
+        with self.lock:
+            return self.seat_locks.setdefault(key, threading.Lock())
+
+    def snapshot(self):
+        """(version, {seat: value}) of the whole board"""
+        with self.lock:
+            return self.version, dict(self.values)
+
+    def statistics(self):
+        """Summary of the current scores (count, mean, std, percentiles, min/max, histogram)"""
+        with self.lock:
+            return self.stats.summary()
+
+    def changes_since(self, version):
+        """(current version, {seat: value} of seats written after `version`)"""
+        with self.lock:
+            changed = {k: self.values[k] for k, v in self.seat_versions.items() if v > version}
+            return self.version, changed
+
+    def set(self, key, value, session_id, base_version):
+        """Store one entry; returns the conflict it raised, or None"""
+        conflicts = self.set_many({key: value}, session_id, base_version)
+        return conflicts[0] if conflicts else None
+
+    def set_many(self, entries, session_id, base_version):
+        """Store several entries with one storage write; returns the conflicts they raised"""
+        entries = dict(entries)
+        # Seat locks are always taken in seat order, so concurrent bulk writes cannot deadlock
+        locks = [self._seat_lock(key) for key in sorted(entries)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            conflicts = []
+            with self.lock:
+                self.version += 1
+                for key, value in entries.items():
+                    previous = self.values.get(key)
+                    other = self.writers.get(key)
+                    if (self.seat_versions.get(key, 0) > base_version and other != session_id
+                            and previous is not None and previous != value):
+                        conflict = self.conflicts[key] = {
+                            "seat": key,
+                            "value": value,
+                            "session": session_id,
+                            "other_value": previous,
+                            "other_session": other,
+                            "time": time.time(),
+                        }
+                        conflicts.append(conflict)
+                    self.stats.update(previous, value)
+                    self.values[key] = value
+                    self.seat_versions[key] = self.version
+                    self.writers[key] = session_id
+            # Still under the seat locks: storage sees the writes of a seat in board order
+            save_entries(entries.items(), self.class_id)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+        if conflicts:
+            count("live.conflicts", len(conflicts))
+        return conflicts
+
+    def replace(self, numbers_dict, session_id):
+        """Replace every seat (e.g. clearing for a new exam); drops open conflicts"""
+        locks = [self._seat_lock(key) for key in sorted(set(self.values) | set(numbers_dict))]
+        for lock in locks:
+            lock.acquire()
+        try:
+            with self.lock:
+                self.version += 1
+                self.values = dict(numbers_dict)
+                self.stats = ScoreStats(self.values.values())
+                self.seat_versions = dict.fromkeys(numbers_dict, self.version)
+                self.writers = dict.fromkeys(numbers_dict, session_id)
+                self.conflicts.clear()
+            save_dict(numbers_dict, self.class_id)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def pull_external(self):
+        """Take in scores other processes stored for the class since the last pull"""
+        if not has_external_changes(self.class_id):
+            return
+        with self.lock:
+            # Seats being written here keep that write: it reaches storage after the external one
+            entries = {
+                key: value for key, value in external_changes(self.class_id).items()
+                if key in self.values and not self.seat_locks[key].locked() and self.values[key] != value
+            }
+            if not entries:
+                return
+            self.version += 1
+            for key, value in entries.items():
+                self.stats.update(self.values[key], value)
+                self.values[key] = value
+                self.seat_versions[key] = self.version
+                self.writers[key] = None
+        count("live.external", len(entries))
+
+    def resolve(self, key, value, session_id):
+        """Settle a flagged seat on `value`"""
+        with self.lock:
+            conflict = self.conflicts.pop(key, None)
+            current = self.values.get(key)
+            version = self.version
+        if conflict is not None and current != value:
+            self.set(key, value, session_id, version)
+
+    def open_conflicts(self):
+        """Flagged seats, oldest first"""
+        with self.lock:
+            return sorted(self.conflicts.values(), key=lambda conflict: conflict["time"])
+
+    def touch(self, session_id):
+        """Mark a session as connected to this board"""
+        with self.lock:
+            self.sessions[session_id] = time.time()
+
+    def leave(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def peers(self, session_id):
+        """Number of other sessions that refreshed within LIVE_SESSION_TIMEOUT"""
+        cutoff = time.time() - LIVE_SESSION_TIMEOUT
+        with self.lock:
+            for other, seen in list(self.sessions.items()):
+                if seen < cutoff:
+                    del self.sessions[other]
+            return sum(1 for other in self.sessions if other != session_id)
+
+class LiveBoards:
+    """Process-wide board per class, created from storage the first time a session opens the class
+    and brought up to date with other processes' writes whenever it is fetched"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.boards = {}
+
+    def get(self, class_id):
+        with self.lock:
+            board = self.boards.get(class_id)
+            if board is None:
+                board = self.boards[class_id] = ClassBoard(class_id, load_class_dict(class_id))
+        board.pull_external()
+        return board
+
+@functools.lru_cache(maxsize=None)
+def get_live_boards():
+    """Boards shared by every session"""
+    return LiveBoards()
+
+def get_board(class_id):
+    """Shared board of a class"""
+    return get_live_boards().get(class_id)
@@ -0,0 +1,189 @@
+"""Low-overhead timers and counters around the hot paths, with Prometheus-text / JSON-lines export
+
+Every timing is recorded in the process-wide registry (get_metrics()) and, when a Streamlit
+session has bound its own registry with bind_session(), in that session's registry too.
+"""
+
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Samples kept per phase for percentiles (counts and sums cover every sample)
+METRICS_WINDOW = 1024
+# SCORE_METRICS_FILE=path enables export: *.prom is rewritten as Prometheus text, anything else gets JSON lines
+METRICS_EXPORT_PATH = os.environ.get("SCORE_METRICS_FILE")
+METRICS_EXPORT_INTERVAL = 15.0
+
+def percentile(ordered, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class Metrics:
+    """Per-phase latency samples and named counters, safe to update from any thread"""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.totals = {}
+        self.counters = {}
+        self.started_at = time.time()
+
+    def observe(self, phase, seconds):
+        with self.lock:
+            samples = self.samples.get(phase)
+            if samples is None:
+                samples = self.samples[phase] = deque(maxlen=self.window)
+                self.totals[phase] = [0, 0.0]
+            samples.append(seconds)
+            totals = self.totals[phase]
+            totals[0] += 1
+            totals[1] += seconds
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.totals.clear()
+            self.counters.clear()
+            self.started_at = time.time()
+
+    def snapshot(self):
+        """{'phases': {phase: count/total/percentiles in ms}, 'counters': {name: value}}"""
+        with self.lock:
+            samples = {phase: sorted(values) for phase, values in self.samples.items()}
+            totals = {phase: tuple(values) for phase, values in self.totals.items()}
+            counters = dict(self.counters)
+        phases = {}
+        for phase in sorted(samples):
+            ordered = samples[phase]
+            count, total = totals[phase]
+            phases[phase] = {
+                "count": count,
+                "total_ms": total * 1000,
+                "mean_ms": total / count * 1000,
+                "p50_ms": percentile(ordered, 0.50) * 1000,
+                "p95_ms": percentile(ordered, 0.95) * 1000,
+                "p99_ms": percentile(ordered, 0.99) * 1000,
+                "max_ms": ordered[-1] * 1000,
+            }
+        return {"started_at": self.started_at, "phases": phases, "counters": dict(sorted(counters.items()))}
+
+    def to_prometheus(self):
+        """Prometheus text exposition: one summary for all phases, one counter family"""
+        snapshot = self.snapshot()
+        lines = ["# HELP score_tool_phase_seconds Latency of instrumented phases",
+                 "# TYPE score_tool_phase_seconds summary"]
+        for phase, stats in snapshot["phases"].items():
+            for quantile, key in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+                lines.append(f'score_tool_phase_seconds{{phase="{phase}",quantile="{quantile}"}} {stats[key] / 1000:.6f}')
+            lines.append(f'score_tool_phase_seconds_sum{{phase="{phase}"}} {stats["total_ms"] / 1000:.6f}')
+            lines.append(f'score_tool_phase_seconds_count{{phase="{phase}"}} {stats["count"]}')
+        lines += ["# HELP score_tool_events_total Counted events",
+                  "# TYPE score_tool_events_total counter"]
+        for name, value in snapshot["counters"].items():
+            lines.append(f'score_tool_events_total{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def to_json_line(self):
+        return json.dumps(dict(self.snapshot(), timestamp=time.time()), ensure_ascii=False)
+
+class ExportWriter:
+    """Writes the process registry to METRICS_EXPORT_PATH at most once per interval"""
+
+    def __init__(self, path, interval=METRICS_EXPORT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.last_export = 0.0
+
+    def export(self, metrics, force=False):
+        if not self.path:
+            return False
+        with self.lock:
+            now = time.time()
+            if not force and now - self.last_export < self.interval:
+                return False
+            self.last_export = now
+            try:
+                if self.path.endswith(".prom"):
+                    # Scrapers may read at any time, so the file is replaced atomically
+                    tmp_path = self.path + ".tmp"
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        f.write(metrics.to_prometheus())
+                    os.replace(tmp_path, self.path)
+                else:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(metrics.to_json_line() + "\n")
+                return True
+            except OSError:
+                return False
+
+@functools.lru_cache(maxsize=None)
+def get_metrics():
+    """Registry shared by every session and worker thread"""
+    return Metrics()
+
+@functools.lru_cache(maxsize=None)
+def get_exporter(path=METRICS_EXPORT_PATH):
+    return ExportWriter(path)
+
+def export_metrics(force=False):
+    """Write the export file if SCORE_METRICS_FILE is set and the interval has passed"""
+    return get_exporter().export(get_metrics(), force)
+
+session_metrics = contextvars.ContextVar("score_tool_session_metrics", default=None)
+
+def bind_session(metrics):
+    """Also record timings made in this thread/context into a session's own registry"""
+    session_metrics.set(metrics)
+
+def observe(phase, seconds):
+    get_metrics().observe(phase, seconds)
+    session = session_metrics.get()
+    if session is not None:
+        session.observe(phase, seconds)
+
+def count(name, amount=1):
+    get_metrics().count(name, amount)
+    session = session_metrics.get()
+    if session is not None:
+        session.count(name, amount)
+
+class timer:
+    """Context manager timing a block into `phase`"""
+
+    __slots__ = ("phase", "start")
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.phase, time.perf_counter() - self.start)
+        return False
+
+def timed(phase):
+    """Decorator timing every call of a function into `phase`"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(phase, time.perf_counter() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,69 @@
+"""Durable outbox of uploads that have not reached Google Sheets yet"""
+
+import functools
+import os
+import socket
+
+from .sync import JsonStateFile
+
+OUTBOX_PATH = "upload_outbox.json"
+# Records are marked with the process running them, so the app server and a CLI run from
+# cron never both run the same upload
+PROCESS_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+def owner_alive(owner):
+    """Whether the process that marked a record is still running (unknown hosts count as gone)"""
+    host, _, pid = (owner or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+class UploadOutbox(JsonStateFile):
+    """Pending and failed uploads by idempotency key, kept until they succeed or are discarded.
+
+    A record holds everything needed to redo the upload (mode, class, title, target,
+    seats, scores snapshot, progress) except credentials: uploaded service-account
+    keys are never written to disk. Each record belongs to the process that last wrote it.
+    """
+
+    def put(self, key, record):
+        with self._writing() as records:
+            records[key] = dict(record, owner=PROCESS_OWNER)
+            self._save()
+
+    def remove(self, key):
+        with self._writing() as records:
+            if records.pop(key, None) is not None:
+                self._save()
+
+    def records(self):
+        with self.lock:
+            return dict(self._load())
+
+    def adopt(self):
+        """Take over the records of processes that are gone (or of this one); returns them by key"""
+        with self._writing() as records:
+            adopted = {
+                key: record for key, record in records.items()
+                if record.get("owner") == PROCESS_OWNER or not owner_alive(record.get("owner"))
+            }
+            if any(record.get("owner") != PROCESS_OWNER for record in adopted.values()):
+                for record in adopted.values():
+                    record["owner"] = PROCESS_OWNER
+                self._save()
+        return adopted
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self._load()
+
+@functools.lru_cache(maxsize=None)
+def get_outbox(path=OUTBOX_PATH):
+    """Outbox shared by every session"""
+    return UploadOutbox(path)
@@ -0,0 +1,153 @@
+"""Token buckets that keep Google Sheets requests under the per-minute quotas
+
+Every request a cached gspread client sends takes one token from the bucket of its
+service account and one from the bucket of the spreadsheet it touches. When a bucket
+is empty the request waits for its turn instead of failing with 429. The buckets live
+in a small state file, so the app server and CLI runs on the same machine share them.
+"""
+
+import functools
+import threading
+import time
+
+from .metrics import count, observe
+from .sync import JsonStateFile
+
+# Bucket state shared by every process started from the app directory
+RATE_LIMIT_PATH = "rate_limit.json"
+
+# Sheets API: 60 requests per minute per user (service account)
+SHEETS_ACCOUNT_QUOTA = 60
+# Cap per spreadsheet so several accounts writing the same sheet stay coordinated too
+SHEETS_SPREADSHEET_QUOTA = 60
+SHEETS_QUOTA_PERIOD = 60.0
+# Requests allowed back-to-back before pacing kicks in
+SHEETS_QUOTA_BURST = 10
+
+class TokenBucket:
+    """Token bucket sized so no `period`-long window admits more than `quota` requests.
+
+    The bucket starts with `burst` tokens and refills at (quota - burst) / period per
+    second; reservations may drive it negative, which queues later callers behind them.
+    """
+
+    def __init__(self, quota, period, burst, tokens=None, updated=None):
+        self.capacity = max(1, min(burst, quota - 1))
+        self.rate = max(quota - self.capacity, 1) / period
+        self.tokens = float(self.capacity) if tokens is None else tokens
+        self.updated = time.time() if updated is None else updated
+
+    def _refill(self, now):
+        # Wall-clock time, comparable between processes; a clock stepping back refills nothing
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = now
+
+    def full(self, now):
+        return self.tokens + max(0.0, now - self.updated) * self.rate >= self.capacity
+
+    def reserve(self, now):
+        """Take a token and return how long the caller must wait before using it"""
+        self._refill(now)
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def wait_estimate(self, now):
+        """Seconds a new request would wait right now"""
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+class SharedBuckets(JsonStateFile):
+    """Bucket state ("account:<id>" / "spreadsheet:<id>" -> [tokens, updated]) kept in a file and
+    changed under its lock, so every process draws from the same buckets"""
+
+    def reserve(self, limiter, keys, now):
+        """Take a token from each bucket; returns how long the caller must wait"""
+        with self._writing() as states:
+            delay = 0.0
+            for key in keys:
+                name = ":".join(key)
+                bucket = limiter.new_bucket(key, *states.get(name, ()))
+                delay = max(delay, bucket.reserve(now))
+                states[name] = [bucket.tokens, bucket.updated]
+            # Buckets that have refilled completely hold no state worth keeping
+            for name, state in list(states.items()):
+                if not limiter.new_bucket(tuple(name.split(":", 1)), *state).full(now):
+                    continue
+                del states[name]
+            self._save()
+        return delay
+
+    def buckets(self, limiter):
+        with self.lock:
+            states = dict(self._load())
+        return {tuple(name.split(":", 1)): limiter.new_bucket(tuple(name.split(":", 1)), *state)
+                for name, state in states.items()}
+
+class RateLimiter:
+    """Buckets keyed by ('account', id) and ('spreadsheet', id), shared by every session and worker,
+    and with `path` also by every other process using the same state file"""
+
+    def __init__(self, account_quota=SHEETS_ACCOUNT_QUOTA, spreadsheet_quota=SHEETS_SPREADSHEET_QUOTA,
+                 period=SHEETS_QUOTA_PERIOD, burst=SHEETS_QUOTA_BURST, path=None):
+        self.quotas = {"account": account_quota, "spreadsheet": spreadsheet_quota}
+        self.period = period
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.shared = SharedBuckets(path) if path else None
+        self.waiting = 0
+
+    def new_bucket(self, key, tokens=None, updated=None):
+        return TokenBucket(self.quotas[key[0]], self.period, self.burst, tokens, updated)
+
+    def _bucket(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = self.new_bucket(key)
+        return bucket
+
+    @staticmethod
+    def bucket_keys(account, spreadsheet_id=None):
+        keys = [("account", account)]
+        if spreadsheet_id:
+            keys.append(("spreadsheet", spreadsheet_id))
+        return keys
+
+    def acquire(self, account, spreadsheet_id=None):
+        """Block until one request for this account/spreadsheet may be sent; returns the time waited"""
+        keys = self.bucket_keys(account, spreadsheet_id)
+        with self.lock:
+            now = time.time()
+            if self.shared is not None:
+                delay = self.shared.reserve(self, keys, now)
+            else:
+                delay = max(self._bucket(key).reserve(now) for key in keys)
+            if delay:
+                self.waiting += 1
+        if not delay:
+            return 0.0
+        count("ratelimit.throttled")
+        try:
+            time.sleep(delay)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+        observe("ratelimit.wait", delay)
+        return delay
+
+    def wait_estimate(self, account=None, spreadsheet_id=None):
+        """Seconds a new request would wait behind the given account/spreadsheet (the busiest bucket if neither is given)"""
+        wanted = set(self.bucket_keys(account, spreadsheet_id))
+        with self.lock:
+            now = time.time()
+            buckets = self.shared.buckets(self) if self.shared is not None else self.buckets
+            return max(
+                (bucket.wait_estimate(now) for key, bucket in buckets.items()
+                 if key in wanted or (account is None and spreadsheet_id is None)),
+                default=0.0
+            )
+
+@functools.lru_cache(maxsize=None)
+def get_rate_limiter():
+    """Rate limiter shared by every session, and through RATE_LIMIT_PATH with the CLI"""
+    return RateLimiter(path=RATE_LIMIT_PATH)
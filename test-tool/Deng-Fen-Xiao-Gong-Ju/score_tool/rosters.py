@@ -0,0 +1,56 @@
+"""Class rosters: which seat numbers exist in each class"""
+
+import functools
+import json
+import os
+
+# Class rosters: one JSON list of seat numbers per class in rosters/<class>.json
+ROSTER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rosters")
+DEFAULT_CLASS = "default"
+
+def initialize_dict(seats):
+    """Initialize dictionary with all keys set to None"""
+    return {k: None for k in seats}
+
+class Roster:
+    """Seat numbers of one class with precomputed lookup structures"""
+
+    def __init__(self, class_id, seats):
+        self.class_id = class_id
+        # Sorted seat order (sheet row order) and membership set are built once per roster file
+        self.seats = tuple(sorted(set(int(seat) for seat in seats)))
+        self.seat_set = frozenset(self.seats)
+        # Seat -> 0-based position, i.e. sheet row = index + 2
+        self.row_index = {seat: idx for idx, seat in enumerate(self.seats)}
+
+    def __len__(self):
+        return len(self.seats)
+
+    def __contains__(self, seat):
+        return seat in self.seat_set
+
+@functools.lru_cache(maxsize=16)
+def list_classes(roster_dir=ROSTER_DIR, dir_mtime=None):
+    """List class ids that have a roster file (re-listed when the directory changes)"""
+    if not os.path.isdir(roster_dir):
+        return []
+    return sorted(
+        entry.name[:-len(".json")]
+        for entry in os.scandir(roster_dir)
+        if entry.is_file() and entry.name.endswith(".json")
+    )
+
+@functools.lru_cache(maxsize=1024)
+def load_roster(class_id, roster_mtime=None):
+    """Load and index a class roster (cached until the file changes)"""
+    with open(os.path.join(ROSTER_DIR, f"{class_id}.json"), "r", encoding="utf-8") as f:
+        return Roster(class_id, json.load(f))
+
+def get_roster(class_id):
+    """Cached roster for a class"""
+    return load_roster(class_id, os.path.getmtime(os.path.join(ROSTER_DIR, f"{class_id}.json")))
+
+def get_class_ids():
+    """Class ids with a roster file"""
+    mtime = os.path.getmtime(ROSTER_DIR) if os.path.isdir(ROSTER_DIR) else None
+    return list_classes(ROSTER_DIR, mtime)
@@ -0,0 +1,181 @@
+"""Local columnar copy of an uploaded grade sheet, so past exams can be analysed without Google Sheets
+
+The copy of one worksheet is a directory with seats.npy (the seat number of each sheet row,
+-1 where column A is not a number), one float32 array per exam column (col_0002.npy for
+column B and so on; NaN for blank or non-numeric cells) and meta.json with the column titles.
+Arrays are memory-mapped when read. A refresh reads the header row and the seat column in one
+request; when the seats and the titles already cached are unchanged only the new columns are
+downloaded (one more request), otherwise the whole sheet is.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .metrics import count, timer
+from .sheets import get_column_letter, get_google_sheets_client, open_target_worksheet
+
+SHEET_CACHE_DIR = os.environ.get("SCORE_SHEET_CACHE", "sheet_cache")
+
+def parse_cell(value):
+    """Score of a sheet cell as a float; NaN when blank or not a number"""
+    try:
+        return float(str(value).strip())
+    except ValueError:
+        return float("nan")
+
+def parse_seat(value):
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        return -1
+
+class SheetCache:
+    """Cached columns of one worksheet ("<spreadsheet id>/<worksheet>", None = the first sheet)"""
+
+    def __init__(self, spreadsheet_id, worksheet=None, root=SHEET_CACHE_DIR):
+        self.spreadsheet_id = spreadsheet_id
+        self.worksheet = worksheet
+        digest = hashlib.sha1(f"{spreadsheet_id}/{worksheet or ''}".encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(root, digest)
+        self.lock = threading.Lock()
+        self.meta = None
+        self._matrix = None
+
+    def _load_meta(self):
+        if self.meta is None:
+            try:
+                with open(os.path.join(self.path, "meta.json"), "r", encoding="utf-8") as f:
+                    self.meta = json.load(f)
+            except (OSError, ValueError):
+                self.meta = {"titles": [], "refreshed": None}
+        return self.meta
+
+    def _save_meta(self, meta):
+        # Written last and atomically: the arrays it lists are already on disk
+        path = os.path.join(self.path, "meta.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        self.meta = meta
+
+    def _column_path(self, index):
+        return os.path.join(self.path, f"col_{index + 2:04d}.npy")
+
+    @property
+    def titles(self):
+        return list(self._load_meta()["titles"])
+
+    @property
+    def refreshed(self):
+        """Time of the last refresh, None if never downloaded"""
+        return self._load_meta()["refreshed"]
+
+    def seats(self):
+        """Seat number per sheet row (memory-mapped)"""
+        import numpy as np
+        if not self.titles:
+            return np.empty(0, dtype=np.int32)
+        return np.load(os.path.join(self.path, "seats.npy"), mmap_mode="r")
+
+    def column(self, index):
+        """Scores of the index-th exam column (memory-mapped)"""
+        import numpy as np
+        return np.load(self._column_path(index), mmap_mode="r")
+
+    def matrix(self):
+        """(exams × rows) float matrix of every cached column, kept until the next refresh"""
+        import numpy as np
+        with self.lock:
+            if self._matrix is None:
+                titles = self.titles
+                columns = [self.column(i) for i in range(len(titles))]
+                self._matrix = np.vstack(columns) if columns else np.empty((0, len(self.seats())))
+            return self._matrix
+
+    def trend(self, seat):
+        """[(title, score or None)] of one seat across the cached exams"""
+        import numpy as np
+        rows = np.flatnonzero(np.asarray(self.seats()) == seat)
+        if not len(rows):
+            return []
+        values = self.matrix()[:, rows[0]]
+        return [(title, None if np.isnan(value) else float(value)) for title, value in zip(self.titles, values)]
+
+    def refresh(self, worksheet, full=False):
+        """Bring the copy up to date with a gspread worksheet; returns (mode, columns downloaded)
+
+        mode is "unchanged", "incremental" (only new columns) or "full".
+        """
+        import numpy as np
+        with self.lock, timer("sheet_cache.refresh"):
+            known = self._load_meta()["titles"]
+            header_rows, seat_rows = worksheet.batch_get(["1:1", "A:A"])
+            header = [str(title).strip() for title in (header_rows[0] if header_rows else [])]
+            while header and not header[-1]:
+                header.pop()
+            titles = header[1:]
+            seats = np.array([parse_seat(row[0] if row else "") for row in seat_rows[1:]], dtype=np.int32)
+            cached_seats = np.load(os.path.join(self.path, "seats.npy")) if known else None
+
+            if not full and cached_seats is not None and np.array_equal(seats, cached_seats) \
+                    and titles[:len(known)] == known:
+                start = len(known)
+                if start == len(titles):
+                    mode, rows = "unchanged", []
+                else:
+                    mode = "incremental"
+                    rows = worksheet.batch_get([
+                        f"{get_column_letter(start + 2)}2:{get_column_letter(len(titles) + 1)}{len(seats) + 1}"
+                    ])[0]
+            else:
+                mode, start = "full", 0
+                rows = [row[1:] for row in worksheet.get_all_values()[1:len(seats) + 1]]
+
+            os.makedirs(self.path, exist_ok=True)
+            for offset in range(len(titles) - start):
+                values = [row[offset] if offset < len(row) else "" for row in rows]
+                values += [""] * (len(seats) - len(values))
+                column = np.array([parse_cell(value) for value in values], dtype=np.float32)
+                np.save(self._column_path(start + offset), column)
+            if mode == "full":
+                np.save(os.path.join(self.path, "seats.npy"), seats)
+                # Columns beyond the sheet's current width are left over from an earlier, wider copy
+                for index in range(len(titles), len(known)):
+                    try:
+                        os.remove(self._column_path(index))
+                    except OSError:
+                        pass
+            self._save_meta({
+                "spreadsheet_id": self.spreadsheet_id,
+                "worksheet": self.worksheet,
+                "titles": titles,
+                "refreshed": time.time(),
+            })
+            self._matrix = None
+        count(f"sheet_cache.{mode}")
+        return mode, len(titles) - start
+
+@functools.lru_cache(maxsize=None)
+def get_sheet_cache(spreadsheet_id, worksheet=None, root=SHEET_CACHE_DIR):
+    """Cache of one worksheet, shared by the whole process"""
+    return SheetCache(spreadsheet_id, worksheet, root)
+
+def pull_sheet(target, uploaded_credentials=None, full=False):
+    """Refresh the local copy of an UploadTarget's worksheet; returns (success, message)"""
+    cache = get_sheet_cache(target.spreadsheet_id, target.worksheet)
+    try:
+        client, error = get_google_sheets_client(uploaded_credentials)
+        if error:
+            return False, error
+        mode, columns = cache.refresh(open_target_worksheet(client, target.spreadsheet_id, target.worksheet), full)
+    except Exception as e:
+        return False, f"下載失敗: {str(e)}"
+    if mode == "unchanged":
+        return True, f"「{target.label}」沒有新的考試（共 {len(cache.titles)} 次）"
+    if mode == "incremental":
+        return True, f"已下載「{target.label}」的 {columns} 次新考試（共 {len(cache.titles)} 次）"
+    return True, f"已下載「{target.label}」全部 {columns} 次考試"
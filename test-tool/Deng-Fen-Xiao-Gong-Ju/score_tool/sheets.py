@@ -0,0 +1,1035 @@
+"""Google Sheets access: cached clients, batched column uploads and the background upload queue"""
+
+import contextvars
+import functools
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from .metrics import count, export_metrics, timed, timer
+from .outbox import get_outbox
+from .ratelimit import get_rate_limiter
+from .rosters import DEFAULT_CLASS
+from .storage import get_storage
+from .sync import get_sync_state
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SPREADSHEET_NAME = "登分小工具 - 成績記錄"
+
+SERVICE_ACCOUNT_SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive'
+]
+# Cached Sheets clients: refresh connector tokens this many seconds before expiry
+CLIENT_EXPIRY_MARGIN = 60
+REPLIT_TOKEN_TTL = 30 * 60
+
+# Worksheets opened for reads and delta syncs are reused for this long (seconds)
+WORKSHEET_CACHE_TTL = 10 * 60
+
+# Background uploads: worker count and backoff for network / quota (429) / server errors,
+# which are retried until they succeed. An exam going to several targets runs one job per
+# target, so there are enough workers for a typical fan-out (three targets) to run side by side
+UPLOAD_WORKERS = 4
+UPLOAD_BACKOFF_BASE = 2.0
+UPLOAD_BACKOFF_MAX = 60.0
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+# Finished uploads stay listed (for the status panel) at most this long unless a session clears them
+FINISHED_JOB_TTL = 60 * 60
+
+# gspread, google-auth and requests are a large share of a cold start, so they are imported on the
+# first upload; SCORE_PREWARM_IMPORTS=0 turns off loading them in the background after the first render
+PREWARM_IMPORTS = os.environ.get("SCORE_PREWARM_IMPORTS", "1") != "0"
+
+@functools.lru_cache(maxsize=None)
+def load_google_stack():
+    """Import gspread and the google-auth / requests modules it needs, timed as sheets.import
+
+    A caller racing the prewarm thread blocks on the import lock until the modules are complete.
+    """
+    with timer("sheets.import"):
+        import gspread
+        import google.auth.exceptions
+        import google.oauth2.credentials
+        import google.oauth2.service_account
+        import requests
+    return gspread
+
+@functools.lru_cache(maxsize=None)
+def prewarm_imports():
+    """Load the Google stack in a daemon thread so the first upload does not wait for it (once per process)"""
+    if not PREWARM_IMPORTS:
+        return None
+    thread = threading.Thread(target=load_google_stack, name="prewarm-imports", daemon=True)
+    thread.start()
+    return thread
+
+def get_column_letter(col_index):
+    """Convert column index to column letter(s) (1->A, 27->AA, etc.)"""
+    result = ""
+    while col_index > 0:
+        col_index -= 1
+        result = chr(65 + (col_index % 26)) + result
+        col_index //= 26
+    return result
+
+def find_free_column(header):
+    """Return the 1-based index of the first column with an empty header cell (column A holds seat numbers)"""
+    for col_idx, title in enumerate(header[1:], start=2):
+        if not str(title).strip():
+            return col_idx
+    return max(len(header), 1) + 1
+
+def parse_score_cell(value):
+    """Whole-number score of a sheet cell; None when blank or not a whole number"""
+    try:
+        number = float(str(value).strip())
+    except ValueError:
+        return None
+    return int(number) if number.is_integer() else None
+
+def sheet_row_seats(seat_rows):
+    """Seat of each sheet row from row 2, read from column A (the rows of a `A2:A` range)
+
+    Rows without a seat number get a negative placeholder (-row number), so that list
+    position + 2 stays the sheet row.
+    """
+    seats = []
+    for row_no, seat_row in enumerate(seat_rows, start=2):
+        seat = parse_score_cell(seat_row[0]) if seat_row else None
+        seats.append(seat if seat is not None and seat > 0 else -row_no)
+    return seats
+
+def build_upload_batch(header, seat_rows, numbers_dict, column_title, seats, target_col=None):
+    """Build the batch_update payload for one exam column, each score in the row of its seat
+
+    `header` is row 1 and `seat_rows` column A below it, as read from the sheet. Seats are
+    matched to the rows that already carry their number; seats the sheet does not list yet
+    are appended below the last row (an empty sheet gets the whole seat column).
+    Returns (col_index, data, rows): rows is the seat of each sheet row from row 2, with a
+    negative placeholder for rows that hold no seat of `seats`, as recorded in the sync state.
+
+    When retrying, `target_col` is the column picked by the earlier attempt; it is reused if it already
+    carries our title so a write that succeeded on Google's side is not duplicated into a new column.
+    """
+    data = []
+    
+    if not any(str(title).strip() for title in header):
+        data.append({"range": "A1", "values": [["座號"]] + [[key] for key in seats]})
+        header = ["座號"]
+        rows = list(seats)
+    else:
+        wanted = set(seats)
+        rows, placed = [], set()
+        for row_no, seat in enumerate(sheet_row_seats(seat_rows), start=2):
+            # Rows of other rosters, and repeats of a seat, are left alone
+            if seat in wanted and seat not in placed:
+                placed.add(seat)
+            else:
+                seat = -row_no
+            rows.append(seat)
+        missing = [key for key in seats if key not in placed]
+        if missing:
+            data.append({"range": f"A{len(rows) + 2}", "values": [[key] for key in missing]})
+            rows.extend(missing)
+    
+    if target_col and target_col <= len(header) and header[target_col - 1] == column_title:
+        col_index = target_col
+    else:
+        col_index = find_free_column(header)
+    col_letter = get_column_letter(col_index)
+    score_data = [[column_title]]
+    for key in rows:
+        value = numbers_dict.get(key)
+        score_data.append([value if value is not None else ""])
+    data.append({"range": f"{col_letter}1", "values": score_data})
+    
+    return col_index, data, rows
+
+class SheetsClientPool:
+    """Process-wide cache of authorized gspread clients, keyed by credential source and identity.
+
+    Service-account clients refresh their own tokens through google-auth, so they
+    are kept until evicted. Replit connector tokens cannot be refreshed locally and
+    are re-fetched shortly before they expire.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.authorizing = threading.Lock()
+        self.clients = {}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.clients.get(key)
+            if entry is None:
+                return None
+            client, expires_at = entry
+            if expires_at is not None and expires_at - CLIENT_EXPIRY_MARGIN <= time.time():
+                del self.clients[key]
+                return None
+        count("sheets.client.pool_hit")
+        return client
+
+    def get_or_create(self, key, authorize, expires_at=None):
+        """Cached client for `key`, authorized once even when several upload workers ask for it at the same time"""
+        client = self.get(key)
+        if client is not None:
+            return client
+        with self.authorizing:
+            client = self.get(key)
+            if client is None:
+                client = self.put(key, authorize(), expires_at)
+        return client
+
+    def put(self, key, client, expires_at=None):
+        count("sheets.client.authorized")
+        instrument_client(client, client_account(client, key))
+        with self.lock:
+            self.clients[key] = (client, expires_at)
+        return client
+
+    def evict(self, source, identity=None):
+        """Drop cached clients for a credential source (optionally only one identity)"""
+        with self.lock:
+            for key in list(self.clients):
+                if key[0] == source and (identity is None or key[1:] == identity):
+                    del self.clients[key]
+
+@functools.lru_cache(maxsize=None)
+def get_client_pool():
+    """Client pool shared by every session"""
+    return SheetsClientPool()
+
+def service_account_identity(creds_dict):
+    """Identity of a service-account key used as part of the client cache key"""
+    return (creds_dict.get('client_email'), creds_dict.get('private_key_id'))
+
+def authorize_service_account(creds_dict):
+    """Create a gspread client from a service-account info dict"""
+    import gspread
+    from google.oauth2.service_account import Credentials as ServiceAccountCredentials
+    credentials = ServiceAccountCredentials.from_service_account_info(
+        creds_dict,
+        scopes=SERVICE_ACCOUNT_SCOPES
+    )
+    return gspread.authorize(credentials)
+
+def parse_token_expiry(expires_at):
+    """Parse the connector's expires_at (ISO 8601) into a timestamp, defaulting to a fixed TTL"""
+    try:
+        return datetime.fromisoformat(str(expires_at).replace('Z', '+00:00')).timestamp()
+    except (TypeError, ValueError):
+        return time.time() + REPLIT_TOKEN_TTL
+
+def api_call_name(method, endpoint):
+    """Short name of a Sheets/Drive request for metrics, e.g. values.batchUpdate or spreadsheets.get"""
+    path = endpoint.split("?", 1)[0]
+    if "/spreadsheets/" not in path:
+        return "drive.files" if "/drive/" in path else "other"
+    resource = path.split("/spreadsheets/", 1)[1]
+    if "/" not in resource:
+        # {id} or {id}:batchUpdate
+        return "spreadsheets." + (resource.split(":", 1)[1] if ":" in resource else method.lower())
+    rest = resource.split("/", 1)[1]
+    if rest.startswith("values:"):
+        return "values." + rest[len("values:"):]
+    if rest.startswith("values/"):
+        # Ranges are URL-quoted, so a ':' here introduces the action (append, clear)
+        if ":" in rest:
+            return "values." + rest.rsplit(":", 1)[1]
+        return "values." + {"GET": "get", "PUT": "update"}.get(method.upper(), method.lower())
+    return "spreadsheets." + rest.split("/", 1)[0].split(":", 1)[0]
+
+def endpoint_spreadsheet_id(endpoint):
+    """Spreadsheet a Sheets API URL refers to; None for Drive and other requests"""
+    if "/spreadsheets/" not in endpoint:
+        return None
+    resource = endpoint.split("/spreadsheets/", 1)[1]
+    for separator in "/:?":
+        resource = resource.split(separator, 1)[0]
+    return resource or None
+
+def client_account(client, key):
+    """Quota identity of a pooled client: its service-account email, else the credential source"""
+    auth = getattr(getattr(client, "http_client", None), "auth", None)
+    return getattr(auth, "service_account_email", None) or ":".join(map(str, key[:2]))
+
+def instrument_client(client, account):
+    """Route every HTTP request a gspread client sends through the shared rate limiter and time it
+
+    API call counts come with the timings. Requests wait for a token of `account` and of the
+    spreadsheet they touch, so concurrent sessions queue up instead of running into 429s.
+    """
+    http_client = getattr(client, "http_client", None)
+    if http_client is None or getattr(http_client, "instrumented", False):
+        return client
+    request = http_client.request
+    
+    def timed_request(method, endpoint, *args, **kwargs):
+        name = api_call_name(method, endpoint)
+        get_rate_limiter().acquire(account, endpoint_spreadsheet_id(endpoint))
+        with timer("sheets_api." + name):
+            try:
+                return request(method, endpoint, *args, **kwargs)
+            except Exception:
+                count("sheets_api.errors")
+                raise
+    
+    http_client.request = timed_request
+    http_client.instrumented = True
+    return client
+
+@timed("sheets.client")
+def get_google_sheets_client(uploaded_credentials=None):
+    """Get Google Sheets client using Replit connection, uploaded credentials, Streamlit Secrets, or local secrets.json
+
+    Uploaded credentials are passed in explicitly so this also works from upload worker threads.
+    """
+    pool = get_client_pool()
+    try:
+        load_google_stack()
+        hostname = os.environ.get('REPLIT_CONNECTORS_HOSTNAME')
+        x_replit_token = None
+        
+        repl_identity = os.environ.get('REPL_IDENTITY')
+        web_repl_renewal = os.environ.get('WEB_REPL_RENEWAL')
+        
+        # Try Replit connection first
+        if repl_identity:
+            x_replit_token = 'repl ' + repl_identity
+        elif web_repl_renewal:
+            x_replit_token = 'depl ' + web_repl_renewal
+        
+        if x_replit_token and hostname:
+            key = ('replit', hostname, x_replit_token)
+            client = pool.get(key)
+            if client is not None:
+                return client, None
+            
+            url = f'https://{hostname}/api/v2/connection?include_secrets=true&connector_names=google-sheet'
+            headers = {
+                'Accept': 'application/json',
+                'X_REPLIT_TOKEN': x_replit_token
+            }
+            
+            try:
+                import gspread
+                import requests
+                from google.oauth2.credentials import Credentials
+                response = requests.get(url, headers=headers, timeout=10)
+                if response.status_code == 200:
+                    data = response.json()
+                    items = data.get('items', [])
+                    
+                    if items:
+                        connection_settings = items[0]
+                        settings = connection_settings.get('settings', {})
+                        access_token = settings.get('access_token')
+                        
+                        if not access_token:
+                            oauth_creds = settings.get('oauth', {}).get('credentials', {})
+                            access_token = oauth_creds.get('access_token')
+                        
+                        if access_token:
+                            credentials = Credentials(token=access_token)
+                            client = gspread.authorize(credentials)
+                            return pool.put(key, client, parse_token_expiry(settings.get('expires_at'))), None
+            except Exception:
+                pass
+        
+        # Try credentials uploaded in the session
+        try:
+            if uploaded_credentials:
+                creds_dict = uploaded_credentials
+                key = ('uploaded',) + service_account_identity(creds_dict)
+                return pool.get_or_create(key, lambda: authorize_service_account(creds_dict)), None
+        except Exception:
+            pass
+        
+        # Try Streamlit Secrets (for Streamlit Cloud)
+        try:
+            import streamlit as st
+            if 'google_sheets_credentials' in st.secrets:
+                creds_dict = st.secrets['google_sheets_credentials']
+                if isinstance(creds_dict, str):
+                    creds_dict = json.loads(creds_dict)
+                key = ('secrets',) + service_account_identity(creds_dict)
+                return pool.get_or_create(key, lambda: authorize_service_account(creds_dict)), None
+        except Exception:
+            pass
+        
+        # Try local secrets.json file
+        try:
+            secrets_path = os.path.join(APP_DIR, 'secrets.json')
+            if os.path.exists(secrets_path):
+                # Keyed by mtime so an edited file is picked up without reading it every time
+                key = ('file', secrets_path, os.path.getmtime(secrets_path))
+                
+                def authorize():
+                    with open(secrets_path, 'r', encoding='utf-8') as f:
+                        creds_dict = json.load(f)
+                    pool.evict('file')
+                    return authorize_service_account(creds_dict)
+                
+                return pool.get_or_create(key, authorize), None
+        except Exception:
+            pass
+        
+        return None, "未找到Google Sheets認證信息。請上傳密鑰文件或在本地創建 secrets.json。"
+        
+    except Exception as e:
+        return None, f"連接Google Sheets時出錯: {str(e)}"
+
+def is_network_error(error):
+    """Whether a request failed before reaching Google (offline, DNS, timeouts, token refresh)"""
+    import requests
+    from google.auth.exceptions import TransportError
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, TransportError))
+
+def is_transient_error(error):
+    """Whether an upload error is worth retrying (quota 429, server 5xx, network failures)"""
+    if is_network_error(error):
+        return True
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status in RETRYABLE_STATUS_CODES
+
+def is_quota_error(error):
+    """Whether Google rejected a request for exceeding the per-minute quota"""
+    return getattr(getattr(error, 'response', None), 'status_code', None) == 429
+
+def open_worksheet(spreadsheet, worksheet_name=None, rows=1000):
+    """Worksheet by title, created if the spreadsheet does not have it yet; the first sheet for None"""
+    if not worksheet_name:
+        return spreadsheet.sheet1
+    import gspread
+    try:
+        return spreadsheet.worksheet(worksheet_name)
+    except gspread.WorksheetNotFound:
+        return spreadsheet.add_worksheet(worksheet_name, rows=rows, cols=26)
+
+def open_target_worksheet(client, spreadsheet_id, worksheet_name=None):
+    """Existing worksheet by title, or the first sheet for None"""
+    spreadsheet = client.open_by_key(spreadsheet_id)
+    return spreadsheet.worksheet(worksheet_name) if worksheet_name else spreadsheet.sheet1
+
+class WorksheetCache:
+    """Worksheets already opened per client, kept for WORKSHEET_CACHE_TTL seconds.
+
+    Opening a worksheet costs two metadata requests, more than the narrow reads made on it,
+    so listing a target's exams, loading one and syncing corrections back open it once.
+    A worksheet that fails a request is evicted and opened again next time.
+    """
+
+    def __init__(self, ttl=WORKSHEET_CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.worksheets = {}
+
+    def get(self, client, spreadsheet_id, worksheet_name=None):
+        key = (id(client), spreadsheet_id, worksheet_name or None)
+        with self.lock:
+            entry = self.worksheets.get(key)
+        if entry is not None and entry[0] is client and entry[2] > time.time():
+            count("sheets.worksheet.cache_hit")
+            return entry[1]
+        worksheet = open_target_worksheet(client, spreadsheet_id, worksheet_name)
+        with self.lock:
+            self.worksheets[key] = (client, worksheet, time.time() + self.ttl)
+        return worksheet
+
+    def evict(self, worksheet):
+        with self.lock:
+            for key, entry in list(self.worksheets.items()):
+                if entry[1] is worksheet:
+                    del self.worksheets[key]
+
+@functools.lru_cache(maxsize=None)
+def get_worksheet_cache():
+    """Worksheet cache shared by every session"""
+    return WorksheetCache()
+
+def open_upload_worksheet(spreadsheet_id, worksheet_name=None, uploaded_credentials=None):
+    """Worksheet of an upload target for list_exam_columns / load_exam_column, reused while cached
+
+    Returns (worksheet, error).
+    """
+    try:
+        client, error = get_google_sheets_client(uploaded_credentials)
+        if error:
+            return None, error
+        return get_worksheet_cache().get(client, spreadsheet_id, worksheet_name), None
+    except Exception as e:
+        return None, f"打開工作表失敗: {str(e)}"
+
+def upload_to_google_sheets(numbers_dict, column_title, spreadsheet_name, spreadsheet_id=None,
+                            uploaded_credentials=None, resume=None, seats=None, worksheet_name=None):
+    """Upload data to Google Sheets
+
+    Each score goes to the row whose column A holds its seat; seats the sheet does not list yet are
+    appended in the order of `seats` (the roster order), which defaults to the sorted keys of numbers_dict.
+    The column goes to the worksheet titled `worksheet_name` (created when missing), else the first sheet.
+
+    If `resume` is a dict, transient errors are raised instead of reported so the caller can retry,
+    and the chosen column is remembered in resume['col_index'] for the next attempt (the seat of
+    each sheet row in resume['rows']).
+    """
+    if seats is None:
+        seats = sorted(numbers_dict)
+    try:
+        client, error = get_google_sheets_client(uploaded_credentials)
+        if error:
+            return False, error
+        import gspread
+        
+        spreadsheet_found = False
+        spreadsheet = None
+        
+        if spreadsheet_id and spreadsheet_id.strip():
+            try:
+                spreadsheet = client.open_by_key(spreadsheet_id.strip())
+                spreadsheet_found = True
+            except Exception as id_error:
+                if resume is not None and is_transient_error(id_error):
+                    raise
+                return False, f"無法用ID打開試算表: {str(id_error)}"
+        else:
+            spreadsheet_name = spreadsheet_name.strip() if spreadsheet_name else DEFAULT_SPREADSHEET_NAME
+            
+            try:
+                spreadsheet = client.open(spreadsheet_name)
+                spreadsheet_found = True
+            except gspread.SpreadsheetNotFound:
+                spreadsheet_found = False
+            except Exception as open_error:
+                if resume is not None and is_transient_error(open_error):
+                    raise
+                return False, f"查找試算表時出錯: {str(open_error)}"
+            
+            if not spreadsheet_found:
+                try:
+                    spreadsheet = client.create(spreadsheet_name)
+                except Exception as create_error:
+                    return False, f"創建試算表時出錯: {str(create_error)}"
+        
+        try:
+            worksheet = open_worksheet(spreadsheet, worksheet_name, len(seats) + 1)
+        except Exception as ws_error:
+            if resume is not None and is_transient_error(ws_error):
+                raise
+            return False, f"訪問工作表時出錯: {str(ws_error)}"
+        
+        # One read of the header row and seat column, one batched write for everything else
+        target_col = resume.get('col_index') if resume is not None else None
+        header, seat_rows = worksheet.batch_get(["1:1", "A2:A"])
+        col_index, data, rows = build_upload_batch(
+            header[0] if header else [], seat_rows, numbers_dict, column_title, seats, target_col
+        )
+        if resume is not None:
+            resume['col_index'] = col_index
+            resume['rows'] = rows
+        
+        needed_rows = len(rows) + 1
+        if col_index > worksheet.col_count or needed_rows > worksheet.row_count:
+            worksheet.resize(rows=max(worksheet.row_count, needed_rows), cols=max(worksheet.col_count, col_index))
+        
+        worksheet.batch_update(data)
+        
+        place = f"{spreadsheet_name or spreadsheet.title}（{worksheet.title}）" if worksheet_name else spreadsheet_name
+        msg = f"成功上傳到Google Sheets！\n試算表：{place}\n列名：{column_title}"
+        return True, msg
+        
+    except Exception as e:
+        if resume is not None and is_transient_error(e):
+            raise
+        return False, f"上傳失敗: {str(e)}"
+
+def sync_changes_to_google_sheets(numbers_dict, sync_state, uploaded_credentials=None, resume=None):
+    """Write only the seats that changed since the last upload/sync into the already-uploaded column
+
+    `sync_state` is one target's entry from SyncStateStore.get(). The column header is checked
+    first so a moved or renamed column is never overwritten; the changed cells then go out
+    in one batch_update. The written {seat: value} entries are returned in resume['synced'].
+    """
+    synced = sync_state["synced"]
+    dirty = {k: numbers_dict.get(k) for k in sync_state["seats"] if numbers_dict.get(k) != synced.get(k)}
+    if not dirty:
+        return True, "沒有需要同步的修改"
+    
+    try:
+        client, error = get_google_sheets_client(uploaded_credentials)
+        if error:
+            return False, error
+        
+        worksheet = get_worksheet_cache().get(client, sync_state["spreadsheet_id"], sync_state.get("worksheet"))
+        col_letter = get_column_letter(sync_state["column"])
+        
+        try:
+            if worksheet.acell(f"{col_letter}1").value != sync_state["title"]:
+                return False, f"試算表中 {col_letter} 欄的標題已不是「{sync_state['title']}」，請重新上傳整欄"
+            
+            row_index = {seat: idx for idx, seat in enumerate(sync_state["seats"])}
+            data = [
+                {"range": f"{col_letter}{row_index[k] + 2}", "values": [[value if value is not None else ""]]}
+                for k, value in sorted(dirty.items())
+            ]
+            worksheet.batch_update(data)
+        except Exception:
+            get_worksheet_cache().evict(worksheet)
+            raise
+        
+        if resume is not None:
+            resume['synced'] = dirty
+        return True, f"已同步 {len(dirty)} 筆修改到「{sync_state['title']}」"
+        
+    except Exception as e:
+        if resume is not None and is_transient_error(e):
+            raise
+        return False, f"同步失敗: {str(e)}"
+
+def list_exam_columns(worksheet):
+    """Exam columns of a worksheet (from open_upload_worksheet) as [(column index, title)], read
+    from the header row only
+
+    Returns (columns, error).
+    """
+    try:
+        header = worksheet.row_values(1)
+    except Exception as e:
+        get_worksheet_cache().evict(worksheet)
+        return None, f"讀取標題列失敗: {str(e)}"
+    columns = [(col_idx, str(title).strip()) for col_idx, title in enumerate(header[1:], start=2)]
+    return [(col_idx, title) for col_idx, title in columns if title], None
+
+def load_exam_column(worksheet, col_index, column_title):
+    """Read one uploaded exam column for editing: the seat column and that column, in one two-range request
+
+    `worksheet` is the one the columns were listed from, so loading costs this single request.
+    Returns (column, error); column is {"seats": seat of each sheet row (a negative placeholder
+    where column A holds no seat number), "values": {seat: score}, "skipped": seats whose cell
+    was not a whole number}. The header is checked, so a column that moved since it was listed
+    is never loaded under the wrong title.
+    """
+    col_letter = get_column_letter(col_index)
+    try:
+        seat_rows, column_rows = worksheet.batch_get(["A2:A", f"{col_letter}1:{col_letter}"])
+    except Exception as e:
+        get_worksheet_cache().evict(worksheet)
+        return None, f"讀取欄位失敗: {str(e)}"
+    
+    title = str(column_rows[0][0]).strip() if column_rows and column_rows[0] else ""
+    if title != column_title:
+        return None, f"試算表中 {col_letter} 欄的標題已不是「{column_title}」，請重新讀取考試列表"
+    
+    seats, values, skipped = sheet_row_seats(seat_rows), {}, []
+    cells = column_rows[1:]
+    for row_no, seat in enumerate(seats, start=2):
+        if seat < 0:
+            continue
+        cell = cells[row_no - 2][0] if row_no - 2 < len(cells) and cells[row_no - 2] else ""
+        if not str(cell).strip():
+            continue
+        value = parse_score_cell(cell)
+        if value is None:
+            skipped.append(seat)
+        else:
+            values[seat] = value
+    return {"seats": seats, "values": values, "skipped": skipped}, None
+
+class UploadJob:
+    """One queued upload to one target and its progress
+
+    `mode` is "column" for a full new column or "delta" for syncing changed seats only.
+    Jobs of the same exam going to several targets share a `group`.
+    """
+
+    def __init__(self, key, numbers_dict, column_title, spreadsheet_id, uploaded_credentials, seats, class_id,
+                 mode="column", worksheet=None, target_name=None, group=None, sync_key=None):
+        self.id = key[:12]
+        self.key = key
+        self.mode = mode
+        self.class_id = class_id
+        self.numbers_dict = numbers_dict
+        self.seats = seats
+        self.column_title = column_title
+        self.spreadsheet_id = spreadsheet_id
+        self.worksheet = worksheet
+        self.target_name = target_name
+        self.group = group
+        # Delta jobs: the sync state they bring up to date
+        self.sync_key = sync_key
+        self.uploaded_credentials = uploaded_credentials
+        self.credential_email = (uploaded_credentials or {}).get('client_email')
+        self.resume = {}
+        self.retry_timer = None
+        self.done = threading.Event()
+        # Worker attempts run in a copy of the submitting session's context (for its metrics)
+        self.context = contextvars.copy_context()
+        self.status = "queued"
+        self.attempts = 0
+        self.message = ""
+        self.next_retry = None
+        self.created = time.time()
+        self.finished = None
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running", "retrying")
+
+    @property
+    def target_label(self):
+        return self.target_name or self.worksheet or self.spreadsheet_id
+
+    def to_record(self):
+        """Outbox record: everything needed to redo the upload after a restart, minus credentials"""
+        return {
+            "mode": self.mode,
+            "class_id": self.class_id,
+            "numbers_dict": {str(k): v for k, v in self.numbers_dict.items()},
+            "seats": list(self.seats) if self.seats else None,
+            "column_title": self.column_title,
+            "spreadsheet_id": self.spreadsheet_id,
+            "worksheet": self.worksheet,
+            "target_name": self.target_name,
+            "group": self.group,
+            "sync_key": self.sync_key,
+            "credential_email": self.credential_email,
+            "resume": self.resume,
+            "status": self.status,
+            "attempts": self.attempts,
+            "message": self.message,
+            "created": self.created,
+        }
+
+    @classmethod
+    def from_record(cls, key, record):
+        job = cls(
+            key,
+            {int(k): v for k, v in record["numbers_dict"].items()},
+            record["column_title"],
+            record["spreadsheet_id"],
+            None,
+            tuple(record["seats"]) if record.get("seats") else None,
+            record["class_id"],
+            record.get("mode", "column"),
+            record.get("worksheet"),
+            record.get("target_name"),
+            record.get("group"),
+            # Delta jobs from before multiple targets synced the state keyed by the class
+            record.get("sync_key") or record["class_id"]
+        )
+        job.context = contextvars.Context()
+        job.credential_email = record.get("credential_email")
+        job.resume = dict(record.get("resume") or {})
+        if "synced" in job.resume:
+            job.resume["synced"] = {int(k): v for k, v in job.resume["synced"].items()}
+        job.attempts = record.get("attempts", 0)
+        job.message = record.get("message", "")
+        job.created = record.get("created", job.created)
+        if record.get("status") == "failed":
+            job.status = "failed"
+            job.done.set()
+        return job
+
+class UploadQueue:
+    """Background upload worker pool backed by a durable outbox.
+
+    Jobs are keyed by a hash of (mode, spreadsheet/worksheet, title, scores): submitting the
+    same upload again while it is queued, running or waiting to retry returns that job; once
+    it has finished the upload runs again, since re-uploading is then deliberate. Finished
+    jobs are dropped when a session has shown them (release) or after FINISHED_JOB_TTL. An exam going to
+    several targets becomes one job per target; the jobs run side by side on the shared
+    client and succeed, retry or fail independently. Every job is
+    written to the outbox before it runs and stays there until it succeeds (or fails
+    for good and is discarded), so uploads survive restarts and network outages.
+    Transient errors (network, quota, 5xx) are retried with capped exponential backoff
+    for as long as it takes; any other error fails the job. A waiting job does not hold a
+    worker (and can be discarded), and every success retries the waiting jobs at once
+    since connectivity is evidently back.
+
+    Successful column uploads are archived as exams in the storage backend (once per
+    group) and recorded in the sync state so later corrections can be sent as deltas.
+    """
+
+    def __init__(self, storage, sync_state, outbox=None, max_workers=UPLOAD_WORKERS):
+        self.storage = storage
+        self.sync_state = sync_state
+        self.outbox = outbox
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.archived = set()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="upload")
+
+    @staticmethod
+    def idempotency_key(numbers_dict, column_title, spreadsheet_id, mode="column", worksheet=None):
+        target = f"{spreadsheet_id}/{worksheet}" if worksheet else spreadsheet_id
+        payload = json.dumps(
+            [mode, target, column_title, sorted(numbers_dict.items())], separators=(",", ":")
+        )
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def restore(self):
+        """Re-queue the uploads a previous run left in the outbox
+
+        Records another live process is still running (the app server while the CLI runs,
+        or the other way round) are left to it.
+        """
+        if self.outbox is None:
+            return 0
+        restored = 0
+        for key, record in self.outbox.adopt().items():
+            with self.lock:
+                if key in self.jobs:
+                    continue
+                job = self.jobs[key] = UploadJob.from_record(key, record)
+            if job.active:
+                job.status = "queued"
+                self._schedule(job)
+                restored += 1
+        return restored
+
+    def submit(self, numbers_dict, column_title, spreadsheet_id, uploaded_credentials=None, seats=None,
+               class_id=DEFAULT_CLASS, mode="column", worksheet=None, target_name=None, group=None, sync_key=None):
+        key = self.idempotency_key(numbers_dict, column_title, spreadsheet_id, mode, worksheet)
+        with self.lock:
+            self._prune()
+            job = self.jobs.get(key)
+            if job is not None and job.active:
+                return job
+            job = UploadJob(
+                key, dict(numbers_dict), column_title, spreadsheet_id, uploaded_credentials, seats, class_id, mode,
+                worksheet, target_name, group, sync_key
+            )
+            self.jobs[key] = job
+        self._persist(job)
+        self._schedule(job)
+        return job
+
+    def submit_targets(self, numbers_dict, column_title, targets, uploaded_credentials=None, seats=None,
+                       class_id=DEFAULT_CLASS):
+        """Queue the same exam column for each UploadTarget; returns one job per target"""
+        group = self.idempotency_key(numbers_dict, column_title, class_id, "group")[:12]
+        return [
+            self.submit(
+                numbers_dict, column_title, target.spreadsheet_id, uploaded_credentials, seats, class_id,
+                worksheet=target.worksheet, target_name=target.label, group=group
+            )
+            for target in targets
+        ]
+
+    def submit_sync(self, numbers_dict, class_id=DEFAULT_CLASS, uploaded_credentials=None):
+        """Queue a delta sync of a class's changed seats into every target its exam went to; [] if never uploaded"""
+        states = self.sync_state.for_class(class_id)
+        group = self.idempotency_key(numbers_dict, class_id, class_id, "sync")[:12]
+        return [
+            self.submit(
+                numbers_dict, state["title"], state["spreadsheet_id"], uploaded_credentials,
+                tuple(state["seats"]), class_id, mode="delta", worksheet=state.get("worksheet"),
+                target_name=state.get("target_name"), group=group, sync_key=key
+            )
+            for key, state in states.items()
+        ]
+
+    def group(self, group):
+        """Jobs of one fan-out (the targets of one exam), in the order they were submitted"""
+        with self.lock:
+            jobs = [job for job in self.jobs.values() if group and job.group == group]
+        return sorted(jobs, key=lambda job: job.created)
+
+    def retry(self, job_id, uploaded_credentials=None):
+        """Run a failed job again (e.g. after uploading the missing key)"""
+        job = self.get(job_id)
+        if job is None or job.active:
+            return job
+        job.uploaded_credentials = uploaded_credentials or job.uploaded_credentials
+        job.credential_email = (job.uploaded_credentials or {}).get('client_email', job.credential_email)
+        job.status = "queued"
+        job.attempts = 0
+        job.message = ""
+        job.done.clear()
+        self._persist(job)
+        self._schedule(job)
+        return job
+
+    def retry_now(self):
+        """Skip the backoff of every waiting job"""
+        with self.lock:
+            waiting = [job for job in self.jobs.values() if job.retry_timer is not None]
+            for job in waiting:
+                job.retry_timer.cancel()
+                job.retry_timer = None
+        for job in waiting:
+            self._schedule(job)
+        return len(waiting)
+
+    def discard(self, job_id):
+        """Drop a finished, failed or waiting-to-retry job from the queue and the outbox"""
+        job = self.get(job_id)
+        if job is None:
+            return False
+        with self.lock:
+            # A job waiting for its retry is not running; cancelling its timer is enough to stop it
+            if job.status == "retrying" and job.retry_timer is not None:
+                job.retry_timer.cancel()
+                job.retry_timer = None
+                job.status = "failed"
+                job.next_retry = None
+                job.done.set()
+            elif job.active:
+                return False
+            self.jobs.pop(job.key, None)
+        if self.outbox is not None:
+            self.outbox.remove(job.key)
+        return True
+
+    def release(self, job_ids):
+        """Drop finished uploads whose outcome has been shown; failed ones stay in the outbox until retried or discarded"""
+        with self.lock:
+            for key, job in list(self.jobs.items()):
+                if job.id in job_ids and job.status == "success":
+                    del self.jobs[key]
+            self._prune()
+
+    def _prune(self):
+        # Caller holds self.lock
+        cutoff = time.time() - FINISHED_JOB_TTL
+        for key, job in list(self.jobs.items()):
+            if job.status == "success" and job.finished < cutoff:
+                del self.jobs[key]
+        self.archived &= {job.group or job.key for job in self.jobs.values()}
+
+    def wait(self, jobs, timeout=None):
+        """Block until the given jobs have finished or `timeout` seconds have passed (used by the CLI)"""
+        deadline = None if timeout is None else time.time() + timeout
+        for job in jobs:
+            job.done.wait(None if deadline is None else max(0, deadline - time.time()))
+
+    def get(self, job_id):
+        with self.lock:
+            for job in self.jobs.values():
+                if job.id == job_id:
+                    return job
+        return None
+
+    def outbox_jobs(self):
+        """Jobs currently kept in the outbox (pending or failed), oldest first"""
+        if self.outbox is None:
+            return []
+        with self.lock:
+            jobs = [job for key, job in self.jobs.items() if key in self.outbox]
+        return sorted(jobs, key=lambda job: job.created)
+
+    def _persist(self, job):
+        if self.outbox is not None:
+            self.outbox.put(job.key, job.to_record())
+
+    def _schedule(self, job, delay=0):
+        if delay:
+            job.retry_timer = threading.Timer(delay, self._retry_due, (job,))
+            job.retry_timer.daemon = True
+            job.retry_timer.start()
+        else:
+            self.executor.submit(job.context.copy().run, self._run, job)
+
+    def _retry_due(self, job):
+        # retry_now() may already have taken this job; only one of them resubmits it
+        with self.lock:
+            if job.retry_timer is None:
+                return
+            job.retry_timer = None
+        self._schedule(job)
+
+    def _run(self, job):
+        job.attempts += 1
+        job.status = "running"
+        try:
+            with timer(f"upload.{job.mode}"):
+                success, message = self._attempt(job)
+        except Exception as e:
+            if not is_transient_error(e):
+                # Anything else (a bug, a sync state that is gone) would fail the same way on every retry
+                success, message = False, f"上傳失敗: {str(e)}"
+            else:
+                delay = min(UPLOAD_BACKOFF_MAX, UPLOAD_BACKOFF_BASE * 2 ** min(job.attempts - 1, 10))
+                delay += random.uniform(0, delay / 4)
+                if is_quota_error(e):
+                    reason = "超過 Google Sheets 每分鐘請求配額"
+                elif is_network_error(e):
+                    reason = "無法連線到 Google（已存於待傳區，連線恢復後自動上傳）"
+                else:
+                    reason = f"暫時性錯誤: {str(e)}"
+                job.status = "retrying"
+                job.message = reason
+                job.next_retry = time.time() + delay
+                count("upload.retries")
+                self._persist(job)
+                with self.lock:
+                    self._schedule(job, delay)
+                return
+        
+        if success and job.mode == "delta":
+            self.sync_state.mark_synced(job.sync_key, job.resume.get('synced', {}))
+        elif success:
+            # The seat of each sheet row the column was written to, so deltas find the same rows
+            seats = job.resume.get('rows') or job.seats or sorted(job.numbers_dict)
+            self.sync_state.record_upload(
+                job.class_id, job.spreadsheet_id, job.resume['col_index'], job.column_title, seats, job.numbers_dict,
+                job.worksheet, job.target_name
+            )
+            # Every target of a group carries the same exam; it is archived by the first to succeed
+            with self.lock:
+                archive = (job.group or job.key) not in self.archived
+                self.archived.add(job.group or job.key)
+            if archive:
+                try:
+                    self.storage.archive_exam(job.class_id, job.column_title, job.numbers_dict)
+                except Exception:
+                    pass
+        job.status = "success" if success else "failed"
+        job.message = message
+        job.next_retry = None
+        job.finished = time.time()
+        if self.outbox is not None:
+            if success:
+                self.outbox.remove(job.key)
+            else:
+                self._persist(job)
+        job.done.set()
+        count(f"upload.{job.status}")
+        export_metrics()
+        if success:
+            self.retry_now()
+
+    def _attempt(self, job):
+        if job.mode == "delta":
+            sync_state = self.sync_state.get(job.sync_key)
+            if sync_state is None:
+                return False, "這次上傳的同步記錄已被清除（例如清空了所有值），請重新上傳整欄"
+            return sync_changes_to_google_sheets(
+                job.numbers_dict,
+                sync_state,
+                uploaded_credentials=job.uploaded_credentials,
+                resume=job.resume
+            )
+        return upload_to_google_sheets(
+            job.numbers_dict,
+            job.column_title,
+            "",
+            job.spreadsheet_id,
+            uploaded_credentials=job.uploaded_credentials,
+            resume=job.resume,
+            seats=job.seats,
+            worksheet_name=job.worksheet
+        )
+
+@functools.lru_cache(maxsize=None)
+def get_upload_queue():
+    """Upload queue shared by every session; uploads left in the outbox are resumed on first use"""
+    queue = UploadQueue(get_storage(), get_sync_state(), get_outbox())
+    queue.restore()
+    return queue
@@ -0,0 +1,223 @@
+"""Score statistics: running per-exam figures kept up to date entry by entry, cross-exam comparison
+and per-student trends"""
+
+import math
+
+# Histogram: buckets of 10 points; the last one collects 100 and above
+HISTOGRAM_BUCKET = 10
+HISTOGRAM_TOP = 100
+
+def bucket_label(index):
+    low = index * HISTOGRAM_BUCKET
+    return f"{low}+" if low >= HISTOGRAM_TOP else f"{low}-{low + HISTOGRAM_BUCKET - 1}"
+
+class ScoreStats:
+    """Running statistics of one exam's scores.
+
+    Each entry adjusts the count, sum, sum of squares, the count of its score and its histogram
+    bucket in O(1); min/max are only rescanned when the last copy of the extreme score goes away.
+    Median and percentiles walk the distinct scores, of which there are at most a few hundred
+    however many students there are.
+    """
+
+    def __init__(self, values=()):
+        self.count = 0
+        self.total = 0
+        self.total_sq = 0
+        self.value_counts = {}
+        self.buckets = [0] * (HISTOGRAM_TOP // HISTOGRAM_BUCKET + 1)
+        self.min = None
+        self.max = None
+        for value in values:
+            if value is not None:
+                self.add(value)
+
+    def _bucket(self, value):
+        return min(value // HISTOGRAM_BUCKET, len(self.buckets) - 1)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.total_sq += value * value
+        self.value_counts[value] = self.value_counts.get(value, 0) + 1
+        self.buckets[self._bucket(value)] += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def remove(self, value):
+        remaining = self.value_counts[value] - 1
+        self.count -= 1
+        self.total -= value
+        self.total_sq -= value * value
+        self.buckets[self._bucket(value)] -= 1
+        if remaining:
+            self.value_counts[value] = remaining
+            return
+        del self.value_counts[value]
+        if value == self.min:
+            self.min = min(self.value_counts, default=None)
+        if value == self.max:
+            self.max = max(self.value_counts, default=None)
+
+    def update(self, old, new):
+        """Account for one seat changing from `old` to `new` (either may be None)"""
+        if old == new:
+            return
+        if old is not None:
+            self.remove(old)
+        if new is not None:
+            self.add(new)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    @property
+    def std(self):
+        """Population standard deviation"""
+        if not self.count:
+            return None
+        mean = self.total / self.count
+        return math.sqrt(max(0.0, self.total_sq / self.count - mean * mean))
+
+    def percentiles(self, qs):
+        """Nearest-rank percentiles for each q in [0, 1], in one pass over the distinct scores"""
+        if not self.count:
+            return [None] * len(qs)
+        ranks = sorted((max(1, math.ceil(q * self.count)), i) for i, q in enumerate(qs))
+        results = [None] * len(qs)
+        seen = 0
+        pending = iter(ranks)
+        rank, index = next(pending)
+        for value in sorted(self.value_counts):
+            seen += self.value_counts[value]
+            while rank <= seen:
+                results[index] = value
+                try:
+                    rank, index = next(pending)
+                except StopIteration:
+                    return results
+        return results
+
+    def histogram(self):
+        """[(bucket label, count)] for every bucket, including empty ones"""
+        return [(bucket_label(i), n) for i, n in enumerate(self.buckets)]
+
+    def summary(self):
+        p25, median, p75 = self.percentiles((0.25, 0.5, 0.75))
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "std": self.std,
+            "min": self.min,
+            "p25": p25,
+            "median": median,
+            "p75": p75,
+            "max": self.max,
+            "histogram": self.histogram(),
+        }
+
+def compare_exams(seats, columns, movers=5):
+    """Compare exams of one class with numpy, one vectorized pass per figure.
+
+    `columns` is [(title, {seat: value})] oldest first, the current scores last. Returns
+    per-exam count/mean/std/median/min/max and, when there are at least two exams, how the
+    last one differs from the one before it: mean change, improved/declined counts, the
+    correlation between them and the seats that moved most.
+    """
+    import numpy as np
+
+    seats = list(seats)
+    matrix = np.array(
+        [[np.nan if scores.get(seat) is None else scores[seat] for seat in seats] for _, scores in columns],
+        dtype=float
+    ).reshape(len(columns), len(seats))
+    present = ~np.isnan(matrix)
+    counts = present.sum(axis=1)
+    filled = np.where(present, matrix, 0.0)
+    safe_counts = np.maximum(counts, 1)
+    means = filled.sum(axis=1) / safe_counts
+    stds = np.sqrt(np.maximum(0.0, (filled * filled).sum(axis=1) / safe_counts - means * means))
+    medians = [float(np.median(row[~np.isnan(row)])) if n else None for row, n in zip(matrix, counts)]
+    mins = np.where(present, matrix, np.inf).min(axis=1)
+    maxs = np.where(present, matrix, -np.inf).max(axis=1)
+    exams = [
+        {
+            "title": title,
+            "count": int(n),
+            "mean": float(means[i]) if n else None,
+            "std": float(stds[i]) if n else None,
+            "median": medians[i],
+            "min": float(mins[i]) if n else None,
+            "max": float(maxs[i]) if n else None,
+        }
+        for i, ((title, _), n) in enumerate(zip(columns, counts))
+    ]
+    result = {"exams": exams, "change": None, "movers": []}
+    if len(columns) < 2:
+        return result
+
+    previous, current = matrix[-2], matrix[-1]
+    both = present[-2] & present[-1]
+    delta = current - previous
+    change = {
+        "title": columns[-1][0],
+        "previous_title": columns[-2][0],
+        "seats": int(both.sum()),
+        "mean_delta": float(delta[both].mean()) if both.any() else None,
+        "improved": int((delta[both] > 0).sum()),
+        "declined": int((delta[both] < 0).sum()),
+        "correlation": None,
+    }
+    if both.sum() > 1 and previous[both].std() > 0 and current[both].std() > 0:
+        change["correlation"] = float(np.corrcoef(previous[both], current[both])[0, 1])
+    result["change"] = change
+    order = np.argsort(-np.abs(np.where(both, delta, 0.0)), kind="stable")[:movers]
+    result["movers"] = [
+        (seats[i], float(previous[i]), float(current[i]), float(delta[i])) for i in order if both[i] and delta[i]
+    ]
+    return result
+
+def student_trends(matrix):
+    """Per-student trend over an (exams × students) matrix, oldest exam first, NaN for missing scores.
+
+    Returns arrays with one entry per student: count, mean, last score, change from the
+    previous score they have, and slope (points per exam, least squares over the exams they
+    took). Figures a student has too few scores for are NaN.
+    """
+    import numpy as np
+
+    matrix = np.asarray(matrix, dtype=float)
+    exams = matrix.shape[0]
+    if not exams:
+        missing = np.full(matrix.shape[1], np.nan)
+        return {"count": np.zeros(matrix.shape[1], dtype=int), "mean": missing, "last": missing,
+                "change": missing, "slope": missing}
+    present = ~np.isnan(matrix)
+    counts = present.sum(axis=0)
+    safe_counts = np.maximum(counts, 1)
+    filled = np.where(present, matrix, 0.0)
+    means = filled.sum(axis=0) / safe_counts
+
+    x = np.arange(exams, dtype=float)[:, None]
+    x_means = np.where(present, x, 0.0).sum(axis=0) / safe_counts
+    dx = np.where(present, x - x_means, 0.0)
+    spread = (dx * dx).sum(axis=0)
+    slopes = (dx * (filled - means)).sum(axis=0) / np.where(spread > 0, spread, np.nan)
+
+    # Index of the last and second-to-last exam each student has a score for
+    taken = np.where(present, np.arange(exams)[:, None], -1)
+    last = taken.max(axis=0, initial=-1)
+    previous = np.where(taken == last, -1, taken).max(axis=0, initial=-1)
+    columns = np.arange(matrix.shape[1])
+    last_scores = np.where(last >= 0, matrix[np.maximum(last, 0), columns], np.nan)
+    previous_scores = np.where(previous >= 0, matrix[np.maximum(previous, 0), columns], np.nan)
+    return {
+        "count": counts,
+        "mean": np.where(counts > 0, means, np.nan),
+        "last": last_scores,
+        "change": last_scores - previous_scores,
+        "slope": slopes,
+    }
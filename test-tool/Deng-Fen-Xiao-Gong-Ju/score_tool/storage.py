@@ -0,0 +1,587 @@
+"""Score persistence: journaled JSON files (default) or SQLite"""
+
+import atexit
+import contextlib
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .metrics import observe, timed, timer
+from .rosters import DEFAULT_CLASS, get_roster, initialize_dict
+from .sync import file_lock
+
+SAVE_PATH = "numbers_dict.json"
+# Storage backend: "journal" (JSON snapshot + entry log, default) or "sqlite"
+STORAGE_BACKEND = os.environ.get("SCORE_STORAGE", "journal")
+SQLITE_PATH = os.environ.get("SCORE_DB_PATH", "scores.db")
+SQLITE_BUSY_TIMEOUT_MS = 5000
+
+# Entry journal tuning: fsync every N appends or T seconds, compact after M log records
+GROUP_COMMIT_SIZE = 16
+GROUP_COMMIT_INTERVAL = 2.0
+COMPACT_THRESHOLD = 500
+
+@contextlib.contextmanager
+def locked(lock):
+    """Hold a storage lock, recording how long the caller waited for it (contention between sessions)"""
+    start = time.perf_counter()
+    with lock:
+        observe("storage.lock_wait", time.perf_counter() - start)
+        yield
+
+class StorageLoadError(Exception):
+    """Stored scores exist but could not be read; callers show it instead of writing over the store"""
+
+def read_snapshot(snapshot_path):
+    """Mapping stored in a journal snapshot, None if there is none
+
+    Snapshots are replaced atomically, so one that cannot be parsed is damaged and the
+    error is raised rather than treating the class as empty.
+    """
+    if not os.path.exists(snapshot_path):
+        return None
+    with open(snapshot_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {int(k): (int(v) if v is not None else None) for k, v in data.items()}
+
+def file_stamp(path):
+    """(mtime, size, inode) of a file, None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+def read_log(log_path, data, offset=0):
+    """Apply the complete records of an entry log from `offset` on to `data`;
+    returns (data, records, offset just past the last complete record)"""
+    records = 0
+    good_offset = offset
+    if not os.path.exists(log_path):
+        return data, records, good_offset
+    with open(log_path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                key, value = json.loads(line)
+            except ValueError:
+                break
+            if data is None:
+                data = {}
+            data[int(key)] = int(value) if value is not None else None
+            good_offset += len(line)
+            records += 1
+    return data, records, good_offset
+
+def read_journal(snapshot_path, log_path):
+    """Snapshot + log of a journal on disk, read without opening it for writing"""
+    return read_log(log_path, read_snapshot(snapshot_path))[0]
+
+class EntryJournal:
+    """Append-only entry log on top of an atomically replaced JSON snapshot.
+
+    Every entry is appended to the log as one compact `[key, value]` line.
+    Appends are fsynced in groups (every GROUP_COMMIT_SIZE records, or every
+    GROUP_COMMIT_INTERVAL seconds by the shared JournalFlusher for journals from
+    get_journal), and once the log reaches COMPACT_THRESHOLD records it is folded
+    into a fresh snapshot written via os.replace.
+
+    The files are shared with other processes (the app server and CLI runs): every
+    read and write holds a lock file (`<snapshot>.lock`) and first takes in what the
+    others appended or compacted since, so no process folds a stale mapping into the
+    snapshot or truncates records it has not read. Entries taken in that way are also
+    kept for external_changes(), which is how the live boards pick them up.
+    """
+
+    def __init__(self, snapshot_path, log_path):
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.lock_path = snapshot_path + ".lock"
+        self.lock = threading.RLock()
+        self.file_locked = False
+        self.state = None
+        self.snapshot_stamp = None
+        self.log_offset = 0
+        self.log_file = None
+        self.log_records = 0
+        self.pending = 0
+        self.external = {}
+
+    def _replay_log(self, data, offset=0):
+        data, records, self.log_offset = read_log(self.log_path, data, offset)
+        self.log_records = self.log_records + records if offset else records
+        if os.path.exists(self.log_path) and os.path.getsize(self.log_path) != self.log_offset:
+            # Drop a partially written tail so new appends start on a clean line
+            with open(self.log_path, "r+b") as f:
+                f.truncate(self.log_offset)
+        return data
+
+    def _changed_on_disk(self):
+        return (file_stamp(self.snapshot_path) != self.snapshot_stamp
+                or (file_stamp(self.log_path) or (0, 0))[1] != self.log_offset)
+
+    def _refresh(self):
+        """Take in what other processes wrote since this one last looked (under the lock file)"""
+        if self.state is None:
+            self.snapshot_stamp = file_stamp(self.snapshot_path)
+            self.state = self._replay_log(read_snapshot(self.snapshot_path))
+            return
+        if not self._changed_on_disk():
+            return
+        log_size = (file_stamp(self.log_path) or (0, 0))[1]
+        if file_stamp(self.snapshot_path) == self.snapshot_stamp and log_size > self.log_offset:
+            changes = self._replay_log({}, self.log_offset)
+            self.state.update(changes)
+        else:
+            # Compacted or replaced by another process: read everything again
+            self.snapshot_stamp = file_stamp(self.snapshot_path)
+            state = self._replay_log(read_snapshot(self.snapshot_path)) or {}
+            changes = {k: state.get(k) for k in set(self.state) | set(state) if self.state.get(k) != state.get(k)}
+            self.state = state
+        self.external.update(changes)
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        """Hold the thread lock and, at the outermost level, the lock file shared with other processes"""
+        with locked(self.lock):
+            if self.file_locked:
+                yield
+                return
+            with file_lock(self.lock_path):
+                self.file_locked = True
+                try:
+                    self._refresh()
+                    yield
+                finally:
+                    self.file_locked = False
+
+    def _write_log(self, entries):
+        if self.log_file is None:
+            self.log_file = open(self.log_path, "ab")
+        data = "".join(
+            json.dumps([key, value], separators=(",", ":")) + "\n" for key, value in entries
+        ).encode("utf-8")
+        self.log_file.write(data)
+        self.log_file.flush()
+        self.log_offset += len(data)
+
+    def load(self):
+        """Return the current mapping (snapshot + replayed log), or None if nothing is stored"""
+        with self._exclusive():
+            return dict(self.state) if self.state is not None else None
+
+    def external_changes(self):
+        """{key: value} other processes stored since the last call (empty until this journal was loaded)"""
+        with self.lock:
+            if self.state is None or (not self.external and not self._changed_on_disk()):
+                return {}
+            with self._exclusive():
+                changes, self.external = self.external, {}
+                return changes
+
+    def has_external_changes(self):
+        """Cheap check (no locks) whether external_changes() may return something"""
+        return self.state is not None and (bool(self.external) or self._changed_on_disk())
+
+    def append(self, key, value):
+        """Record a single entry; durable after the next group commit"""
+        self.append_many([(key, value)])
+
+    def append_many(self, entries):
+        """Record several entries with one write"""
+        entries = list(entries)
+        with self._exclusive():
+            if self.state is None:
+                self.state = {}
+            self._write_log(entries)
+            self.state.update(entries)
+            # Written after whatever another process stored for these keys
+            for key, _ in entries:
+                self.external.pop(key, None)
+            self.log_records += len(entries)
+            self.pending += len(entries)
+            if self.pending >= GROUP_COMMIT_SIZE:
+                self.sync()
+            if self.log_records >= COMPACT_THRESHOLD:
+                self.compact()
+
+    def replace(self, numbers_dict):
+        """Replace the whole mapping (e.g. when clearing all values)"""
+        with self._exclusive():
+            # Log the full mapping first so a crash before compaction still replays to it
+            self._write_log(numbers_dict.items())
+            self.pending += 1
+            self.sync()
+            self.state = dict(numbers_dict)
+            self.external.clear()
+            self.compact()
+
+    def sync(self):
+        """fsync all appended records (group commit)"""
+        with self.lock:
+            if self.pending and self.log_file is not None:
+                with timer("storage.fsync"):
+                    os.fsync(self.log_file.fileno())
+            self.pending = 0
+
+    def compact(self):
+        """Fold the log (including records other processes appended) into a new snapshot and truncate the log"""
+        with self._exclusive():
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({str(k): v for k, v in self.state.items()}, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            self.snapshot_stamp = file_stamp(self.snapshot_path)
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
+            # Replaying entries already in the snapshot is harmless, so truncating after the replace is safe
+            with open(self.log_path, "w", encoding="utf-8") as f:
+                os.fsync(f.fileno())
+            self.log_offset = 0
+            self.log_records = 0
+            self.pending = 0
+
+class JournalFlusher:
+    """One background thread that group-commits every registered journal each GROUP_COMMIT_INTERVAL
+    seconds (and once more at exit), however many class journals are open"""
+
+    def __init__(self, interval=GROUP_COMMIT_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.journals = []
+        threading.Thread(target=self._loop, daemon=True).start()
+        atexit.register(self.sync_all)
+
+    def add(self, journal):
+        with self.lock:
+            self.journals.append(journal)
+
+    def sync_all(self):
+        with self.lock:
+            journals = list(self.journals)
+        for journal in journals:
+            journal.sync()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.sync_all()
+
+@functools.lru_cache(maxsize=None)
+def get_flusher():
+    return JournalFlusher()
+
+@functools.lru_cache(maxsize=None)
+def get_journal(snapshot_path=SAVE_PATH):
+    """Process-wide journal shared by every session"""
+    journal = EntryJournal(snapshot_path, snapshot_path + ".log")
+    get_flusher().add(journal)
+    return journal
+
+def class_save_path(class_id):
+    """Snapshot path for a class; the default class keeps the original numbers_dict.json"""
+    if class_id == DEFAULT_CLASS:
+        return SAVE_PATH
+    return f"numbers_dict.{class_id}.json"
+
+class JournalStorage:
+    """Scores kept as one journaled JSON file per class (current exam only, no history)"""
+
+    def load(self, class_id):
+        return get_journal(class_save_path(class_id)).load()
+
+    def replace(self, class_id, numbers_dict):
+        get_journal(class_save_path(class_id)).replace(numbers_dict)
+
+    def append(self, class_id, key, value):
+        get_journal(class_save_path(class_id)).append(key, value)
+
+    def append_many(self, class_id, entries):
+        get_journal(class_save_path(class_id)).append_many(entries)
+
+    def has_external_changes(self, class_id):
+        return get_journal(class_save_path(class_id)).has_external_changes()
+
+    def external_changes(self, class_id):
+        return get_journal(class_save_path(class_id)).external_changes()
+
+    def archive_exam(self, class_id, title, numbers_dict):
+        return None
+
+    def list_exams(self, class_id):
+        return []
+
+    def exam_scores(self, exam_id):
+        return {}
+
+class SQLiteStorage:
+    """Scores kept in an SQLite database in WAL mode.
+
+    Each class has one current exam (the working set edited in the UI); uploaded
+    exams are archived as further exam rows so their history can be queried.
+    Scores that are None are not stored: writing None deletes the seat's row.
+    The current scores of each class this process has loaded are remembered with the
+    database's data_version, so writes of other processes can be told apart from ours.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS class (
+            id TEXT PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS seat (
+            id INTEGER PRIMARY KEY,
+            class_id TEXT NOT NULL REFERENCES class(id),
+            seat_no INTEGER NOT NULL,
+            UNIQUE (class_id, seat_no)
+        );
+        CREATE TABLE IF NOT EXISTS exam (
+            id INTEGER PRIMARY KEY,
+            class_id TEXT NOT NULL REFERENCES class(id),
+            title TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            is_current INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS exam_current ON exam(class_id) WHERE is_current = 1;
+        CREATE INDEX IF NOT EXISTS exam_class ON exam(class_id, created_at);
+        CREATE TABLE IF NOT EXISTS score (
+            exam_id INTEGER NOT NULL REFERENCES exam(id) ON DELETE CASCADE,
+            seat_id INTEGER NOT NULL REFERENCES seat(id),
+            value INTEGER,
+            PRIMARY KEY (exam_id, seat_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS score_seat ON score(seat_id, exam_id);
+    """
+
+    UPSERT_SCORE = """
+        INSERT INTO score (exam_id, seat_id, value) VALUES (?, ?, ?)
+        ON CONFLICT (exam_id, seat_id) DO UPDATE SET value = excluded.value
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        # One shared connection; sqlite3 caches the prepared statements used below
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        self.conn.executescript(self.SCHEMA)
+        self.current_exams = {}
+        self.seat_ids = {}
+        # class_id -> [{seat: value} as last read or written here, data_version when read]
+        self.seen = {}
+
+    def _ensure_class(self, class_id):
+        """Return the current exam id of a class, creating the class (and importing its JSON file) on first use"""
+        exam_id = self.current_exams.get(class_id)
+        if exam_id is not None:
+            return exam_id
+        row = self.conn.execute(
+            "SELECT id FROM exam WHERE class_id = ? AND is_current = 1", (class_id,)
+        ).fetchone()
+        if row is None:
+            with self.conn:
+                self.conn.execute("INSERT OR IGNORE INTO class (id) VALUES (?)", (class_id,))
+                exam_id = self.conn.execute(
+                    "INSERT INTO exam (class_id, title, created_at, is_current) VALUES (?, '', ?, 1)",
+                    (class_id, time.time())
+                ).lastrowid
+            self.current_exams[class_id] = exam_id
+            self.import_json(class_id, class_save_path(class_id))
+        else:
+            exam_id = self.current_exams[class_id] = row[0]
+        return exam_id
+
+    def _seat_id(self, class_id, seat_no):
+        key = (class_id, seat_no)
+        seat_id = self.seat_ids.get(key)
+        if seat_id is None:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO seat (class_id, seat_no) VALUES (?, ?)", key
+            )
+            seat_id = self.seat_ids[key] = self.conn.execute(
+                "SELECT id FROM seat WHERE class_id = ? AND seat_no = ?", key
+            ).fetchone()[0]
+        return seat_id
+
+    def _write_scores(self, exam_id, class_id, numbers_dict):
+        """Upsert the scores of an exam; a None value clears the seat (deletes its row)"""
+        rows = [(exam_id, self._seat_id(class_id, key), value) for key, value in numbers_dict.items()]
+        self.conn.executemany(self.UPSERT_SCORE, [row for row in rows if row[2] is not None])
+        self.conn.executemany(
+            "DELETE FROM score WHERE exam_id = ? AND seat_id = ?", [row[:2] for row in rows if row[2] is None]
+        )
+
+    def import_json(self, class_id, json_path):
+        """Migrate an existing numbers_dict JSON file (snapshot + entry log) into the current exam"""
+        if not os.path.exists(json_path):
+            return False
+        numbers_dict = read_journal(json_path, json_path + ".log")
+        if not numbers_dict:
+            return False
+        with self.lock, self.conn:
+            self._write_scores(self._ensure_class(class_id), class_id, numbers_dict)
+        return True
+
+    def _data_version(self):
+        """Changes whenever another connection commits to the database"""
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def load(self, class_id):
+        with self.lock:
+            exam_id = self._ensure_class(class_id)
+            version = self._data_version()
+            scores = dict(self.conn.execute(
+                "SELECT seat.seat_no, score.value FROM score JOIN seat ON seat.id = score.seat_id"
+                " WHERE score.exam_id = ?", (exam_id,)
+            ).fetchall())
+            self.seen[class_id] = [dict(scores), version]
+        return scores
+
+    def replace(self, class_id, numbers_dict):
+        with self.lock, self.conn:
+            exam_id = self._ensure_class(class_id)
+            self.conn.execute("DELETE FROM score WHERE exam_id = ?", (exam_id,))
+            self._write_scores(exam_id, class_id, numbers_dict)
+            if class_id in self.seen:
+                self.seen[class_id][0] = dict(numbers_dict)
+
+    def append(self, class_id, key, value):
+        self.append_many(class_id, [(key, value)])
+
+    def append_many(self, class_id, entries):
+        entries = dict(entries)
+        with locked(self.lock), self.conn:
+            self._write_scores(self._ensure_class(class_id), class_id, entries)
+            if class_id in self.seen:
+                self.seen[class_id][0].update(entries)
+
+    def has_external_changes(self, class_id):
+        with self.lock:
+            return class_id in self.seen and self._data_version() != self.seen[class_id][1]
+
+    def external_changes(self, class_id):
+        """{seat: value} other processes changed since this one last read or wrote the class"""
+        with self.lock:
+            if not self.has_external_changes(class_id):
+                return {}
+            seen = self.seen[class_id][0]
+            scores = self.load(class_id)
+        return {k: scores.get(k) for k in set(seen) | set(scores) if seen.get(k) != scores.get(k)}
+
+    def archive_exam(self, class_id, title, numbers_dict):
+        """Store an uploaded exam as a history row; returns its exam id"""
+        with self.lock, self.conn:
+            self._ensure_class(class_id)
+            exam_id = self.conn.execute(
+                "INSERT INTO exam (class_id, title, created_at) VALUES (?, ?, ?)",
+                (class_id, title, time.time())
+            ).lastrowid
+            self._write_scores(exam_id, class_id, numbers_dict)
+        return exam_id
+
+    def list_exams(self, class_id):
+        """Archived exams of a class as (exam_id, title, created_at), oldest first"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT id, title, created_at FROM exam WHERE class_id = ? AND is_current = 0"
+                " ORDER BY created_at", (class_id,)
+            ).fetchall()
+
+    def exam_scores(self, exam_id):
+        """All scores of one exam as {seat_no: value}"""
+        with self.lock:
+            return dict(self.conn.execute(
+                "SELECT seat.seat_no, score.value FROM score JOIN seat ON seat.id = score.seat_id"
+                " WHERE score.exam_id = ?", (exam_id,)
+            ).fetchall())
+
+    def seat_history(self, class_id, seat_no):
+        """Archived scores of one seat as (title, created_at, value), oldest first"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT exam.title, exam.created_at, score.value FROM seat"
+                " JOIN score ON score.seat_id = seat.id"
+                " JOIN exam ON exam.id = score.exam_id"
+                " WHERE seat.class_id = ? AND seat.seat_no = ? AND exam.is_current = 0"
+                " ORDER BY exam.created_at", (class_id, seat_no)
+            ).fetchall()
+
+@functools.lru_cache(maxsize=None)
+def get_storage(backend=STORAGE_BACKEND):
+    """Storage backend shared by every session (SCORE_STORAGE=sqlite selects SQLite)"""
+    if backend == "sqlite":
+        return SQLiteStorage(SQLITE_PATH)
+    return JournalStorage()
+
+@timed("storage.load_dict")
+def load_dict(class_id=DEFAULT_CLASS):
+    """Load a class's stored dictionary; None if nothing is stored, StorageLoadError if it cannot be read"""
+    try:
+        return get_storage().load(class_id)
+    except Exception as e:
+        raise StorageLoadError(f"{class_id}: {e}") from e
+
+@timed("storage.save_dict")
+def save_dict(numbers_dict, class_id=DEFAULT_CLASS):
+    """Replace a class's stored dictionary"""
+    try:
+        get_storage().replace(class_id, numbers_dict)
+        return True
+    except Exception:
+        return False
+
+@timed("storage.save_entry")
+def save_entry(key, value, class_id=DEFAULT_CLASS):
+    """Store a single entry"""
+    try:
+        get_storage().append(class_id, key, value)
+        return True
+    except Exception:
+        return False
+
+@timed("storage.save_entries")
+def save_entries(entries, class_id=DEFAULT_CLASS):
+    """Store several (key, value) entries in one write"""
+    try:
+        get_storage().append_many(class_id, list(entries))
+        return True
+    except Exception:
+        return False
+
+def has_external_changes(class_id):
+    """Whether another process (e.g. a CLI run) may have stored scores for a class since this one looked"""
+    try:
+        return get_storage().has_external_changes(class_id)
+    except Exception:
+        return False
+
+def external_changes(class_id):
+    """{seat: value} other processes stored for a class since the last call"""
+    try:
+        return get_storage().external_changes(class_id)
+    except Exception:
+        return {}
+
+def load_class_dict(class_id):
+    """Load a class's stored scores, keeping only seats on its roster
+
+    An empty store is initialized; a store that fails to load raises StorageLoadError and is left alone.
+    """
+    roster = get_roster(class_id)
+    numbers_dict = initialize_dict(roster.seats)
+    loaded_dict = load_dict(class_id)
+    if loaded_dict is not None:
+        numbers_dict.update((k, v) for k, v in loaded_dict.items() if k in roster.seat_set)
+    else:
+        save_dict(numbers_dict, class_id)
+    return numbers_dict
@@ -0,0 +1,166 @@
+"""Local records of remote sheet state: where each class's exam was uploaded in each target
+and which seats changed since"""
+
+import contextlib
+import functools
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: no lock between processes, only between threads
+    fcntl = None
+
+SYNC_STATE_PATH = "sync_state.json"
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Exclusive lock on `path` held against other processes (e.g. the CLI run from cron next to the app)"""
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+class JsonStateFile:
+    """Small JSON document rewritten atomically on every change.
+
+    The file is shared with other processes: it is read again whenever it changed on disk,
+    and every change is made under a lock file (`<path>.lock`) on a freshly read copy, so
+    one process never overwrites the records another one wrote.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.states = None
+        self.stamp = None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def _load(self):
+        stamp = self._stat()
+        if self.states is None or stamp != self.stamp:
+            self.states = {}
+            if stamp is not None:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self.states = json.load(f)
+                except Exception:
+                    self.states = {}
+            self.stamp = stamp
+        return self.states
+
+    @contextlib.contextmanager
+    def _writing(self):
+        """Hold the thread and process locks for a read-modify-write; yields the current document"""
+        with self.lock, file_lock(self.path + ".lock"):
+            yield self._load()
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.states, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.stamp = self._stat()
+
+class SyncStateStore(JsonStateFile):
+    """Remote column of each class's current exam in each upload target, plus the values last written there.
+
+    States are keyed "<class>@<spreadsheet>/<worksheet>"; a state keyed by the bare class id
+    comes from before multiple targets and stands for the first sheet of its spreadsheet.
+    A seat is dirty when its current score differs from the value last synced, so the
+    dirty set survives restarts without a separate log.
+    """
+
+    @staticmethod
+    def key(class_id, spreadsheet_id, worksheet=None):
+        return f"{class_id}@{spreadsheet_id}/{worksheet or ''}"
+
+    def get(self, key):
+        """Sync state: spreadsheet_id, worksheet, target_name, column, title, seats and synced {seat: value}; None if never uploaded"""
+        with self.lock:
+            state = self._load().get(key)
+            if state is None:
+                return None
+            return dict(state, synced={int(k): v for k, v in state["synced"].items()})
+
+    def _class_keys(self, class_id):
+        return [key for key in self._load() if key == class_id or key.startswith(class_id + "@")]
+
+    def for_class(self, class_id):
+        """{key: sync state} of every target the class's current exam was uploaded to"""
+        with self.lock:
+            keys = self._class_keys(class_id)
+        states = {key: self.get(key) for key in keys}
+        return {key: state for key, state in states.items() if state is not None}
+
+    def record_upload(self, class_id, spreadsheet_id, column, title, seats, numbers_dict, worksheet=None,
+                      target_name=None):
+        """Remember the column a full upload wrote to; everything uploaded is now in sync
+
+        Columns of the class holding another exam are forgotten, so a later sync can never
+        write this exam's scores into them.
+        """
+        key = self.key(class_id, spreadsheet_id, worksheet)
+        with self._writing() as states:
+            for other in self._class_keys(class_id):
+                state = states[other]
+                legacy = other == class_id and state["spreadsheet_id"] == spreadsheet_id and not worksheet
+                if state["title"] != title or legacy:
+                    del states[other]
+            states[key] = {
+                "spreadsheet_id": spreadsheet_id,
+                "worksheet": worksheet,
+                "target_name": target_name,
+                "column": column,
+                "title": title,
+                "seats": list(seats),
+                "synced": {str(k): numbers_dict.get(k) for k in seats},
+            }
+            self._save()
+        return key
+
+    def mark_synced(self, key, entries):
+        """Record that these {seat: value} entries were written to the remote column"""
+        with self._writing() as states:
+            state = states.get(key)
+            if state is None:
+                return
+            state["synced"].update((str(k), v) for k, v in entries.items())
+            self._save()
+
+    def forget(self, class_id):
+        """Drop a class's sync states (e.g. when its scores are cleared for a new exam)"""
+        with self._writing() as states:
+            keys = self._class_keys(class_id)
+            for key in keys:
+                del states[key]
+            if keys:
+                self._save()
+
+    def dirty_seats(self, class_id, numbers_dict):
+        """{seat: value} for seats of the uploaded columns whose score changed since the last sync"""
+        dirty = {}
+        for state in self.for_class(class_id).values():
+            synced = state["synced"]
+            dirty.update(
+                (k, numbers_dict.get(k)) for k in state["seats"] if numbers_dict.get(k) != synced.get(k)
+            )
+        return dirty
+
+@functools.lru_cache(maxsize=None)
+def get_sync_state(path=SYNC_STATE_PATH):
+    """Sync state store shared by the whole process"""
+    return SyncStateStore(path)
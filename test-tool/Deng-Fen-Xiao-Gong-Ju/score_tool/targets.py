@@ -0,0 +1,69 @@
+"""Upload targets: the spreadsheets (and worksheets) each exam column is written to"""
+
+import functools
+import json
+import os
+
+from .rosters import DEFAULT_CLASS, get_class_ids
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXED_SPREADSHEET_ID = "10vZcrrYPBPm4kAvsOoHusaAH8bCPKjvk4qjHjZNFNC8"
+
+# upload_targets.json: a list of {"name", "spreadsheet_id", "worksheet", "classes"}; "worksheet"
+# defaults to the first sheet and "classes" (a list of class ids) to every class.
+# Without the file every class uploads to its own worksheet of FIXED_SPREADSHEET_ID (see default_target).
+TARGETS_PATH = os.environ.get("SCORE_UPLOAD_TARGETS", os.path.join(APP_DIR, "upload_targets.json"))
+
+class UploadTarget:
+    """One place an exam column goes: a spreadsheet and a worksheet in it (None = the first sheet)"""
+
+    def __init__(self, name, spreadsheet_id, worksheet=None, classes=None):
+        self.name = name
+        self.spreadsheet_id = spreadsheet_id
+        self.worksheet = worksheet or None
+        self.classes = frozenset(classes) if classes else None
+
+    @property
+    def label(self):
+        return f"{self.name}（{self.worksheet}）" if self.worksheet and self.worksheet != self.name else self.name
+
+    def applies_to(self, class_id):
+        return self.classes is None or class_id in self.classes
+
+def default_target(class_id):
+    """Target of a class when no targets are configured: the default class keeps the first sheet of
+    FIXED_SPREADSHEET_ID, as before, and every other class gets a worksheet named after it, so
+    classes with different rosters never share one seat column"""
+    if class_id == DEFAULT_CLASS:
+        return UploadTarget("成績記錄", FIXED_SPREADSHEET_ID)
+    return UploadTarget(class_id, FIXED_SPREADSHEET_ID, class_id)
+
+@functools.lru_cache(maxsize=4)
+def load_targets(path=TARGETS_PATH, mtime=None):
+    """Parse the targets file (cached until it changes)"""
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    return tuple(
+        UploadTarget(
+            entry.get("name") or entry.get("worksheet") or entry["spreadsheet_id"],
+            entry["spreadsheet_id"],
+            entry.get("worksheet"),
+            [str(class_id) for class_id in entry.get("classes") or []]
+        )
+        for entry in entries
+    )
+
+def get_upload_targets(class_id=None):
+    """Configured targets, only those that take `class_id` when given (default_target without a configuration)"""
+    targets = None
+    if os.path.exists(TARGETS_PATH):
+        targets = load_targets(TARGETS_PATH, os.path.getmtime(TARGETS_PATH))
+    if not targets:
+        # The default class first, so its (first) sheet stays the one picked when no name is given
+        class_ids = [class_id] if class_id is not None else sorted(
+            set(get_class_ids()) | {DEFAULT_CLASS}, key=lambda class_id: (class_id != DEFAULT_CLASS, class_id)
+        )
+        return [default_target(class_id) for class_id in class_ids]
+    if class_id is None:
+        return list(targets)
+    return [target for target in targets if target.applies_to(class_id)]